@@ -0,0 +1,116 @@
+import json
+import os
+import subprocess
+import threading
+from statistics import mean
+from tempfile import mkdtemp
+from time import perf_counter
+
+from sqlalchemy import event, insert
+from werkzeug.security import generate_password_hash
+
+from wargame import create_app
+from wargame.db import db
+from wargame.models import Game, Team, User
+from wargame.scenarios import new_board_state
+from wargame.utils import entity_types
+
+password = 'benchmark'
+
+
+def make_app(**config):
+    """An app with its own SQLite database in a temporary directory and no background scheduler."""
+    path = mkdtemp(prefix='wargame-benchmark-')
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(path, 'benchmark.db')}",
+        'EVENT_BROKER_PATH': os.path.join(path, 'events'),
+        'SCHEDULER': 'off',
+        'TESTING': True,
+        **config,
+    })
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def create_users(count, prefix='player'):
+    """Create users sharing a single password hash, hashing is far too slow to do it for every one of them."""
+    hashed = generate_password_hash(password)
+    usernames = [f'{prefix}{index}' for index in range(count)]
+    db.session.execute(insert(User), [{'username': username, 'password': hashed, 'active': True} for username in usernames])
+    db.session.commit()
+    users = {user.username: user for user in User.query.filter(User.username.in_(usernames))}
+    return [users[username] for username in usernames]
+
+
+def create_game(owner, players, description='benchmark'):
+    """Create a game with `players[:5]` as the red and `players[5:10]` as the blue team."""
+    teams = list()
+    for name, team_players in (('Red', players[:5]), ('Blue', players[5:10])):
+        team = Team()
+        team.name = name
+        for entity_type, player in zip(entity_types, team_players):
+            setattr(team, entity_type + '_player', player)
+        teams.append(team)
+    game = Game(owner=owner, red_team=teams[0], blue_team=teams[1], description=description, board_state=new_board_state())
+    db.session.add(game)
+    db.session.commit()
+    return game
+
+
+class QueryCounter:
+    """Counts the SQL statements executed by each thread."""
+
+    def __init__(self, engine):
+        self._local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def summarize(seconds, queries=None):
+    summary = {
+        'count': len(seconds),
+        'mean_ms': mean(seconds) * 1000,
+        'p50_ms': percentile(seconds, 0.5) * 1000,
+        'p95_ms': percentile(seconds, 0.95) * 1000,
+        'p99_ms': percentile(seconds, 0.99) * 1000,
+    }
+    if queries is not None:
+        summary['queries_per_call'] = mean(queries)
+    return summary
+
+
+def measure(function, repeat):
+    """Call `function` `repeat` times and return the timings of each call."""
+    timings = list()
+    for _ in range(repeat):
+        started = perf_counter()
+        function()
+        timings.append(perf_counter() - started)
+    return timings
+
+
+def commit_hash():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_report(report, output):
+    report = {'commit': commit_hash(), **report}
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,131 @@
+"""Load generator playing concurrent games with scripted players through the web endpoints.
+
+Every player runs in its own thread and behaves like board.js: it loads the board, polls the time left and the
+board state, and submits its turn with the board form once its team is on turn.
+
+    python -m benchmarks.load --games 5 --turns 6 --output load.json
+"""
+import argparse
+import threading
+from collections import defaultdict
+from random import Random
+from time import perf_counter, sleep
+
+from wargame.db import db
+from wargame.utils import calculate_max_revitalization
+
+from .common import QueryCounter, create_game, create_users, make_app, password, save_report, summarize
+
+
+class Recorder:
+    def __init__(self, counter):
+        self.counter = counter
+        self.timings = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def request(self, name, method, *args, expected=(200, 302, 304), **kwargs):
+        before = self.counter.count
+        started = perf_counter()
+        response = method(*args, **kwargs)
+        elapsed = perf_counter() - started
+        with self._lock:
+            self.timings[name].append(elapsed)
+            self.queries[name].append(self.counter.count - before)
+            if response.status_code not in expected:
+                self.errors[name] += 1
+        return response
+
+
+def turn_form(state, rng):
+    """Fill in the board form for the entities the player can act on, the way a player would."""
+    form = {'turn': state['turn']}
+    for entity_id in state['viewer']['activeEntities']:
+        entity = state['board']['teams'][state['currentTeam']]['entities'][entity_id]
+        resource = max(entity['resource'], 0)
+        action = rng.choice(['none', 'revitalize'] + ['attack'] * bool(entity.get('attacks')) + ['transfer'] * bool(entity.get('connections')))
+        form[entity_id + '__action'] = action
+        if action == 'revitalize':
+            form[entity_id + '__revitalize'] = rng.randint(0, calculate_max_revitalization(resource))
+        elif action == 'attack':
+            form[f"{entity_id}-{entity['attacks'][0]}__attack"] = rng.randint(0, min(resource, 6))
+        elif action == 'transfer':
+            form[f"{entity_id}-{entity['connections'][0]}__transfer"] = rng.randint(0, min(resource, 5))
+    return form
+
+
+def play(app, recorder, username, game_id, turns, poll_interval, seed):
+    rng = Random(seed)
+    client = app.test_client()
+    recorder.request('POST /auth/login', client.post, '/auth/login', data={'username': username, 'password': password})
+    recorder.request('GET /game/board', client.get, f'/game/{game_id}/board')
+
+    submitted = None
+    while True:
+        timer = recorder.request('GET /game/time_left', client.get, f'/game/{game_id}/time_left').get_json()
+        if timer['turn'] >= turns:
+            break
+        state = recorder.request('GET /api/game/state', client.get, f'/api/game/{game_id}/state').get_json()
+        if state['victor']:
+            break
+        if state['viewer']['activeEntities'] and submitted != state['turn']:
+            recorder.request('POST /game/board', client.post, f'/game/{game_id}/board', data=turn_form(state, rng))
+            recorder.request('GET /game/board', client.get, f'/game/{game_id}/board')
+            submitted = state['turn']
+        sleep(poll_interval)
+    recorder.request('GET /game/log', client.get, f'/game/{game_id}/log')
+
+
+def run(games, turns, poll_interval, seed):
+    app = make_app()
+    with app.app_context():
+        counter = QueryCounter(db.engine)
+        owner, *players = create_users(1 + 10 * games)
+        game_players = [players[index * 10:(index + 1) * 10] for index in range(games)]
+        game_ids = [create_game(owner, team_players).id for team_players in game_players]
+        usernames = [[player.username for player in team_players] for team_players in game_players]
+
+    recorder = Recorder(counter)
+    threads = [
+        threading.Thread(target=play, args=(app, recorder, username, game_id, turns, poll_interval, seed + index))
+        for game_id, game_usernames in zip(game_ids, usernames)
+        for index, username in enumerate(game_usernames)
+    ]
+    started = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - started
+
+    requests = sum(len(timings) for timings in recorder.timings.values())
+    all_timings = [timing for timings in recorder.timings.values() for timing in timings]
+    all_queries = [count for counts in recorder.queries.values() for count in counts]
+    return {
+        'games': games,
+        'players': len(threads),
+        'turns': turns,
+        'poll_interval': poll_interval,
+        'seconds': elapsed,
+        'requests': requests,
+        'requests_per_second': requests / elapsed,
+        'errors': dict(recorder.errors),
+        'overall': summarize(all_timings, all_queries),
+        'endpoints': {name: summarize(timings, recorder.queries[name]) for name, timings in sorted(recorder.timings.items())},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=5, help='Number of concurrent games, each with 10 players.')
+    parser.add_argument('--turns', type=int, default=6, help='Number of turns to play in every game.')
+    parser.add_argument('--poll-interval', type=float, default=0.25, help='Seconds between the polls of a player.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the scripted players.')
+    parser.add_argument('--output', help='Write the report to this JSON file.')
+    args = parser.parse_args()
+    save_report(run(args.games, args.turns, args.poll_interval, args.seed), args.output)
+
+
+if __name__ == '__main__':
+    main()
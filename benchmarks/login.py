@@ -0,0 +1,79 @@
+"""Login storm - a classroom of players logging in at the same moment, then polling the game like the board page.
+
+Every player runs in its own thread. The logins wait on a barrier so they all hit the password hashing together,
+and the polls are measured once with the per-worker user cache and once without it.
+
+    python -m benchmarks.login --users 60 --hash-workers 2 --output login.json
+"""
+import argparse
+import threading
+from collections import defaultdict
+from time import perf_counter
+
+from wargame.db import db
+
+from .common import QueryCounter, create_game, create_users, make_app, password, save_report, summarize
+
+
+def storm(app, counter, usernames, game_id, polls):
+    timings, queries = defaultdict(list), defaultdict(list)
+    lock = threading.Lock()
+    barrier = threading.Barrier(len(usernames))
+
+    def timed(name, function):
+        before = counter.count
+        started = perf_counter()
+        response = function()
+        elapsed = perf_counter() - started
+        with lock:
+            timings[name].append(elapsed)
+            queries[name].append(counter.count - before)
+        return response
+
+    def player(username):
+        client = app.test_client()
+        barrier.wait()
+        response = timed('POST /auth/login', lambda: client.post('/auth/login', data={'username': username, 'password': password}))
+        assert response.status_code == 302, response.status_code
+        for _ in range(polls):
+            timed('GET /game/time_left', lambda: client.get(f'/game/{game_id}/time_left'))
+
+    threads = [threading.Thread(target=player, args=(username,)) for username in usernames]
+    started = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - started
+    return {
+        'seconds': elapsed,
+        'logins_per_second': len(usernames) / elapsed,
+        'endpoints': {name: summarize(timings[name], queries[name]) for name in sorted(timings)},
+    }
+
+
+def run(users, hash_workers, polls):
+    results = dict()
+    for user_cache_size in (1024, 0):
+        app = make_app(PASSWORD_HASH_WORKERS=hash_workers, USER_CACHE_SIZE=user_cache_size)
+        with app.app_context():
+            counter = QueryCounter(db.engine)
+            owner, *players = create_users(max(users, 10))
+            game_id = create_game(owner, players[:10]).id
+            usernames = [player.username for player in players[:users]]
+        results['user cache' if user_cache_size else 'no user cache'] = storm(app, counter, usernames, game_id, polls)
+    return {'users': users, 'hash_workers': hash_workers, 'polls': polls, 'runs': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=60, help='Number of players logging in at once.')
+    parser.add_argument('--hash-workers', type=int, default=2, help='Size of the password hashing pool.')
+    parser.add_argument('--polls', type=int, default=20, help='Timer polls per player after logging in.')
+    parser.add_argument('--output', help='Write the report to this JSON file.')
+    args = parser.parse_args()
+    save_report(run(args.users, args.hash_workers, args.polls), args.output)
+
+
+if __name__ == '__main__':
+    main()
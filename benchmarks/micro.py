@@ -0,0 +1,116 @@
+"""Micro-benchmarks of the rules, the render path and the hot database queries.
+
+    python -m benchmarks.micro --output micro.json
+"""
+import argparse
+from random import Random
+
+from flask import render_template
+from flask_login import login_user
+
+from wargame.db import db
+from wargame.engine import Engine
+from wargame.inputs import TurnInputs
+from wargame.models import Game
+from wargame.odds import estimate_odds
+from wargame.scenarios import copy_state, new_board_state
+from wargame.simulation import play_game, random_policy
+from wargame.snapshots import diff
+from wargame.utils import current_team
+
+from .common import QueryCounter, create_game, create_users, make_app, measure, password, save_report, summarize
+
+
+def mid_game_state(turns=8, seed=0):
+    rng = Random(seed)
+    board_state = new_board_state()
+    engine = Engine(board_state, rng=rng)
+    engine.setup()
+    for _ in range(turns):
+        team = current_team(board_state['turn'])
+        engine.resolve_turn(random_policy(board_state, team, rng))
+    return board_state
+
+
+def rule_benchmarks(repeat):
+    board_state = mid_game_state()
+    rng = Random(1)
+    team = current_team(board_state['turn'])
+    inputs = random_policy(board_state, team, rng)
+    form = {'turn': board_state['turn'], 'rus_gov__action': 'transfer', 'rus_gov-bear__transfer': '2', 'bear__action': 'attack',
+            'bear-plc__attack': '3', 'bm-bid-0': '1', 'activated-assets': '0', 'option-0': 'gchq'}
+    later_state = copy_state(board_state)
+    Engine(later_state, rng=Random(2)).resolve_turn(inputs)
+
+    def resolve_turn():
+        Engine(copy_state(board_state), rng=Random(3)).resolve_turn(inputs)
+
+    def resolve_idle_turn():
+        Engine(copy_state(board_state), rng=Random(3)).resolve_turn(TurnInputs())
+
+    return {
+        'engine.resolve_turn': summarize(measure(resolve_turn, repeat)),
+        'engine.resolve_turn (no orders)': summarize(measure(resolve_idle_turn, repeat)),
+        'simulation.play_game': summarize(measure(lambda: play_game(rng.randrange(2 ** 32)), max(repeat // 20, 5))),
+        'inputs.from_form': summarize(measure(lambda: TurnInputs.from_form(form), repeat)),
+        'scenarios.copy_state': summarize(measure(lambda: copy_state(board_state), repeat)),
+        'snapshots.diff': summarize(measure(lambda: diff(board_state, later_state), repeat)),
+        'odds.estimate_odds': summarize(measure(lambda: estimate_odds(board_state, rollouts=2048, seed=0), max(repeat // 20, 5))),
+    }
+
+
+def app_benchmarks(repeat):
+    app = make_app()
+    with app.app_context():
+        counter = QueryCounter(db.engine)
+        owner, *players = create_users(11)
+        game = create_game(owner, players)
+        for _ in range(20):
+            create_game(owner, players)
+        game_id = game.id
+        viewer = players[0]
+
+        def timed(function, repeat):
+            timings, queries = list(), list()
+            for _ in range(repeat):
+                before = counter.count
+                timings.extend(measure(function, 1))
+                queries.append(counter.count - before)
+                db.session.remove()
+            return summarize(timings, queries)
+
+        def render_board():
+            with app.test_request_context(f'/game/{game_id}/board'):
+                login_user(db.session.merge(viewer))
+                render_template('board.html', context=Game.load(game_id, players=True))
+
+        def process_turn():
+            game = db.session.get(Game, game_id)
+            game.process_turn(timeout=True)
+            db.session.rollback()
+
+        render_board()
+        results = {
+            'render board (warm)': timed(render_board, repeat),
+            'Game.process_turn': timed(process_turn, repeat),
+            'User.games_page': timed(lambda: db.session.merge(owner).games_page().items, repeat),
+        }
+        store, app.jinja_env.fragment_store = app.jinja_env.fragment_store, None
+        results['render board (no fragment cache)'] = timed(render_board, repeat)
+        app.jinja_env.fragment_store = store
+
+        user = db.session.merge(viewer)
+        results['User.verify_password'] = timed(lambda: user.verify_password(password), max(repeat // 20, 5))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200, help='Number of calls per benchmark.')
+    parser.add_argument('--output', help='Write the report to this JSON file.')
+    args = parser.parse_args()
+    save_report({'benchmarks': {**rule_benchmarks(args.repeat), **app_benchmarks(args.repeat)}}, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Spectators - a room of observers watching one game while the owner pauses and resumes it every few polls.
+
+Every observer polls like the spectator page does, revalidating its copy with `If-None-Match`. The same room is
+measured watching through the logged in board page, through the spectator view and through the spectator view
+without its page cache, reporting the CPU time the server spent per poll.
+
+    python -m benchmarks.spectators --spectators 100 --rounds 20 --output spectators.json
+"""
+import argparse
+from time import perf_counter, process_time
+
+from wargame.db import db
+
+from .common import QueryCounter, create_game, create_users, make_app, password, save_report, summarize
+
+
+def watch(counter, url, clients, rounds, change_every, owner):
+    etags = [None] * len(clients)
+    timings, queries, statuses = list(), list(), dict()
+    started, cpu_started = perf_counter(), process_time()
+    for round_number in range(rounds):
+        if round_number and round_number % change_every == 0:
+            assert owner.get(url['toggle']).status_code == 200
+        for index, client in enumerate(clients):
+            before = counter.count
+            poll_started = perf_counter()
+            response = client.get(url['view'], headers={'If-None-Match': etags[index]} if etags[index] else {})
+            timings.append(perf_counter() - poll_started)
+            queries.append(counter.count - before)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            etags[index] = response.headers.get('ETag')
+    cpu = process_time() - cpu_started
+    return {
+        'seconds': perf_counter() - started,
+        'cpu_ms_per_poll': cpu / len(timings) * 1000,
+        'statuses': statuses,
+        'polls': summarize(timings, queries),
+    }
+
+
+def run(spectators, rounds, change_every):
+    results = dict()
+    for name, config in (('board', {}), ('spectator', {}), ('spectator without page cache', {'SPECTATOR_CACHE_SIZE': 0})):
+        app = make_app(**config)
+        with app.app_context():
+            counter = QueryCounter(db.engine)
+            owner, *players = create_users(11)
+            game = create_game(owner, players)
+            url = {'toggle': f'/game/{game.id}/toggle_pause'}
+            url['view'] = f'/spectate/{game.spectator_token}' if name.startswith('spectator') else f'/game/{game.id}/board'
+            owner_name = owner.username
+        owner_client = app.test_client()
+        assert owner_client.post('/auth/login', data={'username': owner_name, 'password': password}).status_code == 302
+        # the board needs a login, so there every observer watches as the owner
+        clients = [owner_client] * spectators if name == 'board' else [app.test_client() for _ in range(spectators)]
+        results[name] = watch(counter, url, clients, rounds, change_every, owner_client)
+    return {'spectators': spectators, 'rounds': rounds, 'change_every': change_every, 'runs': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--spectators', type=int, default=100, help='Number of observers watching the game.')
+    parser.add_argument('--rounds', type=int, default=20, help='Polls per observer.')
+    parser.add_argument('--change-every', type=int, default=5, help='Rounds between changes to the game.')
+    parser.add_argument('--output', help='Write the report to this JSON file.')
+    args = parser.parse_args()
+    save_report(run(args.spectators, args.rounds, args.change_every), args.output)
+
+
+if __name__ == '__main__':
+    main()
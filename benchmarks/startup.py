@@ -0,0 +1,108 @@
+"""Startup benchmarks - importing the package, building the app, serving the first request and booting a worker.
+
+Every measurement runs in a fresh interpreter, so nothing is cached in memory between runs. Worker boot is measured
+from the fork to the first response served, once from a master that preloaded the app like `gunicorn --preload`
+and once from a master that did not, where every worker builds the app itself.
+
+    python -m benchmarks.startup --repeat 10 --output startup.json
+"""
+import argparse
+import os
+import subprocess
+import sys
+from tempfile import mkdtemp
+
+from .common import save_report, summarize
+
+first_request = """
+client = app.test_client()
+assert client.get('/auth/login').status_code == 200
+"""
+
+scenarios = {
+    'import wargame': """
+started = perf_counter()
+import wargame
+""",
+    'create_app': """
+started = perf_counter()
+import wargame
+app = wargame.create_app()
+""",
+    'create_app + create_all (what every import used to do)': """
+started = perf_counter()
+import wargame
+from wargame.db import db
+app = wargame.create_app()
+with app.app_context():
+    db.create_all()
+    db.session.commit()
+""",
+    'first request (no bytecode cache)': """
+os.environ['WARGAME_JINJA_CACHE_PATH'] = ''
+started = perf_counter()
+import wargame
+app = wargame.create_app()
+""" + first_request,
+    'first request (bytecode cache)': """
+started = perf_counter()
+import wargame
+app = wargame.create_app()
+""" + first_request,
+    'worker boot (preloaded master)': """
+import wargame
+from wargame.db import dispose_engines
+app = wargame.create_app()
+wargame.precompile_templates(app)
+started = perf_counter()
+if os.fork() != 0:
+    os.wait()
+    os._exit(0)
+dispose_engines(app)
+""" + first_request,
+    'worker boot (no preload)': """
+started = perf_counter()
+if os.fork() != 0:
+    os.wait()
+    os._exit(0)
+import wargame
+app = wargame.create_app()
+""" + first_request,
+}
+
+
+def run_scenario(code, env):
+    script = 'import os\nfrom time import perf_counter\n' + code + '\nprint(perf_counter() - started)\n'
+    result = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True, check=True)
+    return float(result.stdout.split()[-1])
+
+
+def run(repeat):
+    path = mkdtemp(prefix='wargame-benchmark-')
+    env = dict(
+        os.environ,
+        WARGAME_DATABASE_URI=f"sqlite:///{os.path.join(path, 'benchmark.db')}",
+        WARGAME_JINJA_CACHE_PATH=os.path.join(path, 'jinja'),
+        WARGAME_EVENT_BROKER_PATH=os.path.join(path, 'events'),
+        WARGAME_SECRET_KEY='benchmark',
+        WARGAME_SCHEDULER='off',
+        FLASK_APP='wargame',
+    )
+    for command in ('init-db', 'compile-templates'):
+        subprocess.run([sys.executable, '-m', 'flask', command], env=env, capture_output=True, check=True)
+    return {
+        'repeat': repeat,
+        'benchmarks': {name: summarize([run_scenario(code, env) for _ in range(repeat)]) for name, code in scenarios.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=10, help='Number of fresh interpreters per benchmark.')
+    parser.add_argument('--output', help='Write the report to this JSON file.')
+    args = parser.parse_args()
+    save_report(run(args.repeat), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+"""Gunicorn settings, picked up automatically when gunicorn is started from the repository root.
+
+The app is built once in the master process and the workers are forked from it, so they start with the modules
+imported and the templates compiled.
+"""
+import os
+
+wsgi_app = 'wargame:create_app()'
+bind = os.environ.get('WARGAME_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# the app sizes its per-worker pools from it
+os.environ.setdefault('WEB_CONCURRENCY', str(workers))
+if workers > 1:
+    # events published by one worker have to reach the streams and the scheduler of the others
+    os.environ.setdefault('WARGAME_EVENT_BROKER', 'file')
+# every open board holds a Server-Sent Events stream and with it a thread for the stream's duration, so the
+# workers get a thread for each board they may have to serve plus a few for the other requests
+worker_class = 'gthread'
+open_boards = int(os.environ.get('WARGAME_OPEN_BOARDS', 100))
+threads = int(os.environ.get('WARGAME_THREADS', -(-open_boards // workers) + 8))
+preload_app = True
+
+
+def when_ready(server):
+    from wargame import precompile_templates
+    precompile_templates(server.app.wsgi())
+
+
+def post_fork(server, worker):
+    # connections the master may have opened while preloading must not be shared between workers
+    from wargame.db import dispose_engines
+    dispose_engines(server.app.wsgi())
@@ -0,0 +1,63 @@
+import os
+
+import pytest
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+
+from wargame import create_app
+from wargame.db import db
+from wargame.models import Game, Team, User
+from wargame.scenarios import new_board_state
+from wargame.utils import entity_types
+
+
+@pytest.fixture
+def config(tmp_path):
+    """Settings keeping everything the app writes in the test's directory."""
+    return {
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(tmp_path, 'test.db')}",
+        'EVENT_BROKER_PATH': os.path.join(tmp_path, 'events'),
+        'SCHEDULER': 'off',
+        'SCHEDULER_LOCK_PATH': os.path.join(tmp_path, 'scheduler.lock'),
+        'JINJA_CACHE_PATH': '',
+        'SECRET_KEY': 'test',
+        'TESTING': True,
+    }
+
+
+@pytest.fixture
+def app(config):
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        yield app
+
+
+@pytest.fixture
+def game(app):
+    """A game on turn 2, the first turn in which the red team can attack."""
+    hashed = generate_password_hash('password', 'pbkdf2:sha256:1000')
+    db.session.execute(insert(User), [{'username': f'player{index}', 'password': hashed, 'active': True} for index in range(11)])
+    users = User.query.order_by(User.id).all()
+    teams = list()
+    for name, players in (('Red', users[:5]), ('Blue', users[5:10])):
+        team = Team()
+        team.name = name
+        for entity_type, player in zip(entity_types, players):
+            setattr(team, entity_type + '_player', player)
+        teams.append(team)
+    game = Game(owner=users[10], red_team=teams[0], blue_team=teams[1], board_state=new_board_state())
+    db.session.add(game)
+    db.session.commit()
+    for turn in (0, 1):
+        assert Game.resolve_turn(game.id, turn, timeout=True)
+    return db.session.get(Game, game.id)
+
+
+@pytest.fixture
+def login(app):
+    def login(username):
+        client = app.test_client()
+        assert client.post('/auth/login', data={'username': username, 'password': 'password'}).status_code == 302
+        return client
+    return login
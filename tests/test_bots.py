@@ -0,0 +1,33 @@
+from random import Random
+
+from wargame.bots import candidate_moves
+from wargame.db import db
+from wargame.inputs import TurnInputs
+from wargame.models import User
+from wargame.scenarios import new_board_state
+from wargame.simulation import random_policy
+
+
+def test_rollouts_play_the_orders_the_bot_submits():
+    board_state = new_board_state()
+    entity_ids = {'bear', 'scs'}
+    rng = Random(1)
+    for candidate in candidate_moves(board_state, entity_ids, rng):
+        submitted = TurnInputs.from_dict(candidate)
+        assert set(submitted.orders) == entity_ids
+        # merged like _rollouts does with the random orders of the teammates
+        evaluated = TurnInputs.merge((random_policy(board_state, 'red', rng), TurnInputs.from_dict(candidate)))
+        assert {entity_id: evaluated.orders[entity_id] for entity_id in entity_ids} == submitted.orders
+
+
+def test_bots_are_not_taken_over_by_users_with_their_name(app):
+    client = app.test_client()
+    client.post('/auth/register', data={'username': 'Bot (easy)', 'password': 'password', 'password_repeat': 'password'})
+    assert User.query.filter_by(username='Bot (easy)').first() is None
+
+    human = User('Bot (normal)', 'password')
+    db.session.add(human)
+    bot = User.bot_player('normal')
+    db.session.commit()
+    assert bot is not human and bot.bot == 'normal' and bot.username == 'Bot (normal) 2'
+    assert User.bot_player('normal') is bot
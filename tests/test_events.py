@@ -0,0 +1,42 @@
+import os
+import time
+
+from wargame.events import FileBroker, LocalBroker, stream
+
+
+def test_listeners_start_over_after_a_rotation(tmp_path):
+    broker = FileBroker(str(tmp_path), poll_interval=0.01, max_size=60)
+    broker.publish(1, 'turn', {'turn': 1})
+    broker.publish(1, 'turn', {'turn': 2})
+    cursor = broker.cursor(1)
+    broker.publish(1, 'turn', {'turn': 3})
+    assert broker.cursor(1) < cursor
+
+    messages, _ = broker.listen(1, cursor, 0.1)
+    assert [data['turn'] for _, _, data in messages] == [3]
+
+
+def test_idle_game_files_are_pruned(tmp_path):
+    broker = FileBroker(str(tmp_path), max_age=60)
+    for game_id in (1, 2, 'all'):
+        broker.publish(game_id, 'turn', {})
+    expired = time.time() - 120
+    for game_id in (1, 'all'):
+        os.utime(broker._file(game_id), (expired, expired))
+    broker.prune()
+    assert sorted(os.listdir(tmp_path)) == ['2.events', 'all.events']
+
+
+def test_stream_ignores_a_malformed_last_event_id():
+    broker = LocalBroker()
+    broker.publish(1, 'turn', {})
+    for last_event_id in ('garbage', '-3', '99'):
+        assert next(stream(broker, 1, last_event_id, duration=0)) == 'retry: 3000\n\n'
+
+
+def test_events_route_ignores_a_malformed_last_event_id(app, game, login):
+    app.config['EVENT_STREAM_DURATION'] = 0
+    client = login(game.owner.username)
+    response = client.get(f'/game/{game.id}/events', headers={'Last-Event-ID': 'garbage'})
+    assert response.status_code == 200
+    assert response.get_data(as_text=True).startswith('retry: 3000')
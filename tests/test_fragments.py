@@ -0,0 +1,27 @@
+import os
+import time
+from types import SimpleNamespace
+
+from wargame.fragments import FragmentStore, cache_path
+
+
+def test_prune_drops_expired_and_excess_files(tmp_path):
+    store = FragmentStore(path=str(tmp_path), max_age=60, max_files=2)
+    for key in ('old', 'a', 'b', 'c'):
+        store.put(key, key)
+    expired = time.time() - 120
+    os.utime(store._file('old'), (expired, expired))
+    os.utime(store._file('a'), (expired + 90, expired + 90))
+    store.prune()
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(store._file(key)) for key in ('b', 'c'))
+
+
+def test_fragments_are_namespaced_by_database_and_cleared_by_init_db(app, tmp_path):
+    app.config['FRAGMENT_CACHE_PATH'] = str(tmp_path / 'fragments')
+    store = FragmentStore(path=cache_path(app))
+    store.put('arrows:1:1', 'stale')
+    other = SimpleNamespace(config=dict(app.config, SQLALCHEMY_DATABASE_URI='sqlite://'))
+    assert cache_path(app) != cache_path(other)
+
+    app.test_cli_runner().invoke(args=['init-db'])
+    assert FragmentStore(path=cache_path(app)).get('arrows:1:1') is None
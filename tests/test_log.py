@@ -0,0 +1,18 @@
+import re
+
+from wargame.db import db
+from wargame.models import LogEntry
+
+
+def test_log_cursor_stops_at_the_last_readable_entry(game, login):
+    # an entry whose write is still buffered by write-behind, counted by log_seq but not in the table yet
+    db.session.query(LogEntry).filter_by(game_id=game.id, seq=game.log_seq).delete()
+    db.session.commit()
+    client = login(game.owner.username)
+
+    response = client.get(f'/game/{game.id}/log?after=0')
+    assert response.json['lastSeq'] == game.log_seq - 1 == response.json['entries'][-1]['seq']
+    assert client.get(f'/game/{game.id}/log?after={game.log_seq - 1}').json == {'entries': [], 'lastSeq': game.log_seq - 1}
+
+    board = client.get(f'/game/{game.id}/board').get_data(as_text=True)
+    assert re.search(r'data-last-seq="(\d+)"', board).group(1) == str(game.log_seq - 1)
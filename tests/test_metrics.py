@@ -0,0 +1,14 @@
+import pytest
+
+from wargame.models import Game
+
+
+@pytest.fixture
+def config(config):
+    return dict(config, METRICS=True)
+
+
+def test_turns_record_the_serialized_size_of_json_columns(app, game):
+    assert Game.resolve_turn(game.id, 2, timeout=True)
+    metrics = app.test_client().get('/metrics').get_data(as_text=True)
+    assert 'wargame_json_bytes_count{operation="serialize"}' in metrics
@@ -0,0 +1,27 @@
+import pytest
+
+from wargame.models import Game
+
+
+@pytest.mark.parametrize('rollouts', [-5, 0, 1])
+def test_odds_clamps_the_rollout_count(game, login, rollouts):
+    client = login(game.owner.username)
+    response = client.get(f'/game/{game.id}/odds?rollouts={rollouts}')
+    assert response.status_code == 200
+    assert response.json['rollouts'] == 1
+
+
+def test_odds_are_estimated_once_per_game_version(game, login, monkeypatch):
+    from wargame import odds
+
+    estimates = list()
+    estimate_odds = odds.estimate_odds
+    monkeypatch.setattr(odds, 'estimate_odds', lambda *args, **kwargs: estimates.append(1) or estimate_odds(*args, **kwargs))
+    clients = [login(player.username) for player in game.red_team.players]
+    for client in clients:
+        assert client.get(f'/game/{game.id}/odds').status_code == 200
+    assert len(estimates) == 1
+
+    assert Game.resolve_turn(game.id, 2, timeout=True)
+    assert clients[0].get(f'/game/{game.id}/odds').status_code == 200
+    assert len(estimates) == 2
@@ -0,0 +1,13 @@
+import pytest
+from werkzeug.security import generate_password_hash
+
+from wargame.passwords import PasswordHasher
+
+
+@pytest.mark.parametrize('method', ['pbkdf2:sha256', 'pbkdf2:sha256:1000'])
+def test_hash_made_with_the_configured_method_is_kept(method):
+    assert not PasswordHasher(method).needs_rehash(generate_password_hash('password', method))
+
+
+def test_hash_with_a_different_cost_is_rehashed():
+    assert PasswordHasher('pbkdf2:sha256').needs_rehash(generate_password_hash('password', 'pbkdf2:sha256:1000'))
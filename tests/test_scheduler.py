@@ -0,0 +1,24 @@
+import threading
+
+from sqlalchemy.exc import OperationalError
+
+from wargame.scheduler import TurnScheduler
+
+
+def test_scheduler_survives_a_failing_rescan(app):
+    scheduler = TurnScheduler(app, rescan_interval=0)
+    scheduler.retry_delay = 0.01
+    calls = list()
+
+    def rescan():
+        calls.append(1)
+        if len(calls) == 1:
+            raise OperationalError('SELECT', {}, Exception('database is locked'))
+        scheduler.stop()
+
+    scheduler.rescan = rescan
+    thread = threading.Thread(target=scheduler.run)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert len(calls) == 2
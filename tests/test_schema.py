@@ -0,0 +1,89 @@
+import json
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from wargame import create_app
+from wargame.db import db, upgrade_schema
+from wargame.models import Game, GameParticipant, User
+from wargame.scenarios import copy_state, new_board_state
+
+# the user, team and game tables as the first release created them
+legacy_schema = (
+    'CREATE TABLE user (id INTEGER NOT NULL, username VARCHAR NOT NULL, password VARCHAR NOT NULL, active BOOLEAN, '
+    'PRIMARY KEY (id), UNIQUE (username))',
+    'CREATE TABLE team (id INTEGER NOT NULL, name VARCHAR NOT NULL, government_player_id INTEGER NOT NULL, '
+    'industry_player_id INTEGER NOT NULL, people_player_id INTEGER NOT NULL, security_player_id INTEGER NOT NULL, '
+    'energy_player_id INTEGER NOT NULL, PRIMARY KEY (id))',
+    'CREATE TABLE game (id INTEGER NOT NULL, owner_id INTEGER NOT NULL, red_team_id INTEGER NOT NULL, '
+    'blue_team_id INTEGER NOT NULL, victor_id INTEGER, description VARCHAR, ready_players JSON, player_inputs JSON, '
+    'board_state JSON, history JSON, message_log JSON, unpause_time DATETIME, seconds_left INTEGER, is_paused BOOLEAN, '
+    'PRIMARY KEY (id))',
+    "INSERT INTO user (id, username, password, active) VALUES (1, 'owner', 'x', 1), (2, 'red', 'x', 1), (3, 'blue', 'x', 1)",
+    "INSERT INTO team VALUES (1, 'Red', 2, 2, 2, 2, 2), (2, 'Blue', 3, 3, 3, 3, 3)",
+    "INSERT INTO game (id, owner_id, red_team_id, blue_team_id, board_state, message_log) VALUES "
+    "(1, 1, 1, 2, '{}', '[[\"Spring has come\", \"event\"], [\"Bear hit the PLC\", \"attack-damage\"]]'), (2, 1, 1, 2, '{}', '[]')",
+)
+
+
+@pytest.fixture
+def legacy_app(config):
+    with create_engine(config['SQLALCHEMY_DATABASE_URI']).begin() as connection:
+        for statement in legacy_schema:
+            connection.execute(text(statement))
+    app = create_app(config)
+    with app.app_context():
+        yield app
+
+
+def test_init_db_adds_and_backfills_missing_columns(legacy_app):
+    result = legacy_app.test_cli_runner().invoke(args=['init-db'])
+    assert 'Added game.spectator_token.' in result.output
+
+    rows = db.session.execute(text('SELECT version, log_seq, scenario, archived, created, spectator_token FROM game')).all()
+    assert [row[:4] for row in rows] == [(1, 2, 'default', 0), (1, 0, 'default', 0)]
+    assert all(row.created is not None for row in rows)
+    assert len({row.spectator_token for row in rows}) == 2
+    assert db.session.execute(text('SELECT bot FROM user')).scalar() is None
+
+    assert upgrade_schema() == []
+
+
+def test_init_db_lists_the_players_of_existing_games(legacy_app):
+    legacy_app.test_cli_runner().invoke(args=['init-db'])
+    for user_id in (1, 2, 3):
+        assert [game.id for game in db.session.get(User, user_id).games_page().items] == [2, 1]
+    assert GameParticipant.query.filter_by(game_id=1, user_id=2, team='red', role='energy').count() == 1
+
+    upgrade_schema()
+    assert GameParticipant.query.count() == 2 * 11
+
+
+def test_init_db_moves_the_message_logs_of_existing_games(legacy_app):
+    legacy_app.test_cli_runner().invoke(args=['init-db'])
+    upgrade_schema()
+    game = db.session.get(Game, 1)
+    assert [(entry.seq, entry.message, entry.category) for entry in game.log_page()] == [
+        (1, 'Spring has come', 'event'), (2, 'Bear hit the PLC', 'attack-damage'),
+    ]
+    assert game.log_seq == 2
+    assert db.session.get(Game, 2).log_page() == []
+
+
+def test_init_db_stores_the_history_of_existing_games_as_snapshots(legacy_app):
+    states = [new_board_state()]
+    for turn in range(1, 8):
+        state = copy_state(states[-1])
+        state['turn'] = turn
+        state['teams']['red']['entities']['bear']['resource'] = turn
+        states.append(state)
+    db.session.execute(text('UPDATE game SET history = :history, board_state = :board_state WHERE id = 1'), {
+        'history': json.dumps(states[:-1]), 'board_state': json.dumps(states[-1]),
+    })
+    db.session.commit()
+
+    legacy_app.test_cli_runner().invoke(args=['init-db'])
+    upgrade_schema()
+    game = db.session.get(Game, 1)
+    assert list(game.history()) == states
+    assert game.keyframe_turns() == [0, 6]
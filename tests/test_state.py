@@ -0,0 +1,20 @@
+import re
+
+
+def test_state_carries_the_order_forms_of_the_viewer(game, login):
+    red = login('player0').get(f'/api/game/{game.id}/state?forms=1').json
+    blue = login('player5').get(f'/api/game/{game.id}/state?forms=1').json
+
+    assert red['forms']['cards'].keys() == blue['forms']['cards'].keys() == {
+        entity_id for team in game.board_state['teams'].values() for entity_id in team['entities']
+    }
+    for state in (red, blue):
+        active = {
+            entity_id for entity_id, card in state['forms']['cards'].items()
+            if re.search(r'class="card active"', card)
+        }
+        assert active == set(state['viewer']['activeEntities'])
+    assert red['viewer']['activeEntities'] and not blue['viewer']['activeEntities']
+    assert 'Finish turn' in red['forms']['orders']
+    assert blue['forms']['orders'].strip() == ''
+    assert 'forms' not in login('player0').get(f'/api/game/{game.id}/state').json
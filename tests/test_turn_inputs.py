@@ -0,0 +1,40 @@
+import pytest
+
+from wargame.db import db
+from wargame.inputs import EntityOrders, TurnInputs
+from wargame.models import Game, TurnInput
+
+
+def test_attack_investment_above_the_table_is_rejected(game, login):
+    bear_player = game.red_team.industry_player
+    client = login(bear_player.username)
+    response = client.post(f'/api/game/{game.id}/turn', json={'turn': 2, 'orders': {'bear': {'action': 'attack', 'attacks': {'plc': 9}}}})
+    assert response.status_code == 400
+    assert game.turn_inputs.count() == 0
+
+
+def test_turn_resolves_despite_a_bad_stored_input(game):
+    bear_player = game.red_team.industry_player
+    bad_inputs = {'orders': {'bear': {'action': 'attack', 'attacks': {'plc': 9}, 'transfers': {}, 'revitalize': 0}}, 'bids': {}, 'assets': []}
+    db.session.add(TurnInput(game_id=game.id, turn=2, user_id=bear_player.id, inputs=bad_inputs))
+    db.session.commit()
+    assert Game.resolve_turn(game.id, 2, timeout=True)
+    assert db.session.get(Game, game.id, populate_existing=True).board_state['turn'] == 3
+
+
+@pytest.mark.parametrize('inputs', [
+    TurnInputs(orders={'bear': EntityOrders(action='attack', attacks={'plc': 3}, revitalize=-1)}),
+    TurnInputs(orders={'bear': EntityOrders(action='attack', attacks={'plc': 100})}),
+    TurnInputs(orders={'bear': EntityOrders(action='revitalize', revitalize=100)}),
+    TurnInputs(bids={-1: 1}),
+    TurnInputs(assets={-1: ''}),
+    TurnInputs(bids={0: 100}),
+])
+def test_validate_rejects_out_of_range_inputs(game, inputs):
+    assert inputs.validate(game.board_state, game.red_team)
+
+
+def test_validate_ignores_the_fields_of_other_actions(game):
+    # the board form sends every field of the card, whichever action is chosen
+    inputs = TurnInputs(orders={'bear': EntityOrders(action='attack', attacks={'plc': 1}, transfers={}, revitalize=100)})
+    assert inputs.validate(game.board_state, game.red_team) == []
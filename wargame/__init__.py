@@ -2,39 +2,61 @@ import os
 from http import HTTPStatus
 from secrets import token_hex
 
-from flask import Flask, abort, redirect, url_for, request
+import click
+from flask import Flask, abort, current_app, redirect, url_for, request
+from flask.cli import with_appcontext
 from flask_login import LoginManager, utils as flask_utils
+from jinja2 import FileSystemBytecodeCache
 
 login_manager = LoginManager()
 login_manager.login_view = "auth.login"
 
 
-def create_app():
+def create_app(test_config=None):
+    """Build the application without touching the database - its tables are created by `flask init-db`."""
     app = Flask(__name__)
 
     basedir = os.path.abspath(os.path.dirname(__file__))
-    db_path = f'sqlite:///{os.path.join(basedir, "database.db")}'
+    if test_config:
+        app.config.update(test_config)
 
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_path
-    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-    from . import api, auth, game, utils
+    from . import analytics, api, archive, auth, bots, cache, db as database, events, export, fragments, game, metrics, passwords, replay, scheduler, simulation, spectator, utils
 
     app.register_blueprint(api.bp)
     app.register_blueprint(auth.bp)
     app.register_blueprint(game.bp)
+    app.register_blueprint(spectator.bp)
 
-    app.secret_key = get_or_create_secret_key(os.path.join(basedir, 'secret_key'))
+    app.secret_key = app.secret_key or os.environ.get('WARGAME_SECRET_KEY') or get_or_create_secret_key(os.path.join(basedir, 'secret_key'))
 
     login_manager.init_app(app)
+    # the engine is created with the JSON serializers the metrics instrument
+    metrics.init_app(app)
+    # the fragment caches are namespaced by the database
+    database.init_app(app)
+    events.init_app(app)
+    cache.init_app(app)
+    archive.init_app(app)
+    passwords.init_app(app)
+    bots.init_app(app)
+    fragments.init_app(app)
+    spectator.init_app(app)
+    init_jinja_cache(app)
 
     from .db import db
-    db.init_app(app)
     with app.app_context():
-        db.create_all()
-        db.session.commit()
+        metrics.instrument_engine(app, db.engine)
 
     app.context_processor(utils.helper_functions)
+    app.cli.add_command(database.init_db_command)
+    app.cli.add_command(compile_templates_command)
+    app.cli.add_command(simulation.simulate_command)
+    app.cli.add_command(scheduler.scheduler_command)
+    app.cli.add_command(replay.replay_command)
+    app.cli.add_command(export.export_games_command)
+    app.cli.add_command(archive.archive_games_command)
+    app.cli.add_command(analytics.rebuild_stats_command)
+    scheduler.init_app(app)
 
     return app
 
@@ -42,7 +64,7 @@ def create_app():
 @login_manager.user_loader
 def load_user(user_id):
     from .models import User
-    return User.query.filter_by(id=user_id).one_or_none()
+    return User.load(int(user_id))
 
 
 @login_manager.unauthorized_handler
@@ -64,4 +86,33 @@ def get_or_create_secret_key(path):
     return secret_key
 
 
-app = create_app()
+def init_jinja_cache(app):
+    """Keep compiled templates on disk so that new processes skip compiling them, `WARGAME_JINJA_CACHE_PATH=` disables it."""
+    app.config.setdefault('JINJA_CACHE_PATH', os.environ.get('WARGAME_JINJA_CACHE_PATH', os.path.join(app.instance_path, 'jinja')))
+    if path := app.config['JINJA_CACHE_PATH']:
+        os.makedirs(path, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(path)
+
+
+def precompile_templates(app):
+    """Compile every template up front, filling the bytecode cache and the in-memory cache forked workers inherit."""
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
+
+
+@click.command('compile-templates')
+@with_appcontext
+def compile_templates_command():
+    """Compile all templates into the Jinja bytecode cache."""
+    names = precompile_templates(current_app)
+    click.echo(f'Compiled {len(names)} templates.')
+
+
+def __getattr__(name):
+    # `wargame:app` keeps working for servers and scripts, but the app is only built when it is first asked for
+    if name == 'app':
+        app = globals()['app'] = create_app()
+        return app
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,63 @@
+from collections import Counter, defaultdict
+
+import click
+from flask.cli import with_appcontext
+
+from .db import db
+from .models import Game, StatCounter
+
+
+def summary():
+    """The dashboard figures, computed from the running totals alone so the cost does not grow with the number of games."""
+    totals = defaultdict(dict)
+    for kind, key, value in db.session.query(StatCounter.kind, StatCounter.key, StatCounter.value):
+        totals[kind][key] = value
+
+    games = totals['games'].get('finished', 0)
+    assets = defaultdict(dict)
+    for key, count in totals['assets'].items():
+        team, asset = key.split(':')
+        assets[team][asset] = count
+    attacks = defaultdict(dict)
+    for key, attempts in totals['attacks'].items():
+        entity_id, investment = key.split(':')
+        successes = totals['attack_successes'].get(key, 0)
+        attacks[entity_id][investment] = {
+            'attempts': attempts,
+            'successes': successes,
+            'backfires': totals['attack_backfires'].get(key, 0),
+            'successRate': successes / attempts,
+        }
+    return {
+        'games': games,
+        'winRate': {team: totals['wins'].get(team, 0) / games if games else 0 for team in ('red', 'blue')},
+        'averageVictoryPoints': {entity_id: vps / games for entity_id, vps in totals['entity_vps'].items()} if games else {},
+        'events': totals['events'],
+        'assets': assets,
+        'attacks': attacks,
+    }
+
+
+def rebuild(batch_size=20):
+    """Recount all totals from the stored games, replaying the seeded ones - returns the number of games counted.
+
+    Turns resolved while the rebuild runs may be counted twice or not at all, so it is best run between sessions.
+    """
+    StatCounter.query.delete()
+    tally = Counter()
+    games = 0
+    for game in Game.query.order_by(Game.id).yield_per(batch_size):
+        tally.update(game.replayed_tally())
+        games += 1
+    if tally:
+        StatCounter.increment(db.session, tally)
+    db.session.commit()
+    return games
+
+
+@click.command('rebuild-stats')
+@with_appcontext
+def rebuild_stats_command():
+    """Recount the cross-game analytics from all stored games."""
+    games = rebuild()
+    click.echo(f'Rebuilt the analytics from {games} games.')
@@ -1,11 +1,146 @@
-from flask import Blueprint
-from flask_login import login_required
+from datetime import datetime
+
+from flask import Blueprint, Response, jsonify, render_template, request, stream_with_context
+from flask_login import current_user, login_required
+
+from . import analytics, cache, export, spectator
+from .inputs import InputError, TurnInputs
+from .models import Game
+from .snapshots import diff
+from .utils import current_team, entity_controller, get_player_team, is_entity_active, total_vps, turn_to_month, waiting_for_move
 
 
 bp = Blueprint('api', __name__, url_prefix='/api')
 
+hidden_keys = ('black_market_pool',)
+
 
 @bp.route('/')
 @login_required
 def hello_world():
     return '<p>Hello, World!</p>'
+
+
+@bp.route('/cache')
+@login_required
+def cache_stats():
+    return {**cache.stats(), 'spectators': spectator.stats()}
+
+
+@bp.route('/stats')
+@login_required
+def stats():
+    """Win rates, average VPs per entity and event, asset and attack counts over all games."""
+    return analytics.summary()
+
+
+def visible_board(board_state):
+    return {key: value for key, value in board_state.items() if key not in hidden_keys}
+
+
+def seats(game, player):
+    """(team, entity, controller, whether `player` gives it orders) for every entity of the board."""
+    for team, team_state in game.board_state['teams'].items():
+        for entity_id, entity in team_state['entities'].items():
+            controller = entity_controller(getattr(game, team + '_team'), entity_id)
+            yield team, entity, controller, is_entity_active(game, controller, player, team)
+
+
+def order_forms(game, player):
+    """The cards and the order section of the board page as `player` sees them, to update the page in place."""
+    cards, has_actions, black_market_resources = dict(), False, None
+    for team, entity, controller, active in seats(game, player):
+        cards[entity['id']] = render_template('card.html', context=game, entity=entity, controller=controller, active=active)
+        has_actions = has_actions or active
+        if active and entity['id'] in ('scs', 'gchq'):
+            black_market_resources = entity['resource']
+    orders = render_template('orders.html', context=game, has_actions=has_actions, black_market_resources=black_market_resources)
+    return {'cards': cards, 'orders': orders}
+
+
+def player_state(game, player):
+    """Everything about the game that `player` may see, except for the board itself."""
+    turn = game.board_state['turn']
+    active_entities = [entity['id'] for _, entity, _, active in seats(game, player) if active]
+    return {
+        'gameId': game.id,
+        'version': game.version,
+        'turn': turn,
+        'month': turn_to_month(turn),
+        'currentTeam': current_team(turn),
+        'victoryPoints': {team: total_vps(team_state) for team, team_state in game.board_state['teams'].items()},
+        'victor': game.victor.name if game.victor else None,
+        'readyPlayers': game.ready_players,
+        'viewer': {
+            'team': get_player_team(player, game),
+            'activeEntities': active_entities,
+            'waitingForMove': waiting_for_move(game, player),
+        },
+    }
+
+
+@bp.route('/game/<int:game_id>/state')
+@login_required
+def game_state(game_id):
+    """The board as seen by the current user.
+
+    With `?since=<version>` only a JSON patch against that version's board is sent, as long as the worker still
+    has it cached - otherwise the response carries the full board. `?forms=1` adds the rendered cards and order
+    section of the board page, for the page to swap in when the entities the user gives orders to change.
+    Responses have a strong ETag, so polling clients get a 304 when nothing changed.
+    """
+    game = Game.load(game_id, players=True)
+    state = player_state(game, current_user)
+    since = request.args.get('since', type=int)
+    previous_board = game.board_state if since == game.version else cache.get_game_cache().get(game_id, since, count=False)
+    if since is not None and previous_board is not None:
+        state['since'] = since
+        state['patch'] = diff(visible_board(previous_board), visible_board(game.board_state))
+    else:
+        state['board'] = visible_board(game.board_state)
+    if request.args.get('forms') == '1':
+        state['forms'] = order_forms(game, current_user)
+
+    response = jsonify(state)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+@bp.route('/game/<int:game_id>/turn', methods=['POST'])
+@login_required
+def submit_turn(game_id):
+    """Submit the current user's turn as JSON - `{"turn": n, "orders": {...}, "bids": {...}, "assets": [...]}`."""
+    data = request.get_json(silent=True) or {}
+    try:
+        inputs = TurnInputs.from_dict({'orders': {}, **data})
+    except InputError as e:
+        return {'errors': [str(e)]}, 400
+    if errors := Game.submit_turn(game_id, current_user, data.get('turn'), inputs):
+        return {'errors': [message for message, _ in errors]}, 400
+    return {'errors': []}
+
+
+@bp.route('/games/export')
+@login_required
+def export_games():
+    """Stream one row per turn and entity of the current user's games, as NDJSON or with `?format=csv` as CSV.
+
+    `created_after` and `created_before` (ISO dates) and `finished` (`1` or `0`) narrow down the games.
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in export.formats:
+        return {'errors': [f'Unknown format {export_format!r}.']}, 400
+    try:
+        created_after, created_before = (
+            datetime.fromisoformat(value) if (value := request.args.get(name)) else None for name in ('created_after', 'created_before')
+        )
+    except ValueError as e:
+        return {'errors': [str(e)]}, 400
+    finished = request.args.get('finished', type=lambda value: value == '1')
+    query = export.games_query(created_after, created_before, current_user, finished)
+
+    response = Response(stream_with_context(export.export_lines(query, export_format)), mimetype=export.mimetypes[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename=games.{export_format}'
+    return response
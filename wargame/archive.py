@@ -0,0 +1,113 @@
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy.orm.exc import StaleDataError
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+codecs = ('zstd', 'zlib') if zstandard else ('zlib',)
+
+
+def compress(payload, codec):
+    data = json.dumps(payload, separators=(',', ':')).encode()
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=19).compress(data)
+    return zlib.compress(data, 9)
+
+
+def decompress(data, codec):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('The game was archived with zstd, install the zstandard package to read it.')
+        data = zstandard.ZstdDecompressor().decompress(data)
+    else:
+        data = zlib.decompress(data)
+    return json.loads(data)
+
+
+class ArchiveCache:
+    """Per-worker LRU of decompressed archives, so that browsing an archived game only decompresses it once.
+
+    Cached payloads are shared between requests and must be treated as read-only.
+    """
+
+    def __init__(self, max_size=32):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, game_id):
+        with self._lock:
+            if (payload := self._entries.get(game_id)) is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(game_id)
+            self.hits += 1
+            return payload
+
+    def put(self, game_id, payload):
+        if not self.max_size:
+            return
+        with self._lock:
+            self._entries[game_id] = payload
+            self._entries.move_to_end(game_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'maxSize': self.max_size, 'hits': self.hits, 'misses': self.misses}
+
+
+def init_app(app):
+    app.config.setdefault('ARCHIVE_CODEC', os.environ.get('WARGAME_ARCHIVE_CODEC', codecs[0]))
+    app.config.setdefault('ARCHIVE_AFTER_DAYS', int(os.environ.get('WARGAME_ARCHIVE_AFTER_DAYS', 30)))
+    app.config.setdefault('ARCHIVE_CACHE_SIZE', int(os.environ.get('WARGAME_ARCHIVE_CACHE_SIZE', 32)))
+    app.extensions['wargame_archive_cache'] = ArchiveCache(app.config['ARCHIVE_CACHE_SIZE'])
+
+
+def get_archive_cache():
+    return current_app.extensions['wargame_archive_cache']
+
+
+@click.command('archive-games')
+@click.option('--days', type=int, help='Archive games finished more than this many days ago, defaults to ARCHIVE_AFTER_DAYS.')
+@click.option('--codec', type=click.Choice(codecs), help='Compression to use, defaults to ARCHIVE_CODEC.')
+@click.option('--limit', type=int, help='Archive at most this many games.')
+@with_appcontext
+def archive_games_command(days, codec, limit):
+    """Move the boards, snapshots, turn events and logs of old finished games into compressed archives."""
+    from .db import db
+    from .models import Game
+
+    days = current_app.config['ARCHIVE_AFTER_DAYS'] if days is None else days
+    codec = codec or current_app.config['ARCHIVE_CODEC']
+    game_ids = [game_id for game_id, in Game.archivable(datetime.now() - timedelta(days=days)).limit(limit).with_entities(Game.id)]
+    archived = size = compressed_size = 0
+    for game_id in game_ids:
+        game = db.session.get(Game, game_id)
+        record = game.archive(codec)
+        try:
+            db.session.commit()
+        except StaleDataError:
+            # the game was changed in the meantime, the next run picks it up again
+            db.session.rollback()
+            continue
+        archived += 1
+        size += record.size
+        compressed_size += record.compressed_size
+        db.session.expunge_all()
+    ratio = f', {size / compressed_size:.1f}x smaller' if compressed_size else ''
+    click.echo(f'Archived {archived} of {len(game_ids)} games with {codec} ({size} -> {compressed_size} bytes{ratio}).')
@@ -1,7 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required, login_user, logout_user
 
-from .models import db, User
+from .models import bot_prefix, db, User
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
@@ -16,6 +16,9 @@ def login():
     user = User.query.filter_by(username=username).first()
 
     if user and user.verify_password(password):
+        if user.password_needs_rehash():
+            user.set_password(password)
+            db.session.commit()
         login_user(user)
         next = request.args.get('next')
         return redirect(next or url_for('game.home'))
@@ -46,6 +49,10 @@ def register():
         flash('Passwords do not match!', 'error')
         return render_template('register.html')
 
+    if username and username.startswith(bot_prefix):
+        flash(f'Usernames starting with "{bot_prefix}" are reserved for bots!', 'error')
+        return render_template('register.html')
+
     new_user = User(username, password)
 
     db.session.add(new_user)
@@ -0,0 +1,198 @@
+import json
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from random import Random
+
+from flask import current_app
+
+from .engine import Engine
+from .inputs import TurnInputs, bank_entities
+from .scenarios import copy_state
+from .simulation import aggressive_policy, random_policy, _spend
+from .utils import current_team, entity_controller, entity_ids_by_team
+
+logger = logging.getLogger(__name__)
+
+# seconds of search per turn for each difficulty
+levels = {
+    'easy': 0.5,
+    'normal': 2,
+    'hard': 6,
+}
+
+
+def _restrict(inputs, entity_ids):
+    return TurnInputs(orders={entity_id: orders for entity_id, orders in inputs.orders.items() if entity_id in entity_ids})
+
+
+def candidate_moves(board_state, entity_ids, rng, count=24):
+    """Distinct inputs for `entity_ids` to search over - doing nothing, the aggressive policy and random orders and bids."""
+    team = current_team(board_state['turn'])
+    bank = bank_entities[team]
+    candidates = {}
+    for attempt in range(count * 4):
+        if attempt == 0:
+            inputs = TurnInputs()
+        elif attempt == 1:
+            inputs = _restrict(aggressive_policy(board_state, team, rng), entity_ids)
+        else:
+            inputs = _restrict(random_policy(board_state, team, rng), entity_ids)
+            if bank in entity_ids and board_state['black_market'] and inputs.order(bank).action == 'none' and rng.random() < 0.5:
+                budget = min(max(board_state['teams'][team]['entities'][bank]['resource'], 0), 3)
+                inputs.bids = {index: bid for index, bid in _spend(rng, range(len(board_state['black_market'])), budget).items() if bid}
+        # explicit orders for every seat, otherwise the teammates' orders fill in for them in the rollouts
+        for entity_id in entity_ids:
+            inputs.order(entity_id)
+        candidates.setdefault(json.dumps(inputs.to_dict(), sort_keys=True), inputs.to_dict())
+        if len(candidates) == count:
+            break
+    return list(candidates.values())
+
+
+def _rollouts(board_state, candidates, picks, seed):
+    """Play a game to the end after each picked candidate, with random orders for everyone else.
+
+    Runs in the worker processes - returns (candidate index, 1 for a win of the team on turn or 0) pairs.
+    """
+    rng = Random(seed)
+    team = current_team(board_state['turn'])
+    results = list()
+    for index in picks:
+        state = copy_state(board_state)
+        inputs = TurnInputs.from_dict(candidates[index])
+        teammates = random_policy(state, team, rng)
+        engine = Engine(state, rng=rng)
+        engine.resolve_turn(TurnInputs.merge((teammates, inputs)))
+        while engine.victor is None and state['turn'] < 24:
+            engine.resolve_turn(random_policy(state, current_team(state['turn']), rng))
+        results.append((index, int(engine.victor == team)))
+    return results
+
+
+class BotPlayer:
+    """Plays the seats of bot users with a time-budgeted Monte Carlo search.
+
+    The search treats every candidate move as an arm of a bandit and picks which ones to play out with UCB1, so
+    the promising moves get most of the rollouts. Rollouts run in batches on a pool of processes, and the move
+    with the best win rate when the budget runs out is submitted like a player's turn.
+    """
+
+    exploration = math.sqrt(2)
+    batch_size = 16
+
+    def __init__(self, workers=1, max_budget=10):
+        self.workers = workers
+        self.max_budget = max_budget
+        self._executor = None
+        self._turns = None
+        self._scheduled = dict()
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        # spawned rather than forked, the processes running the bots also serve requests or resolve turns on threads
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _pick(self, wins, plays):
+        total = sum(plays)
+        return max(range(len(plays)), key=lambda index: math.inf if not plays[index] else (
+            wins[index] / plays[index] + self.exploration * math.sqrt(math.log(total) / plays[index])
+        ))
+
+    def search(self, board_state, entity_ids, budget, seed=None):
+        """The best inputs for `entity_ids` that `budget` seconds of rollouts found, with the search statistics."""
+        deadline = time.monotonic() + budget
+        rng = Random(seed)
+        candidates = candidate_moves(board_state, entity_ids, rng)
+        wins, rollouts = [0] * len(candidates), [0] * len(candidates)
+        # counts the rollouts still running as played, so that concurrent batches spread over the candidates
+        plays = [0] * len(candidates)
+        pending = set()
+        while (remaining := deadline - time.monotonic()) > 0:
+            while len(pending) < self.workers * 2:
+                picks = list()
+                for _ in range(self.batch_size):
+                    picks.append(index := self._pick(wins, plays))
+                    plays[index] += 1
+                pending.add(self.executor.submit(_rollouts, board_state, candidates, picks, rng.randrange(2 ** 32)))
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                for index, won in future.result():
+                    wins[index] += won
+                    rollouts[index] += 1
+        for future in pending:
+            future.cancel()
+        best = max(range(len(candidates)), key=lambda index: (wins[index] / rollouts[index] if rollouts[index] else 0, rollouts[index]))
+        return TurnInputs.from_dict(candidates[best]), {
+            'candidates': len(candidates),
+            'rollouts': sum(rollouts),
+            'winRate': wins[best] / rollouts[best] if rollouts[best] else None,
+        }
+
+    def budget(self, game, bot):
+        """Seconds the bot may think - its level's budget, capped by `max_budget` and the time left in the turn."""
+        budget = min(levels.get(bot.bot, levels['normal']), self.max_budget)
+        if not game.is_paused:
+            budget = min(budget, game.time_left() - 1)
+        return max(budget, 0.1)
+
+    def play(self, game_id, turn):
+        """Submit the turn of every bot seated in the team on turn that has not played it yet."""
+        from .models import Game
+
+        game = Game.load(game_id, players=True)
+        if game.victor_id is not None or game.board_state['turn'] != turn:
+            return
+        team = game.current_team
+        seats = dict()
+        for entity_id in entity_ids_by_team[current_team(turn)]:
+            if (player := entity_controller(team, entity_id)).bot and player.username not in game.ready_players:
+                seats.setdefault(player, set()).add(entity_id)
+        for bot, entity_ids in seats.items():
+            inputs, stats = self.search(game.board_state, entity_ids, self.budget(game, bot))
+            logger.info('%s played turn %s of game %s after %s rollouts', bot.username, turn, game_id, stats['rollouts'])
+            for message, _ in Game.submit_turn(game_id, bot, turn, inputs):
+                logger.warning('%s could not play turn %s of game %s: %s', bot.username, turn, game_id, message)
+
+    def schedule(self, app, game_id, turn):
+        """Let the bots of a game play `turn` in the background, once per game and turn."""
+        with self._lock:
+            if self._scheduled.get(game_id) == turn:
+                return
+            self._scheduled[game_id] = turn
+            if self._turns is None:
+                self._turns = ThreadPoolExecutor(thread_name_prefix='bot-turn')
+        self._turns.submit(self._play_in_context, app, game_id, turn)
+
+    def _play_in_context(self, app, game_id, turn):
+        from .db import db
+
+        with app.app_context():
+            try:
+                self.play(game_id, turn)
+            except Exception:
+                logger.exception('Bots failed to play turn %s of game %s', turn, game_id)
+            finally:
+                db.session.remove()
+
+    def forget(self, game_id):
+        with self._lock:
+            self._scheduled.pop(game_id, None)
+
+
+def init_app(app):
+    app.config.setdefault('BOT_WORKERS', int(os.environ.get('WARGAME_BOT_WORKERS', os.cpu_count() or 1)))
+    app.config.setdefault('BOT_MAX_BUDGET', float(os.environ.get('WARGAME_BOT_MAX_BUDGET', 10)))
+    app.extensions['wargame_bots'] = BotPlayer(app.config['BOT_WORKERS'], app.config['BOT_MAX_BUDGET'])
+
+
+def get_bots():
+    return current_app.extensions['wargame_bots']
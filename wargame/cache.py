@@ -0,0 +1,232 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session
+
+from . import archive, fragments
+from .db import db
+
+logger = logging.getLogger(__name__)
+
+
+class GameStateCache:
+    """Per-worker LRU of deserialized board states, keyed by game id and row version.
+
+    The last few versions of every game are kept so that clients can be sent the difference to the version they
+    already have. Cached states are shared between requests and must be treated as read-only.
+    """
+
+    def __init__(self, max_size=256, ttl=300, versions_kept=8):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.versions_kept = versions_kept
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, game_id, version, count=True):
+        with self._lock:
+            versions = self._entries.get(game_id, {})
+            expires, board_state = versions.get(version, (0, None))
+            if board_state is None or expires < time.monotonic():
+                self.misses += count
+                return None
+            self._entries.move_to_end(game_id)
+            self.hits += count
+            return board_state
+
+    def put(self, game_id, version, board_state):
+        with self._lock:
+            versions = self._entries.setdefault(game_id, OrderedDict())
+            versions[version] = (time.monotonic() + self.ttl, board_state)
+            while len(versions) > self.versions_kept:
+                versions.popitem(last=False)
+            self._entries.move_to_end(game_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, game_id):
+        with self._lock:
+            self._entries.pop(game_id, None)
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxSize': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hitRate': self.hits / requests if requests else 0,
+            }
+
+
+class UserCache:
+    """Per-worker LRU of the column values of recently seen users, so that loading the logged in user needs no query.
+
+    Entries expire after `ttl` seconds, which bounds how long other workers keep serving a deactivated user.
+    """
+
+    def __init__(self, max_size=1024, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            expires, row = self._entries.get(user_id, (0, None))
+            if row is None or expires < time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return row
+
+    def put(self, user_id, row):
+        if not self.max_size:
+            return
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, row)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxSize': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': self.hits / requests if requests else 0,
+            }
+
+
+class WriteBehindQueue:
+    """Buffers inserts of non-critical rows (log entries) and writes them in batches from a background thread."""
+
+    def __init__(self, app, flush_interval=1.0, max_pending=500):
+        self.app = app
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.flushed = 0
+        self._pending = list()
+        self._lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self._thread = None
+
+    def add(self, rows):
+        with self._lock:
+            self._pending.extend(rows)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+            if len(self._pending) >= self.max_pending:
+                self._wake_up.set()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, list()
+        if not pending:
+            return
+        rows_by_model = dict()
+        for model, row in pending:
+            rows_by_model.setdefault(model, list()).append(row)
+        with self.app.app_context():
+            for model, rows in rows_by_model.items():
+                db.session.execute(insert(model), rows)
+            db.session.commit()
+            db.session.remove()
+        self.flushed += len(pending)
+
+    def _run(self):
+        while True:
+            self._wake_up.wait(self.flush_interval)
+            self._wake_up.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to write buffered rows')
+
+    def stats(self):
+        with self._lock:
+            return {'pending': len(self._pending), 'flushed': self.flushed}
+
+
+def init_app(app):
+    app.config.setdefault('GAME_CACHE_SIZE', int(os.environ.get('WARGAME_GAME_CACHE_SIZE', 256)))
+    app.config.setdefault('GAME_CACHE_TTL', int(os.environ.get('WARGAME_GAME_CACHE_TTL', 300)))
+    app.config.setdefault('ODDS_CACHE_SIZE', int(os.environ.get('WARGAME_ODDS_CACHE_SIZE', 256)))
+    app.config.setdefault('USER_CACHE_SIZE', int(os.environ.get('WARGAME_USER_CACHE_SIZE', 1024)))
+    app.config.setdefault('USER_CACHE_TTL', int(os.environ.get('WARGAME_USER_CACHE_TTL', 60)))
+    app.config.setdefault('WRITE_BEHIND', os.environ.get('WARGAME_WRITE_BEHIND') == '1')
+    app.config.setdefault('WRITE_BEHIND_INTERVAL', 1.0)
+    app.extensions['wargame_game_cache'] = GameStateCache(app.config['GAME_CACHE_SIZE'], app.config['GAME_CACHE_TTL'])
+    # estimates only change with the board, so they are kept per game version like the board states
+    app.extensions['wargame_odds_cache'] = GameStateCache(app.config['ODDS_CACHE_SIZE'], app.config['GAME_CACHE_TTL'], versions_kept=1)
+    app.extensions['wargame_user_cache'] = UserCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+    if app.config['WRITE_BEHIND']:
+        app.extensions['wargame_write_behind'] = WriteBehindQueue(app, app.config['WRITE_BEHIND_INTERVAL'])
+
+
+def get_game_cache():
+    return current_app.extensions['wargame_game_cache']
+
+
+def get_odds_cache():
+    return current_app.extensions['wargame_odds_cache']
+
+
+def get_user_cache():
+    return current_app.extensions['wargame_user_cache']
+
+
+def get_write_behind():
+    return current_app.extensions.get('wargame_write_behind')
+
+
+def write_behind(session, model, row):
+    """Queue a row to be inserted in the background once the session commits."""
+    session.info.setdefault('write_behind', list()).append((model, row))
+
+
+def stats():
+    queue = get_write_behind()
+    return {
+        'games': get_game_cache().stats(),
+        'odds': get_odds_cache().stats(),
+        'users': get_user_cache().stats(),
+        'writeBehind': queue.stats() if queue else None,
+        'fragments': fragments.stats(current_app),
+        'archives': archive.get_archive_cache().stats(),
+    }
+
+
+@event.listens_for(Session, 'after_commit')
+def _enqueue_write_behind(session):
+    pending = session.info.pop('write_behind', None)
+    if not pending:
+        return
+    get_write_behind().add(pending)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_write_behind(session, previous_transaction):
+    session.info.pop('write_behind', None)
@@ -1,3 +1,146 @@
+import os
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import and_, event, inspect, select, text, update
+
+from .fragments import clear_cache
 
 db = SQLAlchemy()
+
+default_sqlite_pragmas = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+}
+
+pool_options = {
+    'pool_size': 'DATABASE_POOL_SIZE',
+    'max_overflow': 'DATABASE_MAX_OVERFLOW',
+    'pool_timeout': 'DATABASE_POOL_TIMEOUT',
+    'pool_recycle': 'DATABASE_POOL_RECYCLE',
+}
+
+
+def _env_int(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+def init_app(app):
+    """Configure the database from the app config, falling back to `WARGAME_DATABASE_*` environment variables."""
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', os.environ.get(
+        'WARGAME_DATABASE_URI', f"sqlite:///{os.path.join(app.root_path, 'database.db')}",
+    ))
+    app.config.setdefault('SQLALCHEMY_TRACK_MODIFICATIONS', False)
+    app.config.setdefault('DATABASE_POOL_SIZE', _env_int('WARGAME_DATABASE_POOL_SIZE'))
+    app.config.setdefault('DATABASE_MAX_OVERFLOW', _env_int('WARGAME_DATABASE_MAX_OVERFLOW'))
+    app.config.setdefault('DATABASE_POOL_TIMEOUT', _env_int('WARGAME_DATABASE_POOL_TIMEOUT'))
+    app.config.setdefault('DATABASE_POOL_RECYCLE', _env_int('WARGAME_DATABASE_POOL_RECYCLE'))
+    app.config.setdefault('SQLITE_PRAGMAS', dict(default_sqlite_pragmas))
+    if busy_timeout := _env_int('WARGAME_SQLITE_BUSY_TIMEOUT'):
+        app.config['SQLITE_PRAGMAS']['busy_timeout'] = busy_timeout
+
+    engine_options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', dict())
+    for option, key in pool_options.items():
+        if app.config[key] is not None:
+            engine_options.setdefault(option, app.config[key])
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        # pysqlite waits for locks on its own as well, keep it in line with the busy_timeout pragma
+        engine_options.setdefault('connect_args', dict()).setdefault('timeout', app.config['SQLITE_PRAGMAS'].get('busy_timeout', 5000) / 1000)
+
+    db.init_app(app)
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            _set_sqlite_pragmas(db.engine, app.config['SQLITE_PRAGMAS'])
+
+
+def _set_sqlite_pragmas(engine, pragmas):
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+
+def dispose_engines(app):
+    """Drop the pooled connections inherited from a parent process, for servers forking workers from a preloaded app."""
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create the database tables that do not exist yet and add the columns that existing tables are missing."""
+    db.create_all()
+    for table, column in upgrade_schema():
+        click.echo(f'Added {table}.{column}.')
+    clear_cache(current_app)
+    click.echo('Initialized the database.')
+
+
+# data migrations for the rows of earlier versions, run in order by `upgrade_schema` once the columns are added
+upgrade_steps = list()
+
+
+def upgrade_step(function):
+    """Register `function(connection)` as a data migration - it has to skip the rows it already migrated."""
+    upgrade_steps.append(function)
+    return function
+
+
+def upgrade_schema():
+    """Add the model columns that tables created by earlier versions are missing, filling them in for existing rows.
+
+    Columns are added as nullable and backfilled from their defaults - callable defaults of unique columns are
+    called once per row - then made non-nullable where the database supports altering that. The registered
+    upgrade steps then migrate the data. Safe to run again, it only touches what is missing. Returns the
+    (table, column) names it added.
+    """
+    # version counters of existing rows start where new rows do
+    backfills = {mapper.version_id_col: 1 for mapper in db.Model.registry.mappers if mapper.version_id_col is not None}
+    added = list()
+    with db.engine.begin() as connection:
+        inspector = inspect(connection)
+        quote = connection.dialect.identifier_preparer.quote
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                connection.execute(text(
+                    f'ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column.type.compile(dialect=connection.dialect)}'
+                ))
+                _backfill(connection, table, column, backfills.get(column))
+                if column.unique:
+                    connection.execute(text(
+                        f'CREATE UNIQUE INDEX {quote(f"uq_{table.name}_{column.name}")} ON {quote(table.name)} ({quote(column.name)})'
+                    ))
+                if not column.nullable and connection.dialect.name != 'sqlite':
+                    connection.execute(text(f'ALTER TABLE {quote(table.name)} ALTER COLUMN {quote(column.name)} SET NOT NULL'))
+                added.append((table.name, column.name))
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+        for step in upgrade_steps:
+            step(connection)
+    return added
+
+
+def _backfill(connection, table, column, value):
+    default = column.default
+    if value is None and default is not None and default.is_callable and column.unique:
+        keys = table.primary_key.columns
+        for row in connection.execute(select(*keys)).all():
+            where = and_(*(key == row_value for key, row_value in zip(keys, row)))
+            connection.execute(update(table).where(where).values({column.name: default.arg(None)}))
+        return
+    if value is None and default is not None:
+        value = default.arg(None) if default.is_callable else default.arg
+    if value is not None:
+        connection.execute(update(table).values({column.name: value}))
@@ -0,0 +1,487 @@
+from collections import Counter, defaultdict
+from contextlib import nullcontext
+from random import Random
+
+from .inputs import EntityOrders, TurnInputs
+from .utils import (
+    attack_result_table, current_team, opposing_team, teams, vitality_recovery_cost, end_of_month, get_ends_of_months, total_vps, Event, Asset
+)
+
+
+no_orders = EntityOrders()
+
+
+def game_end_tally(board_state, victor):
+    """Analytics counted once a game is decided - the winning side and the final VPs of every entity."""
+    tally = Counter({('games', 'finished'): 1, ('wins', victor): 1})
+    for team_state in board_state['teams'].values():
+        for entity_id, entity in team_state['entities'].items():
+            tally['entity_vps', entity_id] += entity['victory_points']
+    return tally
+
+
+class RecordingRandom(Random):
+    """A Random that remembers the dice rolls and draws of the rules, so that a replay can be checked against them."""
+
+    def __init__(self, seed=None):
+        super().__init__(seed)
+        self.draws = list()
+
+    def randint(self, a, b):
+        value = super().randint(a, b)
+        self.draws.append(value)
+        return value
+
+    def choice(self, seq):
+        value = super().choice(seq)
+        self.draws.append(value)
+        return value
+
+
+def turn_rng(seed, turn):
+    """The random generator of one turn of a seeded game - `turn` is None for the setup of the game."""
+    return RecordingRandom(f'{seed}:setup' if turn is None else f'{seed}:{turn}')
+
+
+class BoardIndex:
+    """Adjacency and lookup tables over the entities of a board state.
+
+    Holds references to the entity dicts, so it stays valid while their fields change, but has to be rebuilt
+    whenever an entity's `connections` or `attacks` change.
+    """
+
+    def __init__(self, board_state):
+        self.entities = dict()
+        self.team_of = dict()
+        for team, team_state in board_state['teams'].items():
+            for entity_id, entity in team_state['entities'].items():
+                self.entities[entity_id] = entity
+                self.team_of[entity_id] = team
+
+        self.connections = defaultdict(list)
+        self.connected_from = defaultdict(list)
+        self.neighbours = defaultdict(dict)
+        self.attacks = defaultdict(list)
+        self.attacked_by = defaultdict(list)
+        for entity_id, entity in self.entities.items():
+            for target_id in entity.get('connections', []):
+                self.connections[entity_id].append(target_id)
+                self.connected_from[target_id].append(entity_id)
+                # splash damage only spreads along a connection's direction, to entities of the same team
+                if self.team_of.get(target_id) == self.team_of[entity_id]:
+                    self.neighbours[entity_id][target_id] = self.entities[target_id]
+            for target_id in entity.get('attacks', []):
+                self.attacks[entity_id].append(target_id)
+                self.attacked_by[target_id].append(entity_id)
+
+
+class Engine:
+    """Applies the game rules to a plain board state, without any database or request context.
+
+    `log` receives every (message, category) pair the rules produce, `rng` supplies all dice rolls and draws.
+    `phase(name)`, when given, returns a context manager wrapped around each phase of a turn, e.g. to time it.
+    `tally` counts the events, black market acquisitions, attacks and game results for the cross-game analytics.
+    """
+
+    def __init__(self, board_state, rng=None, log=None, team_names=None, victor=None, phase=None):
+        self.board_state = board_state
+        self.rng = rng or Random()
+        self.team_names = team_names or {team: team.capitalize() for team in teams}
+        self.victor = victor
+        self.player_inputs = TurnInputs()
+        self._log = log
+        self.tally = Counter()
+        self._index = None
+        self.phase = phase or (lambda name: nullcontext())
+
+    def log(self, message, category):
+        if self._log is not None:
+            self._log(message, category)
+
+    def setup(self):
+        self.give_resources()
+        self.generate_bm_pool()
+        self.get_new_bm_asset()
+        self.process_event()
+
+    def resolve_turn(self, player_inputs):
+        """Resolve the current turn with the merged `TurnInputs` of the team on turn."""
+        self.player_inputs = player_inputs
+        with self.phase('inputs'):
+            self.process_inputs()
+        with self.phase('health'):
+            game_over = self.check_health()
+        if not self.victor:
+            turn = self.board_state['turn']
+            if turn == end_of_month(1):
+                self.enable_attacks()
+            elif turn == end_of_month(12):
+                self.determine_winner()
+
+            # end of month
+            if turn % 2 == 0:
+                with self.phase('victory_points'):
+                    self.calculate_victory_points()
+            else:
+                with self.phase('events'):
+                    self.process_event()
+                with self.phase('black_market'):
+                    self.get_new_bm_asset()
+
+        with self.phase('resources'):
+            self.progress_time(game_over)
+            self.give_resources()
+        return game_over
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = BoardIndex(self.board_state)
+        return self._index
+
+    def invalidate_index(self):
+        self._index = None
+
+    def get_current_entities(self):
+        turn = self.board_state['turn']
+        return self.board_state['teams'][current_team(turn)]['entities']
+
+    def get_entity(self, entity_id):
+        return self.index.entities.get(entity_id)
+
+    def get_all_connections(self, entity_id, entity_team):
+        """Entities of `entity_team` the entity connects to, and the entity itself."""
+        entity = self.board_state['teams'][entity_team]['entities'][entity_id]
+        return self.index.neighbours[entity_id], entity
+
+    def _do_revitalize(self, entity, orders):
+        vitality_recovered = orders.revitalize
+        recovery_cost = vitality_recovery_cost[vitality_recovered]
+        entity['vitality'] += vitality_recovered
+        entity['resource'] -= recovery_cost
+        self.log(f"{entity['name']} spent {recovery_cost} resources to gain {vitality_recovered} vitality.", 'action')
+
+    def check_health(self):
+        govs = {
+            'red': self.board_state['teams']['red']['entities']['rus_gov'],
+            'blue': self.board_state['teams']['blue']['entities']['uk_gov'],
+        }
+        fatalities = False
+        for team, other_team in zip(teams, reversed(teams)):
+            for entity in self.board_state['teams'][team]['entities'].values():
+                if entity['vitality'] > 0:
+                    continue
+                fatalities = True
+                govs[other_team]['victory_points'] += 10
+                self.log(f"{entity['name']} was dealt fatal damage. Opponent was awarded 10 VPs.", 'important')
+
+        if fatalities:
+            self.determine_winner()
+        return fatalities
+
+    def _do_damage(self, target_id, amount, target_team):
+        connections, target = self.get_all_connections(target_id, target_team)
+
+        direct_amount = amount
+        if target['traits'].get('software_update'):
+            direct_amount = 0
+        if target['traits'].get('stuxnet'):
+            direct_amount *= 2
+        if target['traits'].get('education') or target['traits'].get('bargaining_chip'):
+            direct_amount //= 2
+        if target['traits'].get('ransomware'):
+            target['traits']['paralyzed'] = 3
+
+        target['vitality'] -= direct_amount
+
+        for connection in connections.values():
+            if connection['traits'].get('education'):
+                connection['vitality'] -= amount // 4
+            elif connection['traits'].get('network_policy'):
+                pass
+            else:
+                connection['vitality'] -= amount // 2
+        self.log(f"{target['name']} was dealt {amount} damage. Connected entities got {amount // 2} damage.", 'attack-damage')
+
+    def _do_attribution(self, attacker, level):
+        if attacker == 'bear':
+            self.board_state['teams']['blue']['assets'].append('software_update')
+            if level == -2:
+                self.board_state['teams']['blue']['assets'].append('recovery')
+        elif attacker == 'trolls':
+            self.board_state['teams']['blue']['assets'].append('education')
+            if level == -2:
+                self.board_state['teams']['red']['entities']['trolls']['traits']['cannot_attack'] = 2
+        elif attacker == 'scs':
+            self.board_state['teams']['blue']['assets'].append('software_update')
+            self.board_state['teams']['red']['entities']['scs']['traits']['cannot_bit'] = 2
+            if level == -2:
+                self.board_state['teams']['blue']['assets'].append('attack_vector')
+        elif attacker == 'gchq':
+            self.board_state['teams']['blue']['entities']['gchq']['traits']['cannot_attack'] = 2
+            if level == -2:
+                self.board_state['teams']['blue']['entities']['gchq']['traits']['cannot_perform_actions'] = 2
+                self.board_state['teams']['blue']['entities']['uk_gov']['vitality'] -= 1
+        elif attacker == 'uk_gov':
+            self.board_state['teams']['red']['assets'].append('bargaining_chip')
+            if level == -2:
+                self.board_state['teams']['blue']['entities']['uk_gov']['resource'] -= 2
+                self.board_state['teams']['blue']['entities']['uk_gov']['vitality'] -= 2
+
+    def _do_attack(self, entity, orders):
+        turn = self.board_state['turn']
+        for target_id, attack_investment in orders.attacks.items():
+            dice_roll = self.rng.randint(1, 6)
+            attack_success = attack_result_table[attack_investment][dice_roll]
+            self.tally['attacks', f"{entity['id']}:{attack_investment}"] += 1
+            if attack_success:
+                self.tally['attack_successes' if attack_success > 0 else 'attack_backfires', f"{entity['id']}:{attack_investment}"] += 1
+            self.log(f"{entity['name']} spent {attack_investment} resources and rolled {dice_roll}.", 'action')
+
+            if attack_success > 0:
+                self._do_damage(target_id, attack_success, opposing_team(turn))
+            elif attack_success < 0:
+                self._do_damage(entity['id'], -attack_success, current_team(turn))
+                self._do_attribution(entity['id'], -attack_success)
+
+            entity['resource'] -= attack_investment
+            if entity['id'] == 'trolls':
+                if attack_investment >= 3:
+                    vp_cost = 1 if attack_investment < 5 else 2
+                    self.board_state['teams']['red']['entities']['rus_gov']['victory_points'] -= vp_cost
+                    self.log(f'Control the Trolls - Russian Government lost {vp_cost} VP because Online Trolls launched a large attack.', 'victory-point')
+                    if 'ransomware' in entity['traits'].get('assets', []):
+                        entity['victory_points'] += 4
+                        self.log('Success breeds confidence - Online Trolls gained 4 VPs because they launched a large attack '
+                                 'while having the Ransomware asset.', 'victory-point')
+
+    def _do_transfer(self, entity, orders):
+        for target_id, transfer_amount in orders.transfers.items():
+            target = self.get_entity(target_id)
+            target['resource'] += transfer_amount
+            entity['resource'] -= transfer_amount
+            if transfer_amount:
+                self.log(f"{entity['name']} sent {transfer_amount} resources to {target['name']}.", 'action')
+                if entity['id'] == 'elect':
+                    entity['victory_points'] -= 1
+                    self.log(f"Resist the drain - {entity['name']} lost 1 VP due to the transfer of resources.", 'victory-point')
+
+    def process_inputs(self):
+        teams = self.board_state['teams']
+        turn = self.board_state['turn']
+        team = teams[current_team(turn)]
+        asset = Asset(self.board_state)
+        if activated_assets := self.player_inputs.assets:
+            used_assets = list()
+            for index, option in activated_assets.items():
+                asset_id = team['assets'][index]
+                asset.resolve(asset_id, option)
+                if asset_id == 'attack_vector':
+                    self.invalidate_index()
+                activated_asset = Asset.assets[asset_id]
+                self.log(f'Team {current_team(turn).capitalize()} activated asset {activated_asset[0]} - {activated_asset[2]}.', 'action')
+                used_assets.append(index)
+
+            used_assets.sort(reverse=True)
+            for index in used_assets:
+                del team['assets'][index]
+
+        bm_removal = list()
+        for index, bm_item in enumerate(self.board_state['black_market']):
+            asset, opposing_bid, old_bid = bm_item
+            bid = self.player_inputs.bids.get(index, 0)
+            if current_team(turn) == 'red':
+                team['entities']['scs']['resource'] -= bid
+            else:
+                team['entities']['gchq']['resource'] -= bid
+            asset_name = Asset.assets[asset][0]
+            if opposing_bid and not bid:
+                self.log(f"Team {opposing_team(turn).capitalize()}'s bid for {asset_name} was not contested - asset gained.", 'action')
+                self.board_state['teams'][opposing_team(turn)]['assets'].append(asset)
+                self.tally['assets', f'{opposing_team(turn)}:{asset}'] += 1
+                bm_removal.append(index)
+            elif bid:
+                self.log(f'Team {current_team(turn).capitalize()} bid {bid} for {asset_name}.', 'action')
+                self.board_state['black_market'][index] = [asset, bid + old_bid, opposing_bid]
+
+        for removed_index in reversed(bm_removal):
+            del self.board_state['black_market'][removed_index]
+
+        for entity in self.get_current_entities().values():
+            orders = self.player_inputs.orders.get(entity['id'], no_orders)
+            match orders.action:
+                case 'revitalize':
+                    self._do_revitalize(entity, orders)
+                case 'attack':
+                    self._do_attack(entity, orders)
+                case 'transfer':
+                    self._do_transfer(entity, orders)
+
+            if entity['id'] == 'uk_gov' and entity['traits'].get('banking_error'):
+                entity['traits']['banking_error'] = False
+
+            if entity['id'] == 'scs' and entity['traits'].get('embargoed'):
+                entity['traits']['embargoed'] = False
+
+        for t, e, trait in (
+                ('blue', 'elect', 'education'), ('red', 'rus_gov', 'bargaining_chip'),
+                ('blue', 'plc', 'software_update'), ('blue', 'energy', 'software_update'), ('red', 'ros', 'software_update'),
+                ):
+            entity = teams[t]['entities'][e]
+            if entity['traits'].get(trait):
+                entity['traits'][trait] -= 1
+
+        plc = teams['blue']['entities']['plc']
+        if recovery := plc['traits'].get('recovery'):
+            if plc['vitality'] < recovery:
+                plc['vitality'] += 1
+            plc['traits']['recovery'] = plc['vitality']
+
+        for t, e in ('blue', 'energy'), ('red', 'ros'):
+            entity = teams[t]['entities'][e]
+            if entity['traits'].get('stuxnet'):
+                entity['traits']['stuxnet'] = False
+
+        for e in 'plc', 'elect':
+            entity = teams['blue']['entities'][e]
+            if entity['traits'].get('ransomware'):
+                entity['traits']['ransomware'] = False
+            if entity['traits'].get('paralyzed'):
+                entity['traits']['paralyzed'] -= 1
+
+    def give_resources(self):
+        entities = self.get_current_entities()
+        if entities.get('rus_gov', {}).get('traits', {}).get('people_revolt'):
+            rus_gov = entities['rus_gov']
+            rus_gov['traits']['people_revolt'] = False
+            self.log(f"Turn starts - {rus_gov['name']} gains no resources because of the People's revolt effect.", 'event')
+            return
+        gov_entity = entities.get('rus_gov') or entities.get('uk_gov')
+        gov_entity['resource'] += 3
+        self.log(f"Turn starts - {gov_entity['name']} gains 3 resources.", 'resource')
+
+    def progress_time(self, game_over):
+        turn = self.board_state['turn']
+        if not game_over:
+            self.log(f'End of turn {turn // 2 + 1} for the {current_team(turn).capitalize()} team.', 'turn')
+        self.board_state['turn'] += 1
+
+    def determine_winner(self):
+        teams = self.board_state['teams']
+        red_vps = total_vps(teams['red'])
+        blue_vps = total_vps(teams['blue'])
+        self.victor = 'red' if red_vps > blue_vps else 'blue'
+        self.tally.update(game_end_tally(self.board_state, self.victor))
+        self.log(f'Team {self.team_names[self.victor]} won the game having {red_vps} VPs. The opposing team had {blue_vps} VPs.', 'important')
+
+    def enable_attacks(self):
+        self.log('Attacks enabled.', 'turn')
+        for entity in self.board_state['teams']['red']['entities'].values():
+            match entity['id']:
+                case 'bear':
+                    entity['attacks'] = ['plc']
+                case 'trolls':
+                    entity['attacks'] = ['elect']
+        self.invalidate_index()
+
+    def calculate_blue_victory_points(self, turn, entities):
+        if entities['elect']['resource'] >= 4:
+            entities['uk_gov']['victory_points'] += 1
+            self.log('Election time - UK Government gains 1 VP because a month ended with Electorate having 4 or more resources.', 'victory-point')
+        if turn == end_of_month(12) and entities['rus_gov']['vitality'] < 4:
+            self.log('Aggressive outlook - UK Government gains 5 VPs because the Russian Government '
+                     'ended the game with less vitality than it started with.', 'victory-point')
+            entities['uk_gov']['victory_points'] += 5
+
+        plc_triggers = get_ends_of_months(4, 8, 12)
+        if turn in plc_triggers:
+            index = plc_triggers.index(turn)
+            limit = (index + 1) * 3
+            amount_won = index + 2
+            if entities['plc']['resource'] >= limit:
+                entities['plc']['victory_points'] += amount_won
+                self.log(f'Weather the Brexit storm - UK PLC gains {amount_won} VP because it had '
+                         f'more than {limit} resources at the end of the quarter.', 'victory-point')
+
+        quarter_ends = get_ends_of_months(3, 6, 9, 12)
+        if turn in quarter_ends:
+            plc = entities['plc']
+            rd = plc['traits']['recruitment_drive']
+            if rd['vitality'] > plc['vitality']:
+                amount_won = 1 + 2 * rd['count']
+                plc['victory_points'] += 1 + 2 * rd['count']
+                rd['count'] += 1
+                self.log(f"Recruitment drive - UK PLC gains {amount_won} VP because it achieved vitality growth last {rd['count']} quarter(s).", 'victory-point')
+            else:
+                rd['count'] = 0
+            rd['vitality'] = plc['vitality']
+
+        year_halves = get_ends_of_months(6, 12)
+        if turn in year_halves:
+            index = year_halves.index(turn)
+            limit = 6 + index * 3
+            if entities['energy']['vitality'] >= limit:
+                amount_won = index + 2
+                entities['energy']['victory_points'] += amount_won
+                self.log(f'Grow capacity - UK Energy gains {amount_won} VP because has more than {limit} vitality.', 'victory-point')
+
+    @staticmethod
+    def _count_assets_of_type(assets, asset_type):
+        return len(list(filter(lambda a: a[1] == asset_type, Asset.get_assets(assets))))
+
+    def calculate_red_victory_points(self, turn, entities):
+        if entities['rus_gov']['resource'] >= 3:
+            entities['rus_gov']['victory_points'] += 1
+            self.log('Some animals are more equal than others - Russian Government gains 1 VP '
+                     'because it ended the month with more than 3 resources.', 'victory-point')
+
+        bear_triggers = get_ends_of_months(4, 8, 12)
+        if turn in bear_triggers:
+            bear = entities['bear']
+            index = bear_triggers.index(turn)
+            if bear['traits']['last_growth_vitality'] > bear['vitality']:
+                amount_won = 1 + index * 2
+                bear['traits']['last_growth_vitality'] = bear['vitality']
+                bear['victory_points'] += amount_won
+                self.log(f"Those who can't steal - Energetic Bear gains {amount_won} VP because it achieved vitality growth since last check.", 'victory-point')
+
+        if self._count_assets_of_type(self.board_state['teams']['blue']['assets'], 'defence') < self._count_assets_of_type(self.board_state['teams']['red']['assets'], 'attack'):
+            entities['scs']['victory_points'] += 2
+            self.log('Win the arms race - SCS gains 2 VPs because Russia has a better cyber arsenal than the UK.', 'victory-point')
+
+        quarter_ends = get_ends_of_months(3, 6, 9, 12)
+        if turn in quarter_ends:
+            ros = entities['ros']
+            gc = ros['traits']['grow_capacity']
+            if gc['vitality'] > ros['vitality']:
+                amount_won = 1 + 2 * gc['count']
+                ros['victory_points'] += 1 + 2 * gc['count']
+                gc['count'] += 1
+                self.log(f"Grow capacity - Rosenergoatom gains {amount_won} VP because "
+                         "it achieved vitality growth last {gc['count']} quarter(s).", 'victory-point')
+            else:
+                gc['count'] = 0
+            gc['vitality'] = ros['vitality']
+
+    def generate_bm_pool(self):
+        pool = list()
+        for k, v in Asset.assets.items():
+            pool.extend([k] * v[-1])
+        self.board_state['black_market_pool'] = pool
+
+    def get_new_bm_asset(self):
+        new_asset = self.rng.choice(self.board_state['black_market_pool'])
+        self.board_state['black_market_pool'].remove(new_asset)
+        self.board_state['black_market'].append([new_asset, 0, 0])
+
+    def calculate_victory_points(self):
+        turn = self.board_state['turn']
+        teams = self.board_state['teams']
+        entities = dict(**teams['red']['entities'], **teams['blue']['entities'])
+        self.calculate_blue_victory_points(turn, entities)
+        self.calculate_red_victory_points(turn, entities)
+
+    def process_event(self):
+        event_id = Event(self.board_state).handle(self.rng)
+        self.tally['events', event_id] += 1
+        self.log(Event.descriptions[event_id], 'event')
@@ -0,0 +1,187 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from fcntl import LOCK_EX, LOCK_UN, flock
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+class LocalBroker:
+    """Keeps the most recent events of every game in memory, visible only to the current process."""
+
+    def __init__(self, backlog=100):
+        self._condition = threading.Condition()
+        self._counters = defaultdict(int)
+        self._messages = defaultdict(lambda: deque(maxlen=backlog))
+
+    def publish(self, game_id, name, data):
+        with self._condition:
+            self._counters[game_id] += 1
+            self._messages[game_id].append((self._counters[game_id], name, data))
+            self._condition.notify_all()
+
+    def cursor(self, game_id):
+        with self._condition:
+            return self._counters[game_id]
+
+    def listen(self, game_id, cursor, timeout):
+        with self._condition:
+            self._condition.wait_for(lambda: self._counters[game_id] > cursor, timeout)
+            messages = [message for message in self._messages[game_id] if message[0] > cursor]
+            return messages, self._counters[game_id]
+
+
+class FileBroker:
+    """Appends events to one file per game so that every worker process sharing the directory sees them.
+
+    Event ids are byte offsets into the game's file, so a reconnecting client resumes exactly where it stopped.
+    A file is emptied once it outgrows `max_size` bytes - in practice only the file of all games, whose only reader
+    is the scheduler and its periodic rescan - and listeners whose offset lies beyond its end start over from its
+    beginning. Every `prune_interval` seconds the publishing worker deletes the files of the games that had no
+    events for `max_age` seconds, such as the finished ones.
+    """
+
+    prune_interval = 60
+
+    def __init__(self, path, poll_interval=0.25, max_size=1024 * 1024, max_age=24 * 60 * 60):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.max_size = max_size
+        self.max_age = max_age
+        self._pruned = time.monotonic()
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, game_id):
+        return os.path.join(self.path, f'{game_id}.events')
+
+    def publish(self, game_id, name, data):
+        line = json.dumps((name, data)) + '\n'
+        with open(self._file(game_id), 'a') as f:
+            flock(f, LOCK_EX)
+            if os.fstat(f.fileno()).st_size + len(line) > self.max_size:
+                f.truncate(0)
+            f.write(line)
+            f.flush()
+            flock(f, LOCK_UN)
+        with self._lock:
+            due = time.monotonic() - self._pruned > self.prune_interval
+            if due:
+                self._pruned = time.monotonic()
+        if due:
+            self.prune()
+
+    def prune(self):
+        """Delete the files of the games without events for `max_age` seconds, their listeners start over from 0."""
+        expired = time.time() - self.max_age
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if entry.name == f'{all_games}.events' or not entry.name.endswith('.events'):
+                    continue
+                try:
+                    if entry.stat().st_mtime < expired:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def cursor(self, game_id):
+        try:
+            return os.path.getsize(self._file(game_id))
+        except FileNotFoundError:
+            return 0
+
+    def listen(self, game_id, cursor, timeout):
+        deadline = time.monotonic() + timeout
+        while (size := self.cursor(game_id)) == cursor and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+        if size < cursor:
+            # emptied or deleted since the last read
+            cursor = 0
+        if size <= cursor:
+            return [], cursor
+
+        messages = list()
+        with open(self._file(game_id), 'rb') as f:
+            f.seek(cursor)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                cursor += len(line)
+                try:
+                    name, data = json.loads(line)
+                except ValueError:
+                    # the rest of a line cut by a rotation, an offset from before it can point into the middle
+                    continue
+                messages.append((cursor, name, data))
+        return messages, cursor
+
+
+all_games = 'all'
+
+brokers = {
+    'local': lambda app: LocalBroker(),
+    'file': lambda app: FileBroker(
+        app.config['EVENT_BROKER_PATH'], max_size=app.config['EVENT_BROKER_MAX_SIZE'], max_age=app.config['EVENT_BROKER_MAX_AGE'],
+    ),
+}
+
+
+def init_app(app):
+    app.config.setdefault('EVENT_BROKER', os.environ.get('WARGAME_EVENT_BROKER', 'local'))
+    app.config.setdefault('EVENT_BROKER_PATH', os.environ.get('WARGAME_EVENT_BROKER_PATH', os.path.join(app.instance_path, 'events')))
+    app.config.setdefault('EVENT_BROKER_MAX_SIZE', int(os.environ.get('WARGAME_EVENT_BROKER_MAX_SIZE', 1024 * 1024)))
+    app.config.setdefault('EVENT_BROKER_MAX_AGE', int(os.environ.get('WARGAME_EVENT_BROKER_MAX_AGE', 24 * 60 * 60)))
+    # streams end well within gunicorn's worker timeout, the browser reconnects and resumes from the last event id
+    app.config.setdefault('EVENT_STREAM_DURATION', int(os.environ.get('WARGAME_EVENT_STREAM_DURATION', 25)))
+    app.config.setdefault('EVENT_STREAM_KEEPALIVE', 10)
+    app.extensions['wargame_events'] = brokers[app.config['EVENT_BROKER']](app)
+
+
+def get_broker():
+    return current_app.extensions['wargame_events']
+
+
+def publish(session, game_id, name, **data):
+    """Queue an event on the session - it is only delivered to the subscribers once the session commits."""
+    session.info.setdefault('pending_events', list()).append((game_id, name, data))
+
+
+@event.listens_for(Session, 'after_commit')
+def _deliver_pending_events(session):
+    pending = session.info.pop('pending_events', None)
+    if not pending:
+        return
+    broker = get_broker()
+    for game_id, name, data in pending:
+        broker.publish(game_id, name, data)
+        broker.publish(all_games, name, dict(data, gameId=game_id))
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_pending_events(session, previous_transaction):
+    session.info.pop('pending_events', None)
+
+
+def format_message(message_id, name, data):
+    return f'id: {message_id}\nevent: {name}\ndata: {json.dumps(data)}\n\n'
+
+
+def stream(broker, game_id, last_event_id=None, duration=25, keepalive=10):
+    cursor = broker.cursor(game_id)
+    try:
+        # ids from before a restart or a rotation may lie beyond the end, resume from there rather than wait for it
+        cursor = max(min(int(last_event_id), cursor), 0)
+    except (TypeError, ValueError):
+        pass
+    yield 'retry: 3000\n\n'
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        messages, cursor = broker.listen(game_id, cursor, keepalive)
+        if not messages:
+            yield ': keepalive\n\n'
+        for message in messages:
+            yield format_message(*message)
@@ -0,0 +1,109 @@
+import csv
+import io
+import json
+
+import click
+from flask.cli import with_appcontext
+
+from .models import Game, User
+from .utils import turn_to_month
+
+columns = (
+    'game', 'turn', 'month', 'team', 'entity', 'vitality', 'resource', 'victory_points', 'traits',
+    'action', 'attacks', 'transfers', 'revitalize',
+)
+formats = ('ndjson', 'csv')
+mimetypes = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def games_query(created_after=None, created_before=None, owner=None, finished=None):
+    """Games to export, `owner` being a User or a username and `finished` None for both finished and running games."""
+    query = Game.query.order_by(Game.id)
+    if created_after is not None:
+        query = query.filter(Game.created >= created_after)
+    if created_before is not None:
+        query = query.filter(Game.created < created_before)
+    if isinstance(owner, User):
+        query = query.filter(Game.owner_id == owner.id)
+    elif owner is not None:
+        query = query.join(Game.owner).filter(User.username == owner)
+    if finished is not None:
+        query = query.filter(Game.victor_id.isnot(None) if finished else Game.victor_id.is_(None))
+    return query
+
+
+def game_rows(game):
+    """One row per turn and entity of `game`, with the orders the entity got during that turn.
+
+    Turns are rebuilt one after another from the game's snapshots and turn events (or its archive), so only one
+    board state is held at a time. Orders are only known for games with turn events, older games leave them empty.
+    """
+    orders = {event.turn: event.inputs['orders'] for event in game.recorded_events()}
+    for state in game.history():
+        turn = state['turn']
+        turn_orders = orders.get(turn)
+        for team, team_state in state['teams'].items():
+            for entity_id, entity in team_state['entities'].items():
+                row = {
+                    'game': game.id,
+                    'turn': turn,
+                    'month': turn_to_month(turn),
+                    'team': team,
+                    'entity': entity_id,
+                    'vitality': entity['vitality'],
+                    'resource': entity['resource'],
+                    'victory_points': entity.get('victory_points', 0),
+                    'traits': entity.get('traits', {}),
+                    'action': None, 'attacks': None, 'transfers': None, 'revitalize': None,
+                }
+                if turn_orders is not None:
+                    entity_orders = turn_orders.get(entity_id, {})
+                    row['action'] = entity_orders.get('action', 'none')
+                    row['attacks'] = entity_orders.get('attacks', {})
+                    row['transfers'] = entity_orders.get('transfers', {})
+                    row['revitalize'] = entity_orders.get('revitalize', 0)
+                yield row
+
+
+def export_rows(query, batch_size=20):
+    """Stream the rows of every game in `query`, fetching the games in batches through a server-side cursor."""
+    for game in query.yield_per(batch_size):
+        yield from game_rows(game)
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+def csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, columns)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow({key: json.dumps(value) if isinstance(value, dict) else value for key, value in row.items()})
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_lines(query, export_format):
+    rows = export_rows(query)
+    return csv_lines(rows) if export_format == 'csv' else ndjson_lines(rows)
+
+
+@click.command('export-games')
+@click.option('--format', 'export_format', type=click.Choice(formats), default='ndjson', show_default=True)
+@click.option('--created-after', type=click.DateTime(), help='Only games created at or after this time.')
+@click.option('--created-before', type=click.DateTime(), help='Only games created before this time.')
+@click.option('--owner', help='Only games owned by this username.')
+@click.option('--finished/--unfinished', default=None, help='Only finished or only running games.')
+@click.option('--output', type=click.Path(dir_okay=False, writable=True), help='Write to this file instead of stdout.')
+@with_appcontext
+def export_games_command(export_format, created_after, created_before, owner, finished, output):
+    """Export one row per game, turn and entity with the entity's stats and orders."""
+    query = games_query(created_after, created_before, owner, finished)
+    with click.open_file(output or '-', 'w') as f:
+        for line in export_lines(query, export_format):
+            f.write(line)
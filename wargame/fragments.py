@@ -0,0 +1,164 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from hashlib import sha1
+from tempfile import NamedTemporaryFile
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+
+class FragmentStore:
+    """Per-worker LRU of rendered template fragments, optionally backed by a directory shared between workers.
+
+    The directory is pruned every `prune_interval` seconds by whichever worker writes to it, dropping the files
+    older than `max_age` seconds and then the oldest ones beyond `max_files`.
+    """
+
+    prune_interval = 60
+
+    def __init__(self, max_size=2048, path=None, max_age=24 * 60 * 60, max_files=100000):
+        self.max_size = max_size
+        self.path = path
+        self.max_age = max_age
+        self.max_files = max_files
+        self.hits = 0
+        self.misses = 0
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+        self._pruned = time.monotonic()
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, sha1(key.encode()).hexdigest())
+
+    def get(self, key):
+        with self._lock:
+            if (fragment := self._fragments.get(key)) is not None:
+                self._fragments.move_to_end(key)
+                self.hits += 1
+                return fragment
+        if self.path:
+            try:
+                with open(self._file(key), encoding='utf-8') as f:
+                    fragment = f.read()
+            except FileNotFoundError:
+                pass
+            else:
+                self._remember(key, fragment)
+                self.hits += 1
+                return fragment
+        self.misses += 1
+        return None
+
+    def put(self, key, fragment):
+        self._remember(key, fragment)
+        if self.path:
+            with NamedTemporaryFile('w', encoding='utf-8', dir=self.path, delete=False) as f:
+                f.write(fragment)
+            os.replace(f.name, self._file(key))
+            with self._lock:
+                due = time.monotonic() - self._pruned > self.prune_interval
+                if due:
+                    self._pruned = time.monotonic()
+            if due:
+                self.prune()
+
+    def prune(self):
+        """Delete the expired files of the shared directory and the oldest ones above `max_files`."""
+        files = list()
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                try:
+                    files.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    pass
+        files.sort()
+        expired = time.time() - self.max_age
+        excess = len(files) - self.max_files
+        for index, (modified, path) in enumerate(files):
+            if modified >= expired and index >= excess:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _remember(self, key, fragment):
+        with self._lock:
+            self._fragments[key] = fragment
+            self._fragments.move_to_end(key)
+            while len(self._fragments) > self.max_size:
+                self._fragments.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._fragments), 'maxSize': self.max_size, 'hits': self.hits, 'misses': self.misses}
+
+
+class FragmentCacheExtension(Extension):
+    """`{% cache 'name', key, ... %}...{% endcache %}` renders the block once per distinct key.
+
+    The keys must capture everything the block depends on - e.g. an entity id for static text, or the game id
+    and version plus whatever identifies the viewer for fragments showing the board.
+    """
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_store=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        keys = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            keys.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', [nodes.List(keys)]), [], [], body).set_lineno(lineno)
+
+    def _render(self, keys, caller):
+        store = self.environment.fragment_store
+        if store is None:
+            return caller()
+        key = ':'.join(map(str, keys))
+        if (fragment := store.get(key)) is None:
+            fragment = caller()
+            store.put(key, str(fragment))
+        return Markup(fragment)
+
+
+def init_app(app):
+    app.config.setdefault('FRAGMENT_CACHE_SIZE', int(os.environ.get('WARGAME_FRAGMENT_CACHE_SIZE', 2048)))
+    app.config.setdefault('FRAGMENT_CACHE_PATH', os.environ.get('WARGAME_FRAGMENT_CACHE_PATH'))
+    app.config.setdefault('FRAGMENT_CACHE_MAX_AGE', int(os.environ.get('WARGAME_FRAGMENT_CACHE_MAX_AGE', 24 * 60 * 60)))
+    app.config.setdefault('FRAGMENT_CACHE_MAX_FILES', int(os.environ.get('WARGAME_FRAGMENT_CACHE_MAX_FILES', 100000)))
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    if app.config['FRAGMENT_CACHE_SIZE']:
+        app.jinja_env.fragment_store = create_store(app, app.config['FRAGMENT_CACHE_SIZE'])
+
+
+def cache_path(app):
+    """The shared directory of the app's database - a different database never reads the fragments of another."""
+    if path := app.config['FRAGMENT_CACHE_PATH']:
+        return os.path.join(path, sha1(app.config['SQLALCHEMY_DATABASE_URI'].encode()).hexdigest())
+
+
+def create_store(app, max_size):
+    return FragmentStore(max_size, cache_path(app), app.config['FRAGMENT_CACHE_MAX_AGE'], app.config['FRAGMENT_CACHE_MAX_FILES'])
+
+
+def clear_cache(app):
+    """Delete the shared fragments of the app's database, whose game ids and versions start over when it is recreated."""
+    if (path := cache_path(app)) and os.path.isdir(path):
+        with os.scandir(path) as entries:
+            for entry in entries:
+                os.remove(entry.path)
+
+
+def stats(app):
+    store = app.jinja_env.fragment_store
+    return store.stats() if store else None
@@ -1,8 +1,15 @@
-from flask import Blueprint, abort, flash, render_template, request, redirect, url_for
+import json
+
+from flask import Blueprint, Response, abort, current_app, flash, render_template, request, redirect, url_for, stream_with_context
 from flask_login import login_required, current_user
+from sqlalchemy.orm.exc import StaleDataError
 
+from . import bots, events, metrics
+from .cache import get_odds_cache
+from .inputs import InputError, TurnInputs
 from .models import db, User, Game, Team
-from .utils import get_initial_board_state, entity_ids_by_team, entity_types
+from .scenarios import available_scenarios, default_scenario, new_board_state
+from .utils import entity_ids_by_team, entity_types
 
 bp = Blueprint('game', __name__, url_prefix='/')
 
@@ -10,14 +17,25 @@ bp = Blueprint('game', __name__, url_prefix='/')
 @bp.route('/')
 @login_required
 def home():
-    return render_template('home.html')
+    status = request.args.get('status')
+    context = {
+        'status': status,
+        'games': current_user.games_page(request.args.get('page', 1, type=int), status),
+    }
+    return render_template('home.html', context=context)
 
 
 def form_team(team):
     new_team = Team()
     new_team.name = request.form.get(f'{team}-team-name')
     for entity_id, entity_type in zip(entity_ids_by_team[team], entity_types):
-        setattr(new_team, entity_type + '_player', User.query.get(request.form.get(entity_id)))
+        player = request.form.get(entity_id, '')
+        if player.startswith('bot:'):
+            if player[4:] not in bots.levels:
+                abort(400)
+            setattr(new_team, entity_type + '_player', User.bot_player(player[4:]))
+        else:
+            setattr(new_team, entity_type + '_player', User.query.get(player))
     return new_team
 
 
@@ -26,16 +44,21 @@ def form_team(team):
 def new():
     if request.method == 'GET':
         context = {
-            'players': User.query.filter(User.active),
+            'players': User.query.filter(User.active, User.bot.is_(None)),
+            'bot_levels': bots.levels,
+            'scenarios': available_scenarios(),
         }
         return render_template('new.html', context=context)
 
     red_team = form_team('red')
     blue_team = form_team('blue')
     description = request.form.get('description')
-    state = get_initial_board_state()
+    scenario = request.form.get('scenario', default_scenario)
+    if scenario not in available_scenarios():
+        abort(400)
+    state = new_board_state(scenario)
 
-    new_game = Game(owner=current_user, red_team=red_team, blue_team=blue_team, board_state=state, description=description)
+    new_game = Game(owner=current_user, red_team=red_team, blue_team=blue_team, board_state=state, scenario=scenario, description=description)
     db.session.add(new_game)
     db.session.commit()
 
@@ -45,11 +68,18 @@ def new():
 @bp.route('game/<int:game_id>/toggle_pause')
 @login_required
 def toggle_pause(game_id):
-    game = Game.query.get_or_404(game_id)
-    if current_user != game.owner:
-        abort(403)
-    game.toggle_pause()
-    db.session.commit()
+    for _ in range(5):
+        game = db.session.get(Game, game_id, populate_existing=True) or abort(404)
+        if current_user != game.owner:
+            abort(403)
+        game.toggle_pause()
+        try:
+            db.session.commit()
+            break
+        except StaleDataError:
+            db.session.rollback()
+    else:
+        abort(409)
     return {
         'paused': game.is_paused
     }
@@ -58,34 +88,86 @@ def toggle_pause(game_id):
 @bp.route('game/<int:game_id>/time_left')
 @login_required
 def time_left(game_id):
-    game = Game.query.get_or_404(game_id)
+    game = Game.load(game_id)
+    return game.timer_state()
+
+
+@bp.route('game/<int:game_id>/log')
+@login_required
+def log(game_id):
+    game = Game.load(game_id)
+    after = request.args.get('after', type=int)
+    entries = game.log_page(after=after, before=request.args.get('before', type=int))
     return {
-        'turn': game.board_state['turn'],
-        'secondsLeft': game.time_left(),
-        'isStarting': game.is_starting,
-        'isPaused': game.is_paused,
-        'startingDelay': game.starting_delay if game.is_starting else 0,
+        'entries': [entry.to_dict() for entry in entries],
+        # not the game's log_seq, entries buffered by write-behind are not readable yet and must not be skipped
+        'lastSeq': entries[-1].seq if entries else after or 0,
     }
 
 
-@bp.route('game/<int:game_id>/board', methods=['GET', 'POST'])
+@bp.route('game/<int:game_id>/odds')
 @login_required
-def board(game_id):
-    game = Game.query.get_or_404(game_id)
+def game_odds(game_id):
+    from . import odds  # numpy is slow to import and only needed here
+    game = Game.load(game_id)
+    if (rollouts := request.args.get('rollouts', type=int)) is not None:
+        rollouts = max(1, min(rollouts, 100000))
+    # every player's board asks for the same estimate each turn, only the first request pays for the rollouts
+    elif (estimate := get_odds_cache().get(game.id, game.version)) is not None:
+        return estimate
+    estimate = odds.estimate_odds(game.board_state, rollouts=rollouts)
+    estimate['attacks'] = odds.estimate_attacks(game.board_state)
+    if rollouts is None:
+        get_odds_cache().put(game.id, game.version, estimate)
+    return estimate
+
+
+@bp.route('game/<int:game_id>/debug')
+@login_required
+def debug(game_id):
+    game = Game.load(game_id)
+    if current_user != game.owner:
+        abort(403)
+    if (game_metrics := metrics.get_metrics()) is None:
+        abort(404)
+    context = {
+        'game': game,
+        'phases': metrics.turn_phases,
+        'turns': game_metrics.recent_turns(game_id),
+        'board_state_bytes': len(json.dumps(game.board_state)),
+        'snapshots': game.snapshots.count(),
+        'log_entries': game.log_seq,
+    }
+    return render_template('debug.html', context=context)
 
-    if request.method == 'POST':
-        if errors := game.perform_checks(request.form, current_user):
-            for message, category in errors:
-                flash(message, category)
-            return redirect(url_for('game.board', game_id=game.id))
 
-        game.ready_player(current_user)
-        game.process_turn(request.form)
-        db.session.commit()
-        return redirect(url_for('game.board', game_id=game.id))
+@bp.route('game/<int:game_id>/events')
+@login_required
+def game_events(game_id):
+    db.session.query(Game.id).filter_by(id=game_id).first_or_404()
+    db.session.close()
+    stream = events.stream(
+        events.get_broker(), game_id, request.headers.get('Last-Event-ID'),
+        duration=current_app.config['EVENT_STREAM_DURATION'], keepalive=current_app.config['EVENT_STREAM_KEEPALIVE'],
+    )
+    return Response(stream_with_context(stream), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
 
-    elif not game.is_paused and game.time_left() < -5:
-        game.process_turn(dict(), timeout=True)
-        db.session.commit()
 
-    return render_template('board.html', context=game)
+@bp.route('game/<int:game_id>/board', methods=['GET', 'POST'])
+@login_required
+def board(game_id):
+    if request.method == 'POST':
+        try:
+            inputs = TurnInputs.from_form(request.form)
+        except InputError as e:
+            errors = [(str(e), 'error')]
+        else:
+            errors = Game.submit_turn(game_id, current_user, request.form.get('turn', type=int), inputs)
+        for message, category in errors:
+            flash(message, category)
+        return redirect(url_for('game.board', game_id=game_id))
+
+    return render_template('board.html', context=Game.load(game_id, players=True))
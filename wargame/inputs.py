@@ -0,0 +1,184 @@
+import re
+from dataclasses import dataclass, field
+
+from .utils import attack_result_table, calculate_max_revitalization, current_team, entity_controller
+
+actions = ('none', 'revitalize', 'attack', 'transfer', 'black_market')
+
+max_attack_investment = len(attack_result_table) - 1
+
+bank_entities = {'red': 'scs', 'blue': 'gchq'}
+
+field_pattern = re.compile(
+    r'(?P<entity>[^-]+?)__(?P<entity_field>action|revitalize)'
+    r'|(?P<source>[^-]+)-(?P<target>[^-]+)__(?P<kind>attack|transfer)'
+    r'|bm-bid-(?P<bid>\d+)'
+    r'|option-(?P<option>\d+)'
+    r'|activated-assets'
+)
+
+
+class InputError(ValueError):
+    pass
+
+
+def _amount(value):
+    if value in (None, ''):
+        return 0
+    try:
+        amount = int(value)
+    except (TypeError, ValueError):
+        raise InputError(f'{value!r} is not a number.')
+    if amount < 0:
+        raise InputError('Amounts cannot be negative.')
+    return amount
+
+
+@dataclass
+class EntityOrders:
+    action: str = 'none'
+    attacks: dict = field(default_factory=dict)
+    transfers: dict = field(default_factory=dict)
+    revitalize: int = 0
+
+
+@dataclass
+class TurnInputs:
+    """Everything one or more players decided during a turn, keyed by entity id, black market index and asset index."""
+
+    orders: dict = field(default_factory=dict)
+    bids: dict = field(default_factory=dict)
+    assets: dict = field(default_factory=dict)
+
+    def order(self, entity_id):
+        return self.orders.setdefault(entity_id, EntityOrders())
+
+    @classmethod
+    def from_form(cls, form):
+        """Parse the fields of the board form in a single pass."""
+        inputs = cls()
+        options = dict()
+        for name, value in form.items():
+            if not (m := field_pattern.fullmatch(name)):
+                continue
+            if m['entity_field'] == 'action':
+                if value not in actions and value != '':
+                    raise InputError(f'Unknown action {value!r}.')
+                inputs.order(m['entity']).action = value or 'none'
+            elif m['entity_field'] == 'revitalize':
+                inputs.order(m['entity']).revitalize = _amount(value)
+            elif m['kind']:
+                targets = inputs.order(m['source']).attacks if m['kind'] == 'attack' else inputs.order(m['source']).transfers
+                targets[m['target']] = _amount(value)
+            elif m['bid']:
+                if bid := _amount(value):
+                    inputs.bids[int(m['bid'])] = bid
+            elif m['option']:
+                options[int(m['option'])] = value
+            elif value:
+                try:
+                    inputs.assets = {int(index): '' for index in value.split(',')}
+                except ValueError:
+                    raise InputError(f'Invalid asset list {value!r}.')
+        for index in inputs.assets:
+            inputs.assets[index] = options.get(index, '')
+        return inputs
+
+    @classmethod
+    def from_dict(cls, data):
+        if 'orders' not in data:
+            return cls.from_form(data)
+        try:
+            return cls(
+                orders={
+                    entity_id: EntityOrders(
+                        action=orders.get('action', 'none'),
+                        attacks={target: _amount(amount) for target, amount in orders.get('attacks', {}).items()},
+                        transfers={target: _amount(amount) for target, amount in orders.get('transfers', {}).items()},
+                        revitalize=_amount(orders.get('revitalize')),
+                    )
+                    for entity_id, orders in data['orders'].items()
+                },
+                bids={int(index): _amount(bid) for index, bid in data.get('bids', {}).items()},
+                assets={int(index): option or '' for index, option in data.get('assets', [])},
+            )
+        except (AttributeError, TypeError, ValueError) as e:
+            raise InputError(f'Malformed turn inputs: {e}')
+
+    def to_dict(self):
+        return {
+            'orders': {
+                entity_id: {
+                    'action': orders.action,
+                    'attacks': orders.attacks,
+                    'transfers': orders.transfers,
+                    'revitalize': orders.revitalize,
+                }
+                for entity_id, orders in self.orders.items()
+            },
+            'bids': {str(index): bid for index, bid in self.bids.items()},
+            'assets': [[index, option] for index, option in self.assets.items()],
+        }
+
+    @classmethod
+    def merge(cls, all_inputs):
+        """Combine the inputs of several players, later submissions overriding earlier ones."""
+        merged = cls()
+        for inputs in all_inputs:
+            merged.orders.update(inputs.orders)
+            merged.bids.update(inputs.bids)
+            merged.assets.update(inputs.assets)
+        return merged
+
+    def validate(self, board_state, team, player=None):
+        """Check the inputs against the board before they are stored, returning a list of error messages.
+
+        When `player` (a Team member) is given, orders may only be given to the entities they control.
+        """
+        errors = list()
+        entities = board_state['teams'][current_team(board_state['turn'])]['entities']
+        for entity_id, orders in self.orders.items():
+            entity = entities.get(entity_id)
+            if entity is None:
+                errors.append(f'{entity_id} is not an entity of the team on turn.')
+                continue
+            if player is not None and entity_controller(team, entity_id) != player:
+                errors.append(f"You do not control {entity['name']}.")
+            if orders.action not in actions:
+                errors.append(f"Unknown action {orders.action!r} for {entity['name']}.")
+            if not set(orders.attacks) <= set(entity.get('attacks', [])):
+                errors.append(f"{entity['name']} cannot attack {', '.join(set(orders.attacks) - set(entity.get('attacks', [])))}.")
+            if not set(orders.transfers) <= set(entity.get('connections', [])):
+                errors.append(f"{entity['name']} cannot transfer to {', '.join(set(orders.transfers) - set(entity.get('connections', [])))}.")
+            amounts = [*orders.attacks.values(), *orders.transfers.values(), orders.revitalize]
+            if any(amount < 0 for amount in amounts):
+                errors.append(f"Amounts given to {entity['name']} cannot be negative.")
+            # only the amounts of the chosen action are spent, the form also sends the fields of the other ones
+            if orders.action == 'revitalize' and orders.revitalize > calculate_max_revitalization(max(entity['resource'], 0)):
+                errors.append(f"{entity['name']} cannot afford to recover {orders.revitalize} vitality.")
+            if orders.action == 'attack' and any(amount > max_attack_investment for amount in orders.attacks.values()):
+                errors.append(f"{entity['name']} cannot invest more than {max_attack_investment} resources in an attack.")
+            if self.spent(entity_id) > max(entity['resource'], 0):
+                errors.append(f"{entity['name']} cannot spend more resources than it has.")
+        bank_id = bank_entities[current_team(board_state['turn'])]
+        if any(bid < 0 for bid in self.bids.values()):
+            errors.append('Bids cannot be negative.')
+        elif sum(self.bids.values()) + self.spent(bank_id) > max(entities[bank_id]['resource'], 0):
+            errors.append(f"{entities[bank_id]['name']} cannot afford these bids.")
+        if not all(0 <= index < len(board_state['black_market']) for index in self.bids):
+            errors.append('Bid on an item that is not on the black market.')
+        assets = board_state['teams'][current_team(board_state['turn'])]['assets']
+        if not all(0 <= index < len(assets) for index in self.assets):
+            errors.append('Activated an asset the team does not have.')
+        return errors
+
+    def spent(self, entity_id):
+        """Resources the chosen action of `entity_id` costs, not counting revitalization which is checked on its own."""
+        orders = self.orders.get(entity_id)
+        if orders is None:
+            return 0
+        if orders.action == 'attack':
+            return sum(orders.attacks.values())
+        if orders.action == 'transfer':
+            return sum(orders.transfers.values())
+        return 0
@@ -0,0 +1,158 @@
+import json
+import os
+import threading
+from bisect import bisect_left
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from time import perf_counter
+
+from flask import Response, current_app, g, has_app_context, request
+from sqlalchemy import event
+
+second_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+query_buckets = (1, 2, 3, 5, 8, 13, 21, 34, 55)
+byte_buckets = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+turn_phases = ('load_inputs', 'inputs', 'health', 'victory_points', 'events', 'black_market', 'resources', 'snapshot', 'commit')
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Process-wide counters and histograms, rendered in the Prometheus text format.
+
+    Also keeps the phase timings of the most recent turns of every game for the debug panel.
+    """
+
+    def __init__(self, recent_turns=24):
+        self.histograms = dict()
+        self.turns = defaultdict(lambda: deque(maxlen=recent_turns))
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, buckets=second_buckets, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if (histogram := self.histograms.get(key)) is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def record_turn(self, game_id, turn, phases):
+        for phase, seconds in phases.items():
+            self.observe('wargame_turn_phase_seconds', seconds, phase=phase)
+        with self._lock:
+            self.turns[game_id].append({'turn': turn, 'phases': phases, 'seconds': sum(phases.values())})
+
+    def recent_turns(self, game_id):
+        with self._lock:
+            return list(self.turns.get(game_id, ()))
+
+    def render(self):
+        lines = list()
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+        described = set()
+        for (name, labels), histogram in histograms:
+            if name not in described:
+                lines.append(f'# TYPE {name} histogram')
+                described.add(name)
+            label_text = ','.join(f'{key}="{value}"' for key, value in labels)
+            prefix = label_text + ',' if label_text else ''
+            cumulative = 0
+            for bound, count in zip((*histogram.buckets, '+Inf'), histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{{label_text}}} {histogram.sum}')
+            lines.append(f'{name}_count{{{label_text}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+class TurnTimer:
+    """Collects how long each phase of a turn resolution took."""
+
+    def __init__(self):
+        self.phases = dict()
+
+    @contextmanager
+    def phase(self, name):
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + perf_counter() - started
+
+
+def init_app(app):
+    """Has to run before the database is set up, the engine is created with the serializers set here."""
+    app.config.setdefault('METRICS', os.environ.get('WARGAME_METRICS') == '1')
+    if not app.config['METRICS']:
+        return
+    metrics = app.extensions['wargame_metrics'] = Metrics()
+
+    def serialize(value):
+        started = perf_counter()
+        text = json.dumps(value)
+        metrics.observe('wargame_json_seconds', perf_counter() - started, operation='serialize')
+        metrics.observe('wargame_json_bytes', len(text), byte_buckets, operation='serialize')
+        return text
+
+    def deserialize(text):
+        started = perf_counter()
+        value = json.loads(text)
+        metrics.observe('wargame_json_seconds', perf_counter() - started, operation='deserialize')
+        metrics.observe('wargame_json_bytes', len(text), byte_buckets, operation='deserialize')
+        return value
+
+    engine_options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', dict())
+    engine_options.setdefault('json_serializer', serialize)
+    engine_options.setdefault('json_deserializer', deserialize)
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = perf_counter()
+        g.metrics_queries = 0
+        g.metrics_sql_seconds = 0
+
+    @app.after_request
+    def record_request(response):
+        if 'metrics_started' in g:
+            labels = {'endpoint': request.endpoint or 'unknown', 'method': request.method}
+            metrics.observe('wargame_request_seconds', perf_counter() - g.metrics_started, status=response.status_code, **labels)
+            metrics.observe('wargame_request_queries', g.metrics_queries, query_buckets, **labels)
+            metrics.observe('wargame_request_sql_seconds', g.metrics_sql_seconds, **labels)
+        return response
+
+    app.add_url_rule('/metrics', 'metrics', lambda: Response(metrics.render(), mimetype='text/plain; version=0.0.4'))
+
+
+def instrument_engine(app, engine):
+    """Count the queries and SQL time of each request, has to be called with the engine once the app created it."""
+    if 'wargame_metrics' not in app.extensions:
+        return
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started = perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def record_query(conn, cursor, statement, parameters, context, executemany):
+        if has_app_context() and 'metrics_queries' in g:
+            g.metrics_queries += 1
+            g.metrics_sql_seconds += perf_counter() - context._metrics_started
+
+
+def get_metrics():
+    return current_app.extensions.get('wargame_metrics')
+
+
+def turn_timer():
+    return TurnTimer() if get_metrics() is not None else None
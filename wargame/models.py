@@ -1,17 +1,38 @@
+import json
+import logging
+from collections import Counter
+from contextlib import nullcontext
 from datetime import datetime, timedelta
-from random import choice, randint
+from random import SystemRandom
+from secrets import token_urlsafe
+from functools import cached_property
 
+from flask import has_app_context
 from flask_login.mixins import UserMixin
-from sqlalchemy import Column, ForeignKey, String, Integer, Boolean, DateTime, JSON, or_
-from sqlalchemy.ext.mutable import MutableDict, MutableList
-from sqlalchemy.orm import relationship
-from werkzeug.security import check_password_hash, generate_password_hash
-
-from .db import db
-from .utils import (
-    attack_result_table, current_team, opposing_team, find_attack_targets, find_transfer_targets,
-    teams, vitality_recovery_cost, end_of_month, get_ends_of_months, total_vps, Event, Asset
-)
+from sqlalchemy import column, event, inspect, select, table, update, Column, ForeignKey, Index, String, Integer, Boolean, DateTime, JSON, LargeBinary, UniqueConstraint
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.mutable import MutableDict
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, defer, deferred, joinedload, load_only, make_transient_to_detached, relationship, undefer
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.exc import StaleDataError
+
+from .archive import compress, decompress, get_archive_cache
+from .cache import get_game_cache, get_user_cache, get_write_behind, write_behind
+from .db import db, upgrade_step
+from .engine import Engine, game_end_tally, turn_rng
+from .events import publish
+from .inputs import InputError, TurnInputs
+from .metrics import get_metrics, turn_timer
+from .passwords import get_hasher
+from .scenarios import copy_state, default_scenario, new_board_state
+from .snapshots import diff, patch
+from .utils import current_team, entity_types, total_vps
+
+logger = logging.getLogger(__name__)
+
+# usernames of the bot users, reserved for them
+bot_prefix = 'Bot ('
 
 
 class User(db.Model, UserMixin):
@@ -21,13 +42,49 @@ class User(db.Model, UserMixin):
     username = Column(String, nullable=False, unique=True)
     password = Column(String, nullable=False)
     active = Column(Boolean, default=True)
+    bot = Column(String)
 
     def __init__(self, username, password):
         self.username = username
-        self.password = generate_password_hash(password)
+        self.set_password(password)
+
+    @classmethod
+    def bot_player(cls, level):
+        """The user playing every seat given to a bot of `level`, created the first time one is needed."""
+        if (user := cls.query.filter_by(bot=level).first()) is None:
+            # registration refuses the prefix, but accounts made before it did may hold the plain name
+            username, number = f'{bot_prefix}{level})', 1
+            while db.session.query(cls.id).filter_by(username=username).first() is not None:
+                number += 1
+                username = f'{bot_prefix}{level}) {number}'
+            # nobody knows the password, so the bot cannot be logged in as
+            user = cls(username, token_urlsafe(32))
+            user.bot = level
+            db.session.add(user)
+        return user
+
+    @classmethod
+    def load(cls, user_id):
+        """The user with `user_id`, rebuilt from the per-worker user cache when possible instead of queried."""
+        cache = get_user_cache()
+        if (row := cache.get(user_id)) is None:
+            if (user := db.session.get(cls, user_id)) is not None:
+                cache.put(user_id, {column.key: getattr(user, column.key) for column in cls.__table__.columns})
+            return user
+        user = cls.__mapper__.class_manager.new_instance()
+        for key, value in row.items():
+            set_committed_value(user, key, value)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    def set_password(self, password):
+        self.password = get_hasher().hash(password)
 
     def verify_password(self, password):
-        return check_password_hash(self.password, password)
+        return get_hasher().verify(self.password, password)
+
+    def password_needs_rehash(self):
+        return get_hasher().needs_rehash(self.password)
 
     def is_active(self):
         return self.active
@@ -42,19 +99,26 @@ class User(db.Model, UserMixin):
         id, username = self.id, self.username
         return f'<User {id=} {username=}>'
 
-    def _all_roles_query(self):
-        return or_(Team.government_player == self,
-                   Team.industry_player == self,
-                   Team.people_player == self,
-                   Team.security_player == self,
-                   Team.energy_player == self)
+    def games_page(self, page=1, status=None, per_page=20):
+        participations = db.select(GameParticipant.game_id).where(GameParticipant.user_id == self.id)
+        query = Game.query.filter(Game.id.in_(participations)).options(
+            load_only(Game.id, Game.red_team_id, Game.blue_team_id, Game.victor_id),
+            joinedload(Game.red_team).load_only(Team.name),
+            joinedload(Game.blue_team).load_only(Team.name),
+            joinedload(Game.victor).load_only(Team.name),
+        ).order_by(Game.id.desc())
+        if status == 'active':
+            query = query.filter(Game.victor_id.is_(None))
+        elif status == 'finished':
+            query = query.filter(Game.victor_id.is_not(None))
+        return query.paginate(page=page, per_page=per_page, error_out=False)
 
-    @property
-    def games(self):
-        return Game.query.join(
-            Team, or_(Team.id == Game.red_team_id,
-                      Team.id == Game.blue_team_id)
-        ).where(or_(self._all_roles_query(), Game.owner == self)).all()
+
+@event.listens_for(User.active, 'set')
+@event.listens_for(User.password, 'set')
+def _invalidate_cached_user(target, value, oldvalue, initiator):
+    if target.id is not None and has_app_context():
+        get_user_cache().invalidate(target.id)
 
 
 class Team(db.Model):
@@ -77,6 +141,11 @@ class Team(db.Model):
     def players(self):
         return (self.government_player, self.industry_player, self.people_player, self.security_player, self.energy_player)
 
+    @property
+    def seats(self):
+        for entity_type in entity_types:
+            yield entity_type, getattr(self, entity_type + '_player')
+
 
 class Game(db.Model):
     __tablename__ = 'game'
@@ -95,23 +164,42 @@ class Game(db.Model):
     victor = relationship('Team', foreign_keys=[victor_id])
 
     description = Column(String)
-    ready_players = Column(MutableList.as_mutable(JSON), default=list)
-    player_inputs = Column(MutableDict.as_mutable(JSON), default=dict)
+    version = Column(Integer, nullable=False)
+    turn_inputs = relationship('TurnInput', lazy='dynamic', cascade='all, delete-orphan')
     board_state = Column(MutableDict.as_mutable(JSON))
-    history = Column(MutableList.as_mutable(JSON), default=list)
-    message_log = Column(MutableList.as_mutable(JSON), default=list)
+    scenario = Column(String, default=default_scenario, nullable=False)
+    seed = Column(Integer)
+    events = relationship('TurnEvent', lazy='dynamic', order_by='TurnEvent.turn', cascade='all, delete-orphan')
+    snapshots = relationship('GameSnapshot', lazy='dynamic', order_by='GameSnapshot.turn', cascade='all, delete-orphan')
+    log_entries = relationship('LogEntry', lazy='dynamic', order_by='LogEntry.seq', cascade='all, delete-orphan')
+    log_seq = Column(Integer, default=0, nullable=False)
+    participants = relationship('GameParticipant', back_populates='game', cascade='all, delete-orphan')
     unpause_time = Column(DateTime, default=datetime.now)
     seconds_left = Column(Integer, default=int(round_length.total_seconds()))
     is_paused = Column(Boolean, default=True)
+    created = Column(DateTime, default=datetime.now, nullable=False)
+    finished = Column(DateTime)
+    archived = Column(Boolean, default=False, nullable=False)
+    archive_record = relationship('GameArchive', uselist=False, cascade='all, delete-orphan')
+    spectator_token = Column(String, unique=True, default=lambda: token_urlsafe(16))
+
+    __mapper_args__ = {'version_id_col': version}
+
+    keyframe_interval = 6
+    log_page_size = 50
 
     def __init__(self, *args, **kwargs):
-        kwargs['history'] = [kwargs['board_state']]
         super().__init__(*args, **kwargs)
-        self.message_log = list()
-        self.give_resources()
-        self.generate_bm_pool()
-        self.get_new_bm_asset()
-        self.process_event()
+        self.participants.append(GameParticipant(user=self.owner, team=None, role='owner'))
+        for team in ('red', 'blue'):
+            for role, player in getattr(self, team + '_team').seats:
+                self.participants.append(GameParticipant(user=player, team=team, role=role))
+        if self.seed is None:
+            self.seed = SystemRandom().randrange(2 ** 31)
+        engine = self.engine(rng=turn_rng(self.seed, None))
+        engine.setup()
+        record_stats(db.session, engine.tally)
+        self.record_snapshot()
 
     def toggle_pause(self):
         if self.is_starting:
@@ -123,18 +211,83 @@ class Game(db.Model):
             difference = (datetime.now() - self.unpause_time)
             self.seconds_left -= int(difference.total_seconds())
         self.is_paused = not self.is_paused
+        self.publish('pause' if self.is_paused else 'unpause', **self.timer_state())
+
+    def publish(self, name, **data):
+        publish(db.session, self.id, name, **data)
+
+    def timer_state(self):
+        return {
+            'turn': self.board_state['turn'],
+            'secondsLeft': self.time_left(),
+            'isStarting': self.is_starting,
+            'isPaused': self.is_paused,
+            'startingDelay': self.starting_delay if self.is_starting else 0,
+        }
 
-    def get_current_entities(self):
-        turn = self.board_state['turn']
-        return self.board_state['teams'][current_team(turn)]['entities']
+    @classmethod
+    def load(cls, game_id, players=False):
+        """Load a game for reading, taking its board state from the worker's cache when the row version matches.
+
+        With `players`, both teams and all of their players are loaded in the same query. The returned game must
+        not be modified.
+        """
+        options = [defer(cls.board_state)]
+        if players:
+            options.extend(
+                joinedload(getattr(cls, team + '_team')).joinedload(getattr(Team, entity_type + '_player'))
+                for team in ('red', 'blue') for entity_type in entity_types
+            )
+        game = cls.query.options(*options).get_or_404(game_id)
+        cache = get_game_cache()
+        if (board_state := cache.get(game_id, game.version)) is not None:
+            set_committed_value(game, 'board_state', board_state)
+        else:
+            cache.put(game_id, game.version, game.board_state)
+        return game
+
+    def engine(self, phase=None, rng=None):
+        return Engine(
+            self.board_state, rng=rng, log=self.log, victor=self.victor_color, phase=phase,
+            team_names={'red': self.red_team.name, 'blue': self.blue_team.name},
+        )
 
-    def get_entity(self, entity_id):
-        for team in teams:
-            if entity := self.board_state['teams'][team]['entities'].get(entity_id):
-                return entity
+    @property
+    def victor_color(self):
+        if self.victor is None:
+            return None
+        return 'red' if self.victor == self.red_team else 'blue'
 
     def log(self, message, category):
-        self.message_log.append((message, category))
+        self.log_seq = (self.log_seq or 0) + 1
+        entry = dict(turn=self.board_state['turn'], seq=self.log_seq, category=category, message=message)
+        if self.id is not None and get_write_behind():
+            write_behind(db.session, LogEntry, dict(entry, game_id=self.id))
+        else:
+            self.log_entries.append(LogEntry(**entry))
+
+    def log_page(self, after=None, before=None, limit=None):
+        if self.archived:
+            entries = [
+                LogEntry(**entry) for entry in self.archived_data()['log']
+                if (after is None or entry['seq'] > after) and (before is None or entry['seq'] < before)
+            ]
+            return entries[-(limit or self.log_page_size):] if after is None else entries[:limit or self.log_page_size]
+        query = self.log_entries
+        if after is not None:
+            query = query.filter(LogEntry.seq > after)
+        if before is not None:
+            query = query.filter(LogEntry.seq < before)
+        if after is None:
+            entries = query.order_by(None).order_by(LogEntry.seq.desc()).limit(limit or self.log_page_size).all()
+            return entries[::-1]
+        return query.limit(limit or self.log_page_size).all()
+
+    def popup_messages(self):
+        if self.archived:
+            turn = self.board_state['turn'] - 1
+            return [LogEntry(**entry) for entry in self.archived_data()['log'] if entry['turn'] == turn and entry['category'] == 'attack-damage']
+        return self.log_entries.filter_by(turn=self.board_state['turn'] - 1, category='attack-damage')
 
     def time_left(self):
         if self.is_paused:
@@ -151,9 +304,32 @@ class Game(db.Model):
         time_delay = self.unpause_time - datetime.now()
         return time_delay.total_seconds()
 
-    def ready_player(self, player):
-        if player.username not in self.ready_players:
-            self.ready_players.append(player.username)
+    @cached_property
+    def ready_players(self):
+        query = db.session.query(User.username).join(TurnInput, TurnInput.user_id == User.id).filter(
+            TurnInput.game_id == self.id, TurnInput.turn == self.board_state['turn'],
+        )
+        return [username for username, in query]
+
+    def ready_player(self, player, inputs):
+        db.session.add(TurnInput(game_id=self.id, turn=self.board_state['turn'], user_id=player.id, inputs=inputs.to_dict()))
+        self.__dict__.pop('ready_players', None)
+        self.publish('player-ready', player=player.username)
+
+    def collect_inputs(self):
+        """The merged inputs of the turn, leaving out stored inputs that no longer pass validation."""
+        valid_inputs = list()
+        for turn_input in self.turn_inputs.filter_by(turn=self.board_state['turn']).order_by(TurnInput.created):
+            try:
+                inputs = TurnInputs.from_dict(turn_input.inputs)
+                errors = inputs.validate(self.board_state, self.current_team)
+            except (InputError, KeyError, TypeError) as e:
+                errors = [str(e)]
+            if errors:
+                logger.warning('Ignoring the inputs of user %s for turn %s of game %s: %s', turn_input.user_id, turn_input.turn, self.id, ' '.join(errors))
+                continue
+            valid_inputs.append(inputs)
+        return TurnInputs.merge(valid_inputs)
 
     @property
     def current_team(self):
@@ -163,23 +339,10 @@ class Game(db.Model):
     def all_players_ready(self):
         return set(map(lambda p: p.username, self.current_team.players)) == set(self.ready_players)
 
-    def get_all_connections(self, entity_id, entity_team):
-        entities = self.board_state['teams'][entity_team]['entities']
-        entity = entities[entity_id]
-        connected_entities = dict()
-        for connection in entities.values():
-            if connection['id'] in entity.get('connections', []):
-                connected_entities[connection['id']] = connection
-        for candidate in entities.values():
-            if entity in candidate.get('connections', []):
-                connected_entities[candidate['id']] = candidate
-        return connected_entities, entity
-
-    def perform_checks(self, inputs, player):
+    def perform_checks(self, turn, player, inputs=None):
         validation_errors = list()
 
-        turn = self.board_state['turn']
-        if turn != int(inputs['turn']):
+        if turn != self.board_state['turn']:
             validation_errors.append(('The turn had already ended!', 'error'))
 
         if self.victor is not None:
@@ -191,366 +354,418 @@ class Game(db.Model):
         if player not in self.current_team.players:
             validation_errors.append(('It is not your turn now, wait for your opponents to finish.', 'error'))
 
+        if inputs is not None and not validation_errors:
+            validation_errors.extend((message, 'error') for message in inputs.validate(self.board_state, self.current_team, player))
+
         return validation_errors
 
-    def _do_revitalize(self, entity):
-        vitality_recovered = int(self.player_inputs.get(entity['id'] + '__revitalize') or 0)
-        recovery_cost = vitality_recovery_cost[vitality_recovered]
-        entity['vitality'] += vitality_recovered
-        entity['resource'] -= recovery_cost
-        self.log(f"{entity['name']} spent {recovery_cost} resources to gain {vitality_recovered} vitality.", 'action')
-
-    def check_health(self):
-        govs = {
-            'red': self.board_state['teams']['red']['entities']['rus_gov'],
-            'blue': self.board_state['teams']['blue']['entities']['uk_gov'],
-        }
-        fatalities = False
-        for team, other_team in zip(teams, reversed(teams)):
-            for entity in self.board_state['teams'][team]['entities'].values():
-                if entity['vitality'] > 0:
-                    continue
-                fatalities = True
-                govs[other_team]['victory_points'] += 10
-                self.log(f"{entity['name']} was dealt fatal damage. Opponent was awarded 10 VPs.", 'important')
-
-        if fatalities:
-            self.determine_winner()
-        return fatalities
-
-    def _do_damage(self, target_id, amount, target_team):
-        connections, target = self.get_all_connections(target_id, target_team)
-
-        direct_amount = amount
-        if target['traits'].get('software_update'):
-            direct_amount = 0
-        if target['traits'].get('stuxnet'):
-            direct_amount *= 2
-        if target['traits'].get('education') or target['traits'].get('bargaining_chip'):
-            direct_amount //= 2
-        if target['traits'].get('ransomware'):
-            target['traits']['paralyzed'] = 3
-
-        target['vitality'] -= direct_amount
-
-        for connection in connections.values():
-            if connection['traits'].get('education'):
-                connection['vitality'] -= amount // 4
-            elif connection['traits'].get('network_policy'):
-                pass
-            else:
-                connection['vitality'] -= amount // 2
-        self.log(f"{target['name']} was dealt {amount} damage. Connected entities got {amount // 2} damage.", 'attack-damage')
-
-    def _do_attribution(self, attacker, level):
-        if attacker == 'bear':
-            self.board_state['teams']['blue']['assets'].append('software_update')
-            if level == -2:
-                self.board_state['teams']['blue']['assets'].append('recovery')
-        elif attacker == 'trolls':
-            self.board_state['teams']['blue']['assets'].append('education')
-            if level == -2:
-                self.board_state['teams']['red']['trolls']['traits']['cannot_attack'] = 2
-        elif attacker == 'scs':
-            self.board_state['teams']['blue']['assets'].append('software_update')
-            self.board_state['teams']['red']['scs']['traits']['cannot_bit'] = 2
-            if level == -2:
-                self.board_state['teams']['blue']['assets'].append('attack_vector')
-        elif attacker == 'gchq':
-            self.board_state['teams']['blue']['gchq']['traits']['cannot_attack'] = 2
-            if level == -2:
-                self.board_state['teams']['blue']['gchq']['traits']['cannot_perform_actions'] = 2
-                self.board_state['teams']['blue']['uk_gov']['vitality'] -= 1
-        elif attacker == 'uk_gov':
-            self.board_state['teams']['red']['assets'].append('bargaining_chip')
-            if level == -2:
-                self.board_state['teams']['blue']['uk_gov']['resource'] -= 2
-                self.board_state['teams']['blue']['uk_gov']['vitality'] -= 2
-
-    def _do_attack(self, entity):
-        turn = self.board_state['turn']
-        for target_id, field in find_attack_targets(entity['id'], self.player_inputs):
-            attack_investment = int(self.player_inputs.get(field) or 0)
-            dice_roll = randint(1, 6)
-            attack_success = attack_result_table[attack_investment][dice_roll]
-            self.log(f"{entity['name']} spent {attack_investment} resources and rolled {dice_roll}.", 'action')
-
-            if attack_success > 0:
-                self._do_damage(target_id, attack_success, opposing_team(turn))
-            elif attack_success < 0:
-                self._do_damage(entity['id'], -attack_success, current_team(turn))
-                self._do_attribution(entity['id'], -attack_success)
-
-            entity['resource'] -= attack_investment
-            if entity['id'] == 'trolls':
-                if attack_investment >= 3:
-                    vp_cost = 1 if attack_investment < 5 else 2
-                    self.board_state['teams']['red']['entities']['rus_gov']['victory_points'] -= vp_cost
-                    self.log(f'Control the Trolls - Russian Government lost {vp_cost} VP because Online Trolls launched a large attack.', 'victory-point')
-                    if 'ransomware' in entity['traits'].get('assets', []):
-                        entity['victory_points'] += 4
-                        self.log('Success breeds confidence - Online Trolls gained 4 VPs because they launched a large attack '
-                                 'while having the Ransomware asset.', 'victory-point')
-
-    def _do_transfer(self, entity):
-        for target_id, field in find_transfer_targets(entity['id'], self.player_inputs):
-            transfer_amount = int(self.player_inputs.get(field) or 0)
-            target = self.get_entity(target_id)
-            target['resource'] += transfer_amount
-            entity['resource'] -= transfer_amount
-            if transfer_amount:
-                self.log(f"{entity['name']} sent {transfer_amount} resources to {target['name']}.", 'action')
-                if entity['id'] == 'elect':
-                    entity['victory_points'] -= 1
-                    self.log(f"Resist the drain - {entity['name']} lost 1 VP due to the transfer of resources.", 'victory-point')
-
-    def process_inputs(self):
-        teams = self.board_state['teams']
-        turn = self.board_state['turn']
-        team = teams[current_team(turn)]
-        asset = Asset(self.board_state)
-        if activated_assets := self.player_inputs.get('activated-assets'):
-            activated_asset_ids = map(int, activated_assets.split(', '))
-            used_assets = list()
-            for index in activated_asset_ids:
-                asset_id = team['assets'][index]
-                asset.resolve(asset_id, self.player_inputs.get('option-' + str(index), ''))
-                activated_asset = Asset.assets[asset_id]
-                self.log(f'Team {current_team(turn).capitalize()} activated asset {activated_asset[0]} - {activated_asset[2]}.', 'action')
-                used_assets.append(index)
-
-            used_assets.sort(reverse=True)
-            for index in used_assets:
-                del team['assets'][index]
-
-        bm_removal = list()
-        for index, bm_item in enumerate(self.board_state['black_market']):
-            asset, opposing_bid, old_bid = bm_item
-            bid = int(self.player_inputs.get(f'bm-bid-{index}') or 0)
-            if current_team(turn) == 'red':
-                team['entities']['scs']['resource'] -= bid
-            else:
-                team['entities']['gchq']['resource'] -= bid
-            asset_name = Asset.assets[asset][0]
-            if opposing_bid and not bid:
-                self.log(f"Team {opposing_team(turn).capitalize()}'s bid for {asset_name} was not contested - asset gained.", 'action')
-                self.board_state['teams'][opposing_team(turn)]['assets'].append(asset)
-                bm_removal.append(index)
-            elif bid:
-                self.log(f'Team {current_team(turn).capitalize()} bid {bid} for {asset_name}.', 'action')
-                self.board_state['black_market'][index] = asset, bid + old_bid, opposing_bid
-
-        for removed_index in reversed(bm_removal):
-            del self.board_state['black_market'][removed_index]
-
-        for entity in self.get_current_entities().values():
-            if action := self.player_inputs.get(entity['id'] + '__action'):
-                match action:
-                    case '' | 'none':
-                        pass
-                    case 'revitalize':
-                        self._do_revitalize(entity)
-                    case 'attack':
-                        self._do_attack(entity)
-                    case 'transfer':
-                        self._do_transfer(entity)
-
-            if entity['id'] == 'uk_gov' and entity['traits'].get('banking_error'):
-                entity['traits']['banking_error'] = False
-
-            if entity['id'] == 'scs' and entity['traits'].get('embargoed'):
-                entity['traits']['embargoed'] = False
-
-        for t, e, trait in (
-                ('blue', 'elect', 'education'), ('red', 'rus_gov', 'bargaining_chip'),
-                ('blue', 'plc', 'software_update'), ('blue', 'energy', 'software_update'), ('red', 'ros', 'software_update'),
-                ):
-            entity = teams[t]['entities'][e]
-            if entity['traits'].get(trait):
-                entity['traits'][trait] -= 1
-
-        plc = teams['blue']['entities']['plc']
-        if recovery := plc['traits'].get('recovery'):
-            if plc['vitality'] < recovery:
-                plc['vitality'] += 1
-            plc['traits']['recovery'] = plc['vitality']
-
-        for t, e in ('blue', 'energy'), ('red', 'ros'):
-            entity = teams[t]['entities'][e]
-            if entity['traits'].get('stuxnet'):
-                entity['traits']['stuxnet'] = False
-
-        for e in 'plc', 'elect':
-            entity = teams['blue']['entities'][e]
-            if entity['traits'].get('ransomware'):
-                entity['traits']['ransomware'] = False
-            if entity['traits'].get('paralyzed'):
-                entity['traits']['paralyzed'] -= 1
-
-    def give_resources(self):
-        entities = self.get_current_entities()
-        if entities.get('rus_gov', {}).get('traits', {}).get('people_revolt'):
-            rus_gov = entities['rus_gov']
-            rus_gov['traits']['people_revolt'] = False
-            self.log(f"Turn starts - {rus_gov['name']} gains no resources because of the People's revolt effect.", 'event')
-            return
-        gov_entity = entities.get('rus_gov') or entities.get('uk_gov')
-        gov_entity['resource'] += 3
-        self.log(f"Turn starts - {gov_entity['name']} gains 3 resources.", 'resource')
+    @classmethod
+    def submit_turn(cls, game_id, player, turn, inputs):
+        """Store a player's `TurnInputs` and resolve the turn once everyone is ready, returning (message, category) errors."""
+        game = cls.query.get_or_404(game_id)
+        if errors := game.perform_checks(turn, player, inputs):
+            return errors
+
+        game.ready_player(player, inputs)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return [('You already finished your turn - waiting for other players.', 'error')]
+
+        cls.resolve_turn(game_id, turn)
+        return []
+
+    @classmethod
+    def resolve_turn(cls, game_id, turn, timeout=False, attempts=5):
+        """Resolve the given turn of a game at most once, even when several workers try at the same time.
+
+        Every commit of a game compares and bumps its version, so the loser of a race gets a StaleDataError,
+        reloads the game and finds the turn already resolved.
+        """
+        for _ in range(attempts):
+            timer = turn_timer()
+            game = db.session.get(cls, game_id, populate_existing=True)
+            if game is None or game.board_state['turn'] != turn or not game.process_turn(timeout, timer):
+                db.session.rollback()
+                return False
+            try:
+                with timer.phase('commit') if timer else nullcontext():
+                    db.session.commit()
+                if timer:
+                    get_metrics().record_turn(game_id, turn, timer.phases)
+                return True
+            except (StaleDataError, IntegrityError):
+                db.session.rollback()
+        return False
+
+    def process_turn(self, timeout=False, timer=None):
+        if self.victor or not timeout and not self.all_players_ready():
+            return False
 
-    def progress_time(self, game_over):
+        phase = timer.phase if timer else (lambda name: nullcontext())
+        with phase('load_inputs'):
+            previous_state = copy_state(self.board_state)
+            player_inputs = self.collect_inputs()
         turn = self.board_state['turn']
-        if not game_over:
-            self.log(f'End of turn {turn // 2 + 1} for the {current_team(turn).capitalize()} team.', 'turn')
-        self.board_state['turn'] += 1
+        rng = turn_rng(self.seed, turn) if self.seed is not None else None
+        engine = self.engine(phase, rng)
+        engine.resolve_turn(player_inputs)
+        if rng is not None:
+            self.events.append(TurnEvent(turn=turn, inputs=player_inputs.to_dict(), draws=rng.draws, timeout=timeout))
+        record_stats(db.session, engine.tally)
+        if engine.victor:
+            self.victor = getattr(self, engine.victor + '_team')
+            self.finished = datetime.now()
+            self.publish('game-over', victor=self.victor.name)
+
         self.unpause_time = datetime.now()
         self.seconds_left = int(self.round_length.total_seconds())
+        self.__dict__.pop('ready_players', None)
 
-    def determine_winner(self):
-        teams = self.board_state['teams']
-        red_vps = total_vps(teams['red'])
-        blue_vps = total_vps(teams['blue'])
-        self.victor = self.red_team if red_vps > blue_vps else self.blue_team
-        self.log(f'Team {self.victor.name} won the game having {red_vps} VPs. The opposing team had {blue_vps} VPs.', 'important')
-
-    def enable_attacks(self):
-        self.log('Attacks enabled.', 'turn')
-        for entity in self.board_state['teams']['red']['entities'].values():
-            match entity['id']:
-                case 'bear':
-                    entity['attacks'] = ['plc']
-                case 'trolls':
-                    entity['attacks'] = ['elect']
-
-    def calculate_blue_victory_points(self, turn, entities):
-        if entities['elect']['resource'] >= 4:
-            entities['uk_gov']['victory_points'] += 1
-            self.log('Election time - UK Government gains 1 VP because a month ended with Electorate having 4 or more resources.', 'victory-point')
-        if turn == end_of_month(12) and entities['rus_gov']['vitality'] < 4:
-            self.log('Aggressive outlook - UK Government gains 5 VPs because the Russian Government '
-                     'ended the game with less vitality than it started with.', 'victory-point')
-            entities['uk_gov']['victory_points'] += 5
-
-        plc_triggers = get_ends_of_months(4, 8, 12)
-        if turn in plc_triggers:
-            index = plc_triggers.index(turn)
-            limit = (index + 1) * 3
-            amount_won = index + 2
-            if entities['plc']['resource'] >= limit:
-                entities['plc']['victory_points'] += amount_won
-                self.log(f'Weather the Brexit storm - UK PLC gains {amount_won} VP because it had '
-                         f'more than {limit} resources at the end of the quarter.', 'victory-point')
-
-        quarter_ends = get_ends_of_months(3, 6, 9, 12)
-        if turn in quarter_ends:
-            plc = entities['plc']
-            rd = plc['traits']['recruitment_drive']
-            if rd['vitality'] > plc['vitality']:
-                amount_won = 1 + 2 * rd['count']
-                plc['victory_points'] += 1 + 2 * rd['count']
-                rd['count'] += 1
-                self.log(f"Recruitment drive - UK PLC gains {amount_won} VP because it achieved vitality growth last {rd['count']} quarter(s).", 'victory-point')
-            else:
-                rd['count'] = 0
-            rd['vitality'] = plc['vitality']
-
-        year_halves = get_ends_of_months(6, 12)
-        if turn in year_halves:
-            index = year_halves.index(turn)
-            limit = 6 + index * 3
-            if entities['energy']['vitality'] >= limit:
-                amount_won = index + 2
-                entities['energy']['victory_points'] += amount_won
-                self.log(f'Grow capacity - UK Energy gains {amount_won} VP because has more than {limit} vitality.', 'victory-point')
-
-    @staticmethod
-    def _count_assets_of_type(assets, asset_type):
-        return len(list(filter(lambda a: a[1] == asset_type, Asset.get_assets(assets))))
-
-    def calculate_red_victory_points(self, turn, entities):
-        if entities['rus_gov']['resource'] >= 3:
-            entities['rus_gov']['victory_points'] += 1
-            self.log('Some animals are more equal than others - Russian Government gains 1 VP '
-                     'because it ended the month with more than 3 resources.', 'victory-point')
-
-        bear_triggers = get_ends_of_months(4, 8, 12)
-        if turn in bear_triggers:
-            bear = entities['bear']
-            index = bear_triggers.index(turn)
-            if bear['traits']['last_growth_vitality'] > bear['vitality']:
-                amount_won = 1 + index * 2
-                bear['traits']['last_growth_vitality'] = bear['vitality']
-                bear['victory_points'] += amount_won
-                self.log(f"Those who can't steal - Energetic Bear gains {amount_won} VP because it achieved vitality growth since last check.", 'victory-point')
-
-        if self._count_assets_of_type(self.board_state['teams']['blue']['assets'], 'defence') < self._count_assets_of_type(self.board_state['teams']['red']['assets'], 'attack'):
-            entities['scs']['victory_points'] += 2
-            self.log('Win the arms race - SCS gains 2 VPs because Russia has a better cyber arsenal than the UK.', 'victory-point')
-
-        quarter_ends = get_ends_of_months(3, 6, 9, 12)
-        if turn in quarter_ends:
-            ros = entities['ros']
-            gc = ros['traits']['grow_capacity']
-            if gc['vitality'] > ros['vitality']:
-                amount_won = 1 + 2 * gc['count']
-                ros['victory_points'] += 1 + 2 * gc['count']
-                gc['count'] += 1
-                self.log(f"Grow capacity - Rosenergoatom gains {amount_won} VP because "
-                         "it achieved vitality growth last {gc['count']} quarter(s).", 'victory-point')
-            else:
-                gc['count'] = 0
-            gc['vitality'] = ros['vitality']
-
-    def generate_bm_pool(self):
-        pool = list()
-        for k, v in Asset.assets.items():
-            pool.extend([k] * v[-1])
-        self.board_state['black_market_pool'] = pool
-
-    def get_new_bm_asset(self):
-        new_asset = choice(self.board_state['black_market_pool'])
-        self.board_state['black_market_pool'].remove(new_asset)
-        self.board_state['black_market'].append((new_asset, 0, 0))
+        with phase('snapshot'):
+            self.record_snapshot(previous_state)
+        self.publish('turn', **self.timer_state())
+        return True
 
-    def calculate_victory_points(self):
+    def record_snapshot(self, previous_state=None):
+        """Store a keyframe every `keyframe_interval` turns. Seeded games rebuild the turns in between by replaying
+        their turn events, older games store the difference to the previous state instead."""
         turn = self.board_state['turn']
-        teams = self.board_state['teams']
-        entities = dict(**teams['red']['entities'], **teams['blue']['entities'])
-        self.calculate_blue_victory_points(turn, entities)
-        self.calculate_red_victory_points(turn, entities)
-
-    def process_turn(self, inputs, timeout=False):
-        self.player_inputs.update(inputs)
-
-        if not timeout and not self.all_players_ready():
+        if previous_state is None or turn % self.keyframe_interval == 0:
+            self.snapshots.append(GameSnapshot(turn=turn, is_keyframe=True, data=copy_state(self.board_state)))
+        elif self.seed is None:
+            self.snapshots.append(GameSnapshot(turn=turn, is_keyframe=False, data=diff(previous_state, self.board_state)))
+
+    def replay_turn(self, state, event):
+        """Apply a recorded turn to `state` with the current rules, returning the engine that resolved it."""
+        engine = Engine(state, rng=turn_rng(self.seed, event.turn))
+        engine.resolve_turn(TurnInputs.from_dict(event.inputs))
+        return engine
+
+    def keyframe_turns(self):
+        if self.archived:
+            return [snapshot['turn'] for snapshot in self.archived_data()['snapshots'] if snapshot['is_keyframe']]
+        return [turn for turn, in db.session.query(GameSnapshot.turn).filter_by(game_id=self.id, is_keyframe=True)]
+
+    def recorded_snapshots(self, from_turn, to_turn):
+        if self.archived:
+            return [GameSnapshot(**snapshot) for snapshot in self.archived_data()['snapshots'] if from_turn <= snapshot['turn'] <= to_turn]
+        return self.snapshots.filter(GameSnapshot.turn.between(from_turn, to_turn)).options(undefer(GameSnapshot.data)).all()
+
+    def recorded_events(self, from_turn=0, to_turn=None):
+        to_turn = self.board_state['turn'] if to_turn is None else to_turn
+        if self.archived:
+            return [TurnEvent(**turn_event) for turn_event in self.archived_data()['events'] if from_turn <= turn_event['turn'] <= to_turn]
+        return self.events.filter(TurnEvent.turn.between(from_turn, to_turn)).all()
+
+    def _states(self, from_turn, to_turn):
+        """Yield (turn, state, draws_match) from the last keyframe at or before `from_turn` up to `to_turn`."""
+        keyframe_turn = max((turn for turn in self.keyframe_turns() if turn <= from_turn), default=None)
+        if keyframe_turn is None:
             return
-
-        self.process_inputs()
-        game_over = self.check_health()
-        if not self.victor:
-            turn = self.board_state['turn']
-            if turn == end_of_month(1):
-                self.enable_attacks()
-            elif turn == end_of_month(12):
-                self.determine_winner()
-
-            # end of month
-            if turn % 2 == 0:
-                self.calculate_victory_points()
+        snapshots = {snapshot.turn: snapshot for snapshot in self.recorded_snapshots(keyframe_turn, to_turn)}
+        events = {event.turn: event for event in self.recorded_events(keyframe_turn, to_turn - 1)}
+
+        state = copy_state(snapshots[keyframe_turn].data)
+        yield keyframe_turn, state, True
+        for turn in range(keyframe_turn, to_turn):
+            if event := events.get(turn):
+                draws_match = self.replay_turn(state, event).rng.draws == event.draws
+            elif (snapshot := snapshots.get(turn + 1)) is not None:
+                state = copy_state(snapshot.data) if snapshot.is_keyframe else patch(state, snapshot.data)
+                draws_match = True
             else:
-                self.process_event()
-                self.get_new_bm_asset()
+                return
+            yield turn + 1, state, draws_match
+
+    def state_at(self, turn):
+        state = None
+        for state_turn, state, _ in self._states(turn, turn):
+            pass
+        return state if state is not None and state['turn'] == turn else None
+
+    def history(self):
+        for _, state, _ in self._states(0, self.board_state['turn']):
+            yield copy_state(state)
+
+    def verify_replay(self):
+        """Replay the whole game with the current rules and return the turns whose outcome no longer matches.
+
+        A turn does not match when the rules drew different random values than recorded, or when the replayed
+        state differs from the stored keyframe or current board state.
+        """
+        keyframes = set(self.keyframe_turns())
+        mismatches = list()
+        for turn, state, draws_match in self._states(0, self.board_state['turn']):
+            expected = self.board_state if turn == self.board_state['turn'] else self.state_at(turn) if turn in keyframes else None
+            if not draws_match or expected is not None and state != expected:
+                mismatches.append(turn)
+        return mismatches
+
+    def replayed_tally(self):
+        """The analytics tally of the whole game, rebuilt by replaying its setup and turn events.
+
+        Games without a seed cannot be replayed, only their result is counted once they are finished.
+        """
+        if self.seed is None:
+            return game_end_tally(self.board_state, self.victor_color) if self.victor else Counter()
+        engine = Engine(new_board_state(self.scenario), rng=turn_rng(self.seed, None))
+        engine.setup()
+        tally = Counter(engine.tally)
+        state = engine.board_state
+        for turn_event in self.recorded_events(0, self.board_state['turn'] - 1):
+            tally.update(self.replay_turn(state, turn_event).tally)
+        return tally
+
+    @classmethod
+    def archivable(cls, finished_before):
+        """Finished games that are not archived yet and ended before `finished_before` - older games without an end
+        date count from their creation."""
+        return cls.query.filter(
+            cls.victor_id.isnot(None), cls.archived.is_(False), db.func.coalesce(cls.finished, cls.created) < finished_before,
+        ).order_by(cls.id)
+
+    def archive(self, codec):
+        """Move the board, snapshots, turn events and log of a finished game into one compressed GameArchive row.
+
+        Only a small summary stays uncompressed, the rest is decompressed on demand by `archived_data`.
+        """
+        payload = {
+            'board_state': self.board_state,
+            'snapshots': [
+                {'turn': snapshot.turn, 'is_keyframe': snapshot.is_keyframe, 'data': snapshot.data}
+                for snapshot in self.snapshots.options(undefer(GameSnapshot.data))
+            ],
+            'events': [
+                {'turn': event.turn, 'inputs': event.inputs, 'draws': event.draws, 'timeout': event.timeout}
+                for event in self.events
+            ],
+            'log': [
+                {'turn': entry.turn, 'seq': entry.seq, 'category': entry.category, 'message': entry.message}
+                for entry in self.log_entries
+            ],
+        }
+        data = compress(payload, codec)
+        self.archive_record = GameArchive(
+            codec=codec, data=data, size=len(json.dumps(payload)), compressed_size=len(data),
+            red_team=self.red_team.name, blue_team=self.blue_team.name, victor=self.victor.name,
+            red_vps=total_vps(self.board_state['teams']['red']), blue_vps=total_vps(self.board_state['teams']['blue']),
+            turns=self.board_state['turn'], created=self.created, finished=self.finished,
+        )
+        for model in (GameSnapshot, TurnEvent, LogEntry, TurnInput):
+            model.query.filter_by(game_id=self.id).delete(synchronize_session=False)
+        self.board_state = None
+        self.archived = True
+        return self.archive_record
+
+    def archived_data(self):
+        cache = get_archive_cache()
+        if (payload := cache.get(self.id)) is None:
+            codec, data = db.session.query(GameArchive.codec, GameArchive.data).filter_by(game_id=self.id).one()
+            payload = decompress(data, codec)
+            cache.put(self.id, payload)
+        return payload
+
+
+@event.listens_for(Game, 'load')
+@event.listens_for(Game, 'refresh')
+def _restore_archived_board(game, context, attrs=None):
+    # archived games keep their board in the archive, put it back whenever the row is (re)loaded
+    if game.__dict__.get('archived') and game.__dict__.get('board_state') is None:
+        set_committed_value(game, 'board_state', game.archived_data()['board_state'])
+
+
+class GameArchive(db.Model):
+    """Summary of an archived game, with everything else it stored compressed into `data`."""
+    __tablename__ = 'game_archive'
+
+    game_id = Column(ForeignKey('game.id'), primary_key=True)
+    red_team = Column(String, nullable=False)
+    blue_team = Column(String, nullable=False)
+    victor = Column(String, nullable=False)
+    red_vps = Column(Integer, nullable=False)
+    blue_vps = Column(Integer, nullable=False)
+    turns = Column(Integer, nullable=False)
+    created = Column(DateTime, nullable=False)
+    finished = Column(DateTime)
+    archived = Column(DateTime, default=datetime.now, nullable=False)
+    codec = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    compressed_size = Column(Integer, nullable=False)
+    data = deferred(Column(LargeBinary, nullable=False))
+
+
+class StatCounter(db.Model):
+    """Running totals of the cross-game analytics, one row per (kind, key) - e.g. ('events', 'lax_opsec')."""
+    __tablename__ = 'stat_counter'
+
+    kind = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    value = Column(Integer, default=0, nullable=False)
+
+    @classmethod
+    def increment(cls, session, tally):
+        dialect = session.get_bind().dialect.name
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        statement = insert(cls).values([{'kind': kind, 'key': key, 'value': value} for (kind, key), value in tally.items()])
+        session.execute(statement.on_conflict_do_update(index_elements=['kind', 'key'], set_={'value': cls.value + statement.excluded.value}))
+
+
+def record_stats(session, tally):
+    """Queue an analytics tally on the session - it is added to the totals in the same transaction once the session commits."""
+    if tally:
+        session.info.setdefault('stats', Counter()).update(tally)
+
+
+@event.listens_for(Session, 'before_commit')
+def _apply_stats(session):
+    if tally := session.info.pop('stats', None):
+        StatCounter.increment(session, tally)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_stats(session, previous_transaction):
+    session.info.pop('stats', None)
+
+
+class GameSnapshot(db.Model):
+    __tablename__ = 'game_snapshot'
+
+    game_id = Column(ForeignKey('game.id'), primary_key=True)
+    turn = Column(Integer, primary_key=True)
+    is_keyframe = Column(Boolean, nullable=False)
+    data = deferred(Column(JSON, nullable=False))
+
+
+class TurnEvent(db.Model):
+    """The merged inputs a turn was resolved with and the random draws the rules made, written once per turn."""
+    __tablename__ = 'turn_event'
+
+    game_id = Column(ForeignKey('game.id'), primary_key=True)
+    turn = Column(Integer, primary_key=True)
+    inputs = Column(JSON, nullable=False)
+    draws = Column(JSON, nullable=False)
+    timeout = Column(Boolean, default=False, nullable=False)
+    created = Column(DateTime, default=datetime.now, nullable=False)
+
+
+@event.listens_for(TurnEvent, 'before_update')
+def _prevent_turn_event_update(mapper, connection, target):
+    raise ValueError('Turn events are immutable.')
+
+
+class LogEntry(db.Model):
+    __tablename__ = 'log_entry'
+    __table_args__ = (
+        Index('ix_log_entry_game_turn_seq_category', 'game_id', 'turn', 'seq', 'category'),
+    )
+
+    game_id = Column(ForeignKey('game.id'), primary_key=True)
+    seq = Column(Integer, primary_key=True)
+    turn = Column(Integer, nullable=False)
+    category = Column(String, nullable=False)
+    message = Column(String, nullable=False)
 
-        self.progress_time(game_over)
+    def to_dict(self):
+        return {
+            'seq': self.seq,
+            'turn': self.turn,
+            'category': self.category,
+            'message': self.message,
+        }
 
-        self.give_resources()
 
-        self.ready_players.clear()
-        self.player_inputs.clear()
+class GameParticipant(db.Model):
+    __tablename__ = 'game_participant'
+    __table_args__ = (
+        UniqueConstraint('game_id', 'team', 'role'),
+        Index('ix_game_participant_user_game', 'user_id', 'game_id'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    game_id = Column(ForeignKey('game.id'), nullable=False)
+    game = relationship('Game', back_populates='participants')
+    user_id = Column(ForeignKey('user.id'), nullable=False)
+    user = relationship('User')
+    team = Column(String)
+    role = Column(String, nullable=False)
+
+
+@upgrade_step
+def add_participants(connection):
+    """List the owner and players of the games created before participants were recorded."""
+    game, team, participant = Game.__table__, Team.__table__, GameParticipant.__table__
+    games = connection.execute(
+        select(game.c.id, game.c.owner_id, game.c.red_team_id, game.c.blue_team_id).where(game.c.id.not_in(select(participant.c.game_id)))
+    ).all()
+    if not games:
+        return
+    teams = {row.id: row for row in connection.execute(select(team))}
+    rows = list()
+    for game_id, owner_id, red_team_id, blue_team_id in games:
+        rows.append({'game_id': game_id, 'user_id': owner_id, 'team': None, 'role': 'owner'})
+        for side, team_id in (('red', red_team_id), ('blue', blue_team_id)):
+            for entity_type in entity_types:
+                rows.append({'game_id': game_id, 'user_id': getattr(teams[team_id], entity_type + '_player_id'), 'team': side, 'role': entity_type})
+    connection.execute(participant.insert(), rows)
+
+
+def legacy_table(connection, table_name, *columns):
+    """The table with the columns that earlier versions wrote and the models no longer map, or None without them."""
+    existing = {existing['name'] for existing in inspect(connection).get_columns(table_name)}
+    if all(legacy.name in existing for legacy in columns):
+        return table(table_name, column('id', Integer), *columns)
+
+
+@upgrade_step
+def migrate_message_logs(connection):
+    """Copy the message logs that earlier versions kept in a JSON column of the game into log entries."""
+    if (legacy := legacy_table(connection, 'game', column('message_log', JSON))) is None:
+        return
+    game, log_entry = Game.__table__, LogEntry.__table__
+    games = connection.execute(select(legacy.c.id, legacy.c.message_log).where(legacy.c.id.not_in(select(log_entry.c.game_id)))).all()
+    for game_id, messages in games:
+        if not messages:
+            continue
+        # the old log did not record the turns
+        connection.execute(log_entry.insert(), [
+            {'game_id': game_id, 'seq': seq, 'turn': 0, 'message': message, 'category': category}
+            for seq, (message, category) in enumerate(messages, start=1)
+        ])
+        connection.execute(update(game).where(game.c.id == game_id).values(log_seq=len(messages)))
+
+
+@upgrade_step
+def migrate_history(connection):
+    """Store the board states that earlier versions kept in a JSON column of the game as snapshots.
+
+    The old games are unseeded, so like theirs the turns between the keyframes are stored as differences.
+    """
+    if (legacy := legacy_table(connection, 'game', column('history', JSON), column('board_state', JSON))) is None:
+        return
+    snapshot = GameSnapshot.__table__
+    games = connection.execute(
+        select(legacy.c.id, legacy.c.history, legacy.c.board_state).where(legacy.c.id.not_in(select(snapshot.c.game_id)))
+    ).all()
+    for game_id, history, board_state in games:
+        states = {state['turn']: state for state in [*(history or ()), board_state] if state and 'turn' in state}
+        rows, previous = list(), None
+        for turn, state in sorted(states.items()):
+            if previous is None or previous['turn'] != turn - 1 or turn % Game.keyframe_interval == 0:
+                rows.append({'game_id': game_id, 'turn': turn, 'is_keyframe': True, 'data': state})
+            else:
+                rows.append({'game_id': game_id, 'turn': turn, 'is_keyframe': False, 'data': diff(previous, state)})
+            previous = state
+        if rows:
+            connection.execute(snapshot.insert(), rows)
+
 
-        self.history.append(self.board_state)
+class TurnInput(db.Model):
+    __tablename__ = 'turn_input'
 
-    def process_event(self):
-        event = Event(self.board_state)
-        description = event.handle()
-        self.log(description, 'event')
+    game_id = Column(ForeignKey('game.id'), primary_key=True)
+    turn = Column(Integer, primary_key=True)
+    user_id = Column(ForeignKey('user.id'), primary_key=True)
+    inputs = Column(JSON, nullable=False)
+    created = Column(DateTime, default=datetime.now, nullable=False)
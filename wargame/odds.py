@@ -0,0 +1,210 @@
+from time import perf_counter
+
+import numpy as np
+
+from .engine import BoardIndex
+from .utils import (
+    Event, Asset, attack_result_table, calculate_max_revitalization, end_of_month, entity_ids_by_team, vitality_recovery_cost,
+)
+
+entity_ids = entity_ids_by_team['red'] + entity_ids_by_team['blue']
+entity_index = {entity_id: index for index, entity_id in enumerate(entity_ids)}
+team_slices = {'red': slice(0, 5), 'blue': slice(5, 10)}
+governments = {'red': entity_index['rus_gov'], 'blue': entity_index['uk_gov']}
+
+attack_table = np.array(attack_result_table)
+recovery_cost = np.array(vitality_recovery_cost)
+max_revitalization = np.array([calculate_max_revitalization(resource) for resource in range(7)])
+enabled_attacks = (('bear', 'plc'), ('trolls', 'elect'))
+
+
+def _event_effects():
+    """Run every event against a zeroed board to learn its vitality and resource deltas per entity."""
+    events = Event.events()
+    vitality = np.zeros((len(events), len(entity_ids)), dtype=np.int64)
+    resource = np.zeros_like(vitality)
+    for index, name in enumerate(events):
+        board_state = {'teams': {
+            team: {'entities': {entity_id: {'vitality': 0, 'resource': 0, 'traits': {}} for entity_id in ids}}
+            for team, ids in entity_ids_by_team.items()
+        }}
+        getattr(Event(board_state), name)()
+        for team in board_state['teams'].values():
+            for entity_id, entity in team['entities'].items():
+                vitality[index, entity_index[entity_id]] = entity['vitality']
+                resource[index, entity_index[entity_id]] = entity['resource']
+    return vitality, resource
+
+
+event_vitality, event_resource = _event_effects()
+
+
+class Board:
+    """Array view of the parts of a board state that the rollouts simulate."""
+
+    def __init__(self, board_state):
+        entities = {**board_state['teams']['red']['entities'], **board_state['teams']['blue']['entities']}
+        self.turn = board_state['turn']
+        self.vitality = np.array([entities[e]['vitality'] for e in entity_ids])
+        self.resource = np.array([entities[e]['resource'] for e in entity_ids])
+        self.victory_points = np.array([entities[e]['victory_points'] for e in entity_ids])
+
+        index = BoardIndex(board_state)
+        self.connections = np.zeros((len(entity_ids), len(entity_ids)), dtype=np.int64)
+        for entity_id, neighbours in index.neighbours.items():
+            for target in neighbours:
+                self.connections[entity_index[entity_id], entity_index[target]] = 1
+        self.attacks = [(entity_index[attacker], entity_index[target]) for attacker, targets in index.attacks.items() for target in targets]
+
+        self.direct_multiplier = np.ones(len(entity_ids), dtype=np.int64)
+        self.direct_divisor = np.ones(len(entity_ids), dtype=np.int64)
+        self.splash_divisor = np.full(len(entity_ids), 2)
+        self.splash_immune = np.zeros(len(entity_ids), dtype=bool)
+        for entity_id, entity in entities.items():
+            index, traits = entity_index[entity_id], entity['traits']
+            if traits.get('software_update'):
+                self.direct_multiplier[index] = 0
+            if traits.get('stuxnet'):
+                self.direct_multiplier[index] *= 2
+            if traits.get('education') or traits.get('bargaining_chip'):
+                self.direct_divisor[index] = 2
+            if traits.get('education'):
+                self.splash_divisor[index] = 4
+            if traits.get('network_policy'):
+                self.splash_immune[index] = True
+
+        self.arms_race = _count_assets(board_state, 'blue', 'defence') < _count_assets(board_state, 'red', 'attack')
+
+
+def _count_assets(board_state, team, asset_type):
+    return sum(1 for asset in Asset.get_assets(board_state['teams'][team]['assets']) if asset[1] == asset_type)
+
+
+def _damage(board, vitality, target, amount):
+    vitality[:, target] -= amount * board.direct_multiplier[target] // board.direct_divisor[target]
+    splash = amount[:, None] // board.splash_divisor[None, :] * board.connections[target][None, :]
+    vitality -= splash * ~board.splash_immune
+
+
+def _rollout_batch(board, rollouts, rng, attack_probability=0.4, revitalize_probability=0.3):
+    vitality = np.tile(board.vitality, (rollouts, 1))
+    resource = np.tile(board.resource, (rollouts, 1))
+    victory_points = np.tile(board.victory_points, (rollouts, 1))
+    running = np.ones(rollouts, dtype=bool)
+    attacks = list(board.attacks)
+    rus_gov, uk_gov, scs, trolls = (entity_index[e] for e in ('rus_gov', 'uk_gov', 'scs', 'trolls'))
+
+    for turn in range(board.turn, 24):
+        team = ('red', 'blue')[turn % 2]
+        acting = team_slices[team]
+
+        attacked = np.zeros((rollouts, len(entity_ids)), dtype=bool)
+        for attacker, target in attacks:
+            if acting.start <= attacker < acting.stop:
+                available = resource[:, attacker].clip(0, 6)
+                attacking = running & (rng.random(rollouts) < attack_probability)
+                investment = (rng.random(rollouts) * (available + 1)).astype(np.int64) * attacking
+                outcome = attack_table[investment, rng.integers(1, 7, rollouts)] * attacking
+                resource[:, attacker] -= investment
+                _damage(board, vitality, target, outcome.clip(0, None))
+                _damage(board, vitality, attacker, (-outcome).clip(0, None))
+                if attacker == trolls:
+                    victory_points[:, rus_gov] -= (investment >= 3) * np.where(investment < 5, 1, 2)
+                attacked[:, attacker] |= attacking
+
+        revitalizing = running[:, None] & ~attacked[:, acting] & (rng.random((rollouts, 5)) < revitalize_probability)
+        limit = max_revitalization[resource[:, acting].clip(0, 6)]
+        amount = (rng.random((rollouts, 5)) * (limit + 1)).astype(np.int64) * revitalizing
+        vitality[:, acting] += amount
+        resource[:, acting] -= recovery_cost[amount]
+
+        fatal = vitality <= 0
+        over = running & fatal.any(axis=1)
+        victory_points[:, rus_gov] += 10 * fatal[:, team_slices['blue']].sum(axis=1) * over
+        victory_points[:, uk_gov] += 10 * fatal[:, team_slices['red']].sum(axis=1) * over
+        running &= ~over
+
+        if turn == end_of_month(1):
+            attacks.extend((entity_index[attacker], entity_index[target]) for attacker, target in enabled_attacks)
+        if turn % 2 == 0:
+            victory_points[:, uk_gov] += (resource[:, entity_index['elect']] >= 4) * running
+            victory_points[:, rus_gov] += (resource[:, rus_gov] >= 3) * running
+            victory_points[:, scs] += 2 * board.arms_race * running
+        else:
+            event = rng.integers(0, len(event_vitality), rollouts)
+            vitality += event_vitality[event] * running[:, None]
+            resource += event_resource[event] * running[:, None]
+
+        next_government = governments[('red', 'blue')[(turn + 1) % 2]]
+        resource[:, next_government] += 3 * running
+
+    return victory_points[:, team_slices['red']].sum(axis=1), victory_points[:, team_slices['blue']].sum(axis=1)
+
+
+def _distribution(values):
+    percentiles = np.percentile(values, (10, 50, 90))
+    low, high = int(values.min()), int(values.max())
+    counts = np.bincount(values - low, minlength=high - low + 1)
+    return {
+        'mean': float(values.mean()),
+        'p10': float(percentiles[0]),
+        'p50': float(percentiles[1]),
+        'p90': float(percentiles[2]),
+        'histogram': {str(vps): int(count) for vps, count in enumerate(counts, low) if count},
+    }
+
+
+def estimate_odds(board_state, rollouts=None, budget=0.05, batch_size=512, seed=None):
+    """Estimate the win probability and final VP distribution by simulating the remaining turns.
+
+    Simulates batches of `batch_size` random rollouts until `rollouts` were played or, when no rollout count is
+    given, for as long as another batch still fits into `budget` seconds.
+    """
+    started = perf_counter()
+    rng = np.random.default_rng(seed)
+    board = Board(board_state)
+
+    red_batches, blue_batches = list(), list()
+    played = 0
+    while True:
+        batch_started = perf_counter()
+        size = batch_size if rollouts is None else min(batch_size, rollouts - played)
+        red_vps, blue_vps = _rollout_batch(board, size, rng)
+        red_batches.append(red_vps)
+        blue_batches.append(blue_vps)
+        played += size
+        if rollouts is not None:
+            if played >= rollouts:
+                break
+        elif 2 * perf_counter() - batch_started - started >= budget:
+            break
+
+    red_vps, blue_vps = np.concatenate(red_batches), np.concatenate(blue_batches)
+    red_wins = float((red_vps > blue_vps).mean())
+    return {
+        'rollouts': played,
+        'seconds': perf_counter() - started,
+        'winProbability': {'red': red_wins, 'blue': 1 - red_wins},
+        'victoryPoints': {'red': _distribution(red_vps), 'blue': _distribution(blue_vps)},
+    }
+
+
+def estimate_attacks(board_state):
+    """Exact expected outcome of every attack currently available, for each possible investment."""
+    board = Board(board_state)
+    outcomes = attack_table[:, 1:]
+    hits, backfires = outcomes.clip(0, None), (-outcomes).clip(0, None)
+
+    estimates = list()
+    for attacker, target in board.attacks:
+        direct = hits * board.direct_multiplier[target] // board.direct_divisor[target]
+        estimates.append({
+            'attacker': entity_ids[attacker],
+            'target': entity_ids[target],
+            'successChance': (outcomes > 0).mean(axis=1).tolist(),
+            'backfireChance': (outcomes < 0).mean(axis=1).tolist(),
+            'expectedDamage': direct.mean(axis=1).tolist(),
+            'expectedSplash': (hits // 2).mean(axis=1).tolist(),
+            'expectedBackfire': backfires.mean(axis=1).tolist(),
+        })
+    return estimates
@@ -0,0 +1,62 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+default_method = 'pbkdf2:sha256:260000'
+
+
+class PasswordHasher:
+    """Hashes and checks passwords on a bounded pool of threads.
+
+    PBKDF2 releases the GIL, so the pool caps how many hashes run at once in the worker - a burst of logins queues
+    up for the pool instead of every request thread of the worker competing for the CPU at the same time.
+    """
+
+    def __init__(self, method=default_method, workers=2):
+        self.method = method
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        # created on first use, so that workers forked from a preloaded app do not inherit a dead pool
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='password-hash')
+            return self._executor
+
+    def hash(self, password):
+        return self.executor.submit(generate_password_hash, password, self.method).result()
+
+    def verify(self, password_hash, password):
+        return self.executor.submit(check_password_hash, password_hash, password).result()
+
+    def needs_rehash(self, password_hash):
+        """Whether the hash was made with a different method or cost than the configured one."""
+        return password_hash.split('$', 1)[0] != normalize_method(self.method)
+
+
+def normalize_method(method):
+    """The method as werkzeug records it in the hash - `pbkdf2:sha256` is stored with its default iterations."""
+    if method.startswith('pbkdf2:') and method.count(':') == 1:
+        return f'{method}:{DEFAULT_PBKDF2_ITERATIONS}'
+    return method
+
+
+def default_workers():
+    # the pool is per worker process, share the cores between the workers gunicorn runs
+    return max(1, (os.cpu_count() or 1) // int(os.environ.get('WEB_CONCURRENCY', 1)))
+
+
+def init_app(app):
+    app.config.setdefault('PASSWORD_HASH_METHOD', os.environ.get('WARGAME_PASSWORD_HASH_METHOD', default_method))
+    app.config.setdefault('PASSWORD_HASH_WORKERS', int(os.environ.get('WARGAME_PASSWORD_HASH_WORKERS', default_workers())))
+    app.extensions['wargame_password_hasher'] = PasswordHasher(app.config['PASSWORD_HASH_METHOD'], app.config['PASSWORD_HASH_WORKERS'])
+
+
+def get_hasher():
+    return current_app.extensions['wargame_password_hasher']
@@ -0,0 +1,44 @@
+import json
+
+import click
+from flask.cli import with_appcontext
+
+from .db import db
+from .models import Game
+from .utils import total_vps
+
+
+@click.command('replay')
+@click.argument('game_id', type=int, required=False)
+@click.option('--turn', type=int, help='Rebuild the board state at the start of this turn instead of the current one.')
+@click.option('--verify', is_flag=True, help='Replay the recorded turns with the current rules and report where they diverge.')
+@click.option('--output', type=click.Path(dir_okay=False, writable=True), help='Write the rebuilt board state to this file.')
+@with_appcontext
+def replay_command(game_id, turn, verify, output):
+    """Rebuild a game from its keyframes and recorded turns, or check that the current rules still reproduce it.
+
+    Without GAME_ID, --verify checks every seeded game.
+    """
+    if verify:
+        query = Game.query.filter(Game.seed.isnot(None)) if game_id is None else Game.query.filter_by(id=game_id)
+        diverged = 0
+        for game in query:
+            if mismatches := game.verify_replay():
+                diverged += 1
+                click.echo(f'Game {game.id} diverges from turn {mismatches[0]} (turns {", ".join(map(str, mismatches))}).')
+            else:
+                click.echo(f"Game {game.id} reproduces all {game.board_state['turn']} turns.")
+            db.session.expunge_all()
+        raise SystemExit(1 if diverged else 0)
+
+    if game_id is None:
+        raise click.UsageError('GAME_ID is required unless --verify is given.')
+    if (game := db.session.get(Game, game_id)) is None:
+        raise click.ClickException(f'Game {game_id} does not exist.')
+    turn = game.board_state['turn'] if turn is None else turn
+    if (state := game.state_at(turn)) is None:
+        raise click.ClickException(f'Game {game_id} cannot be rebuilt at turn {turn}.')
+    if output:
+        with open(output, 'w') as f:
+            json.dump(state, f, indent=2)
+    click.echo(f"Game {game_id} at turn {turn}: Red {total_vps(state['teams']['red'])} VPs, Blue {total_vps(state['teams']['blue'])} VPs.")
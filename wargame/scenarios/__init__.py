@@ -0,0 +1,49 @@
+import os
+from functools import cache
+from json import load
+from types import MappingProxyType
+
+scenario_dir = os.path.dirname(os.path.abspath(__file__))
+default_scenario = 'default'
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _thaw(value):
+    if type(value) is MappingProxyType:
+        return {key: _thaw(item) for key, item in value.items()}
+    if type(value) is tuple:
+        return [_thaw(item) for item in value]
+    return value
+
+
+def copy_state(value):
+    """Structural copy of a board state - much cheaper than `copy.deepcopy` for plain JSON data."""
+    if isinstance(value, dict):
+        return {key: copy_state(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [copy_state(item) for item in value]
+    return value
+
+
+def available_scenarios():
+    return sorted(name[:-len('.json')] for name in os.listdir(scenario_dir) if name.endswith('.json'))
+
+
+@cache
+def get_scenario(name=default_scenario):
+    """Parse a scenario file once into a read-only template shared by the whole process."""
+    if name not in available_scenarios():
+        raise KeyError(f'Unknown scenario {name!r}')
+    with open(os.path.join(scenario_dir, name + '.json')) as f:
+        return _freeze(load(f))
+
+
+def new_board_state(name=default_scenario):
+    return _thaw(get_scenario(name))
@@ -0,0 +1,168 @@
+import heapq
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from fcntl import LOCK_EX, LOCK_NB, flock
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy.orm import defer
+
+from . import events
+from .db import db
+from .models import Game
+
+logger = logging.getLogger(__name__)
+
+
+class TurnScheduler:
+    """Resolves timed out turns once their deadline passes, instead of waiting for someone to open the board.
+
+    Deadlines are kept in a heap and re-armed from the pause, unpause and turn events of every game. A periodic
+    rescan of unfinished games catches events published by processes that do not share the event broker.
+    The same events start the bots seated in the team on turn.
+    """
+
+    grace_period = 5
+    retry_delay = 1
+
+    def __init__(self, app, rescan_interval=10):
+        self.app = app
+        self.rescan_interval = rescan_interval
+        self.bots = app.extensions['wargame_bots']
+        self._heap = list()
+        self._deadlines = dict()
+        self._stopped = threading.Event()
+
+    def arm(self, game_id, turn, deadline):
+        self._deadlines[game_id] = (turn, deadline)
+        heapq.heappush(self._heap, (deadline, game_id, turn))
+
+    def disarm(self, game_id):
+        self._deadlines.pop(game_id, None)
+
+    def arm_game(self, game, turn=None):
+        if game.victor_id is not None or game.is_paused:
+            self.disarm(game.id)
+        else:
+            turn = game.board_state['turn'] if turn is None else turn
+            self.arm(game.id, turn, time.time() + game.time_left() + self.grace_period)
+
+    def rescan(self):
+        # Only the turn is read from the board state, the database extracts it from the JSON document
+        query = db.session.query(Game, Game.board_state['turn'].as_integer()).options(defer(Game.board_state))
+        for game, turn in query.filter(Game.victor_id.is_(None)):
+            self.arm_game(game, turn)
+            self.bots.schedule(self.app, game.id, turn)
+        db.session.remove()
+
+    def handle_event(self, name, data):
+        game_id = data.get('gameId')
+        if name == 'game-over' or name == 'pause':
+            self.disarm(game_id)
+        elif name in ('unpause', 'turn') and not data['isPaused']:
+            self.arm(game_id, data['turn'], time.time() + data['secondsLeft'] + self.grace_period)
+        if name == 'game-over':
+            self.bots.forget(game_id)
+        elif name in ('unpause', 'turn'):
+            self.bots.schedule(self.app, game_id, data['turn'])
+
+    def fire(self, game_id, turn):
+        game = db.session.get(Game, game_id)
+        if game is None or game.victor_id is not None or game.board_state['turn'] != turn:
+            self.disarm(game_id)
+        elif game.is_paused or game.time_left() > -self.grace_period:
+            self.arm_game(game)
+        else:
+            logger.info('Resolving timed out turn %s of game %s', turn, game_id)
+            Game.resolve_turn(game_id, turn, timeout=True)
+            self.arm_game(db.session.get(Game, game_id, populate_existing=True))
+        db.session.remove()
+
+    def _due(self):
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            deadline, game_id, turn = heapq.heappop(self._heap)
+            if self._deadlines.get(game_id) == (turn, deadline):
+                yield game_id, turn
+
+    def run(self):
+        with self.app.app_context():
+            broker = events.get_broker()
+            cursor = broker.cursor(events.all_games)
+            next_rescan = 0
+            while not self._stopped.is_set():
+                try:
+                    cursor, next_rescan = self._step(broker, cursor, next_rescan)
+                except Exception:
+                    # e.g. a locked database - nothing restarts the thread, so it has to outlive the failure
+                    logger.exception('Turn scheduler failed, retrying in %s seconds', self.retry_delay)
+                    db.session.remove()
+                    self._stopped.wait(self.retry_delay)
+
+    def _step(self, broker, cursor, next_rescan):
+        if time.time() >= next_rescan:
+            self.rescan()
+            next_rescan = time.time() + self.rescan_interval
+
+        for game_id, turn in list(self._due()):
+            try:
+                self.fire(game_id, turn)
+            except Exception:
+                logger.exception('Failed to resolve turn %s of game %s', turn, game_id)
+                db.session.remove()
+
+        wake_up = min(next_rescan, self._heap[0][0] if self._heap else next_rescan)
+        messages, cursor = broker.listen(events.all_games, cursor, max(wake_up - time.time(), 0))
+        for _, name, data in messages:
+            self.handle_event(name, data)
+        return cursor, next_rescan
+
+    def run_elected(self, lock_path):
+        """Run once this process holds the lock at `lock_path`, so that only one process per host schedules turns.
+
+        The others keep trying every rescan interval and take over when the holder exits.
+        """
+        os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+        with open(lock_path, 'a') as lock:
+            while not self._stopped.is_set():
+                try:
+                    flock(lock, LOCK_EX | LOCK_NB)
+                except BlockingIOError:
+                    self._stopped.wait(self.rescan_interval)
+                    continue
+                logger.info('Process %s is running the turn scheduler', os.getpid())
+                self.run()
+
+    def stop(self):
+        self._stopped.set()
+
+
+def init_app(app):
+    app.config.setdefault('SCHEDULER', os.environ.get('WARGAME_SCHEDULER', 'thread'))
+    app.config.setdefault('SCHEDULER_RESCAN_INTERVAL', 10)
+    app.config.setdefault('SCHEDULER_LOCK_PATH', os.environ.get('WARGAME_SCHEDULER_LOCK_PATH', os.path.join(app.instance_path, 'scheduler.lock')))
+    if app.config['SCHEDULER'] != 'thread':
+        return
+
+    @app.before_request
+    def start_scheduler_thread():
+        if 'wargame_scheduler' in app.extensions:
+            return
+        scheduler = app.extensions.setdefault('wargame_scheduler', TurnScheduler(app, app.config['SCHEDULER_RESCAN_INTERVAL']))
+        threading.Thread(target=scheduler.run_elected, args=(app.config['SCHEDULER_LOCK_PATH'],), name='turn-scheduler', daemon=True).start()
+
+
+@click.command('scheduler')
+@with_appcontext
+def scheduler_command():
+    """Run the turn timeout scheduler in the foreground."""
+    scheduler = TurnScheduler(current_app._get_current_object(), current_app.config['SCHEDULER_RESCAN_INTERVAL'])
+    click.echo(f'Turn scheduler started at {datetime.now():%H:%M:%S}.')
+    try:
+        scheduler.run_elected(current_app.config['SCHEDULER_LOCK_PATH'])
+    except KeyboardInterrupt:
+        scheduler.stop()
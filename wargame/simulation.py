@@ -0,0 +1,150 @@
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from importlib import import_module
+from random import Random
+from time import perf_counter
+
+import click
+
+from .engine import Engine
+from .inputs import TurnInputs
+from .scenarios import default_scenario, new_board_state
+from .utils import calculate_max_revitalization, current_team, total_vps
+
+
+def passive_policy(board_state, team, rng):
+    return TurnInputs()
+
+
+def _spend(rng, targets, budget):
+    amounts = dict()
+    for target in targets:
+        amounts[target] = rng.randint(0, budget)
+        budget -= amounts[target]
+    return amounts
+
+
+def random_policy(board_state, team, rng):
+    inputs = TurnInputs()
+    for entity_id, entity in board_state['teams'][team]['entities'].items():
+        actions = ['none', 'revitalize']
+        if entity.get('attacks'):
+            actions.append('attack')
+        if entity.get('connections'):
+            actions.append('transfer')
+        orders = inputs.order(entity_id)
+        orders.action = rng.choice(actions)
+
+        resource = max(entity['resource'], 0)
+        if orders.action == 'attack':
+            orders.attacks = _spend(rng, entity['attacks'], min(resource, 6))
+        elif orders.action == 'transfer':
+            orders.transfers = _spend(rng, entity['connections'], min(resource, 5))
+        elif orders.action == 'revitalize':
+            orders.revitalize = rng.randint(0, calculate_max_revitalization(resource))
+    return inputs
+
+
+def aggressive_policy(board_state, team, rng):
+    inputs = TurnInputs()
+    for entity_id, entity in board_state['teams'][team]['entities'].items():
+        resource = max(entity['resource'], 0)
+        if entity.get('attacks') and resource:
+            inputs.order(entity_id).action = 'attack'
+            inputs.order(entity_id).attacks = {entity['attacks'][0]: min(resource, 6)}
+        elif entity['vitality'] < 4:
+            inputs.order(entity_id).action = 'revitalize'
+            inputs.order(entity_id).revitalize = min(calculate_max_revitalization(resource), 4 - entity['vitality'])
+    return inputs
+
+
+policies = {
+    'passive': passive_policy,
+    'random': random_policy,
+    'aggressive': aggressive_policy,
+}
+
+
+def resolve_policy(name):
+    """Look up a built-in policy by name, or import one given as `module:function`."""
+    if name in policies:
+        return policies[name]
+    module, _, attribute = name.partition(':')
+    return getattr(import_module(module), attribute)
+
+
+def play_game(seed, red_policy='random', blue_policy='random', scenario=default_scenario):
+    rng = Random(seed)
+    board_state = new_board_state(scenario)
+    team_policies = {'red': resolve_policy(red_policy), 'blue': resolve_policy(blue_policy)}
+
+    engine = Engine(board_state, rng=rng)
+    engine.setup()
+    while engine.victor is None and board_state['turn'] < 24:
+        team = current_team(board_state['turn'])
+        engine.resolve_turn(team_policies[team](board_state, team, rng))
+
+    teams = board_state['teams']
+    return engine.victor, total_vps(teams['red']), total_vps(teams['blue']), board_state['turn']
+
+
+def _play_batch(seeds, red_policy, blue_policy, scenario):
+    victors = Counter()
+    vps = {'red': 0, 'blue': 0}
+    turns = 0
+    for seed in seeds:
+        victor, red_vps, blue_vps, last_turn = play_game(seed, red_policy, blue_policy, scenario)
+        victors[victor] += 1
+        vps['red'] += red_vps
+        vps['blue'] += blue_vps
+        turns += last_turn
+    return victors, vps, turns
+
+
+def simulate(games, red_policy='random', blue_policy='random', seed=None, workers=None, batch_size=250, scenario=default_scenario):
+    seed = Random().randrange(2 ** 32) if seed is None else seed
+    batches = [range(start, min(start + batch_size, games)) for start in range(0, games, batch_size)]
+    batches = [[seed + index for index in batch] for batch in batches]
+
+    victors = Counter()
+    vps = {'red': 0, 'blue': 0}
+    turns = 0
+    started = perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_play_batch, batch, red_policy, blue_policy, scenario) for batch in batches]
+        for future in futures:
+            batch_victors, batch_vps, batch_turns = future.result()
+            victors.update(batch_victors)
+            vps['red'] += batch_vps['red']
+            vps['blue'] += batch_vps['blue']
+            turns += batch_turns
+    elapsed = perf_counter() - started
+
+    return {
+        'games': games,
+        'seed': seed,
+        'scenario': scenario,
+        'seconds': elapsed,
+        'games_per_second': games / elapsed if elapsed else 0,
+        'win_rate': {team: victors[team] / games for team in ('red', 'blue')},
+        'average_vps': {team: vps[team] / games for team in ('red', 'blue')},
+        'average_turns': turns / games,
+    }
+
+
+@click.command('simulate')
+@click.option('-n', '--games', default=1000, show_default=True, help='Number of games to play.')
+@click.option('--red', 'red_policy', default='random', show_default=True, help='Red team policy name or module:function.')
+@click.option('--blue', 'blue_policy', default='random', show_default=True, help='Blue team policy name or module:function.')
+@click.option('--seed', type=int, help='Seed of the first game, following games use consecutive seeds.')
+@click.option('--scenario', default=default_scenario, show_default=True, help='Name of the scenario file to play.')
+@click.option('--workers', type=int, default=os.cpu_count(), show_default=True, help='Number of worker processes.')
+def simulate_command(games, red_policy, blue_policy, seed, scenario, workers):
+    """Play games between scripted policies and report throughput and win rates."""
+    report = simulate(games, red_policy, blue_policy, seed, workers, scenario=scenario)
+    click.echo(f"Played {report['games']} games in {report['seconds']:.2f}s "
+               f"({report['games_per_second']:.0f} games/s, seed {report['seed']}).")
+    for team in ('red', 'blue'):
+        click.echo(f"{team.capitalize():>5} - win rate {report['win_rate'][team]:.1%}, average VPs {report['average_vps'][team]:.2f}")
+    click.echo(f"Average game length: {report['average_turns']:.1f} turns")
@@ -0,0 +1,76 @@
+from .scenarios import copy_state
+
+
+def _escape(key):
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+
+def _unescape(token):
+    return token.replace('~1', '/').replace('~0', '~')
+
+
+def diff(old, new, path=''):
+    """Return a JSON patch (RFC 6902 add/remove/replace operations) that turns `old` into `new`.
+
+    Dictionaries are compared key by key. Lists are trimmed of their common prefix and suffix so that
+    removing a single element (e.g. drawing from the black market pool) produces a single operation.
+    """
+    if isinstance(old, list) and isinstance(new, list):
+        return _diff_lists(old, new, path)
+    if isinstance(old, dict) and isinstance(new, dict):
+        operations = list()
+        for key in old.keys() - new.keys():
+            operations.append({'op': 'remove', 'path': f'{path}/{_escape(key)}'})
+        for key, value in new.items():
+            key_path = f'{path}/{_escape(key)}'
+            if key not in old:
+                operations.append({'op': 'add', 'path': key_path, 'value': value})
+            elif old[key] != value:
+                operations.extend(diff(old[key], value, key_path))
+        return operations
+    if old == new:
+        return []
+    return [{'op': 'replace', 'path': path, 'value': new}]
+
+
+def _diff_lists(old, new, path):
+    prefix = 0
+    while prefix < min(len(old), len(new)) and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < min(len(old), len(new)) - prefix and old[-suffix - 1] == new[-suffix - 1]:
+        suffix += 1
+    old_middle = old[prefix:len(old) - suffix]
+    new_middle = new[prefix:len(new) - suffix]
+
+    if len(old_middle) == len(new_middle):
+        operations = list()
+        for index, (old_item, new_item) in enumerate(zip(old_middle, new_middle), prefix):
+            operations.extend(diff(old_item, new_item, f'{path}/{index}'))
+        return operations
+    if len(old_middle) + len(new_middle) >= len(new):
+        return [{'op': 'replace', 'path': path, 'value': new}]
+    operations = [{'op': 'remove', 'path': f'{path}/{index}'} for index in reversed(range(prefix, prefix + len(old_middle)))]
+    operations.extend({'op': 'add', 'path': f'{path}/{index}', 'value': item} for index, item in enumerate(new_middle, prefix))
+    return operations
+
+
+def patch(document, operations):
+    """Apply operations produced by `diff` to `document` in place and return it."""
+    for operation in operations:
+        if not operation['path']:
+            document = copy_state(operation['value'])
+            continue
+        *parents, last = map(_unescape, operation['path'][1:].split('/'))
+        target = document
+        for token in parents:
+            target = target[int(token)] if isinstance(target, list) else target[token]
+        if isinstance(target, list):
+            last = len(target) if last == '-' else int(last)
+        if operation['op'] == 'remove':
+            del target[last]
+        elif operation['op'] == 'add' and isinstance(target, list):
+            target.insert(last, copy_state(operation['value']))
+        else:
+            target[last] = copy_state(operation['value'])
+    return document
@@ -0,0 +1,59 @@
+import os
+
+from flask import Blueprint, Response, current_app, render_template, request
+
+from .db import db
+from .fragments import create_store
+from .models import Game
+
+bp = Blueprint('spectator', __name__, url_prefix='/spectate')
+
+
+def init_app(app):
+    app.config.setdefault('SPECTATOR_CACHE_SIZE', int(os.environ.get('WARGAME_SPECTATOR_CACHE_SIZE', 64)))
+    app.config.setdefault('SPECTATOR_MAX_AGE', int(os.environ.get('WARGAME_SPECTATOR_MAX_AGE', 2)))
+    app.config.setdefault('SPECTATOR_POLL_INTERVAL', int(os.environ.get('WARGAME_SPECTATOR_POLL_INTERVAL', 3)))
+    if app.config['SPECTATOR_CACHE_SIZE']:
+        # rendered pages are keyed by game and version, so they can share a directory with the fragments
+        app.extensions['wargame_spectator_pages'] = create_store(app, app.config['SPECTATOR_CACHE_SIZE'])
+
+
+def get_page_store():
+    return current_app.extensions.get('wargame_spectator_pages')
+
+
+def stats():
+    store = get_page_store()
+    return store.stats() if store else None
+
+
+def render_page(game_id, version):
+    """The spectator page of a game version, rendered by the first spectator to ask for it and cached for the rest."""
+    store = get_page_store()
+    if store is not None and (page := store.get(f'spectate:{game_id}:{version}')) is not None:
+        return version, page
+    game = Game.load(game_id, players=True)
+    page = render_template('spectate.html', context=game, poll_interval=current_app.config['SPECTATOR_POLL_INTERVAL'])
+    if store is not None:
+        store.put(f'spectate:{game_id}:{game.version}', page)
+    return game.version, page
+
+
+@bp.route('/<token>')
+def board(token):
+    """The read-only board for spectators and projectors, reachable by anyone who has the game's spectator link.
+
+    Every spectator gets the same page for a version of the game, so it is rendered once and answered with a
+    strong ETag - unchanged boards cost a single indexed query and a 304, and `Cache-Control: public` lets a
+    proxy in front of the app absorb the polls entirely.
+    """
+    game_id, version = db.session.query(Game.id, Game.version).filter_by(spectator_token=token).first_or_404()
+    if request.if_none_match.contains(f'{game_id}-{version}'):
+        response = Response(status=304)
+    else:
+        version, page = render_page(game_id, version)
+        response = Response(page)
+    response.set_etag(f'{game_id}-{version}')
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['SPECTATOR_MAX_AGE']
+    return response
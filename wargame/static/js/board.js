@@ -11,21 +11,22 @@ const resizeBackground = () => {
   background.width = boardRect.width;
 };
 
-const addClassToTargetOnHover = (selector, className) => {
-  const selected = document.querySelectorAll(selector);
+// The target is looked up on every event, as cards are swapped out when the entities the user gives orders to change
+const addClassToTargetOnHover = (selector, className, root = document) => {
+  const selected = root.querySelectorAll(selector);
+  const target = source => document.getElementById(source.attributes.target.value);
   selected.forEach(source => {
-    const target = document.getElementById(source.attributes.target.value);
     source.addEventListener('mouseenter', () => {
-      target.classList.add(className);
+      target(source).classList.add(className);
     });
     source.addEventListener('mouseleave', () => {
-      target.classList.remove(className);
+      target(source).classList.remove(className);
     });
   });
 };
 
-const makeOnlySelectedOptionVisible = () => {
-  const actionRadios = document.querySelectorAll('.entity-actions input[type="radio"]');
+const makeOnlySelectedOptionVisible = (root = document) => {
+  const actionRadios = root.querySelectorAll('.entity-actions input[type="radio"]');
   actionRadios.forEach(radio => {
     const controlledInputs = document.querySelectorAll('.' + radio.id);
     const entityId = radio.parentNode.parentNode.parentNode.parentNode.id;
@@ -38,18 +39,18 @@ const makeOnlySelectedOptionVisible = () => {
   });
 };
 
-const displayRevitalizeCost = () => {
+const displayRevitalizeCost = (root = document) => {
   const costMapping = window.vitality_recovery_cost;
-  const revitalizeInputs = document.querySelectorAll('.revitalize-amount');
+  const revitalizeInputs = root.querySelectorAll('.revitalize-amount');
   revitalizeInputs.forEach(input => input.addEventListener('change', e => {
     const amount = e.target.valueAsNumber;
     input.previousElementSibling.textContent = costMapping[amount];
   }));
 };
 
-const changeMaxTransferValue = () => {
+const changeMaxTransferValue = (root = document) => {
   const inputsByEntity = {};
-  const transferInputs = document.querySelectorAll('[class*=__transfer-input]');
+  const transferInputs = root.querySelectorAll('[class*=__transfer-input]');
   transferInputs.forEach(input => {
     const entityId = input.className.split('__')[0];
     if (inputsByEntity[entityId]) {
@@ -87,12 +88,8 @@ const refreshTime = () => {
     minute: '2-digit',
     second: '2-digit'
   };
-  if (window.waitingForMove) {
-    if (timeLeft.getTime() <= 0) {
-      form.submit();
-    }
-  } else if (timeLeft.getTime() <= -5000) {
-    location.reload();
+  if (window.waitingForMove && timeLeft.getTime() <= 0) {
+    form.submit();
   }
 
   display.textContent = timeLeft.toLocaleTimeString('en-us', options);
@@ -108,48 +105,179 @@ const refreshTime = () => {
 
 const timerManagement = () => {
   refreshTime();
-  setInterval(refreshIfTurnOver, 5000);
-  refreshIfTurnOver();
+  if (window.EventSource) {
+    subscribeToEvents();
+  } else {
+    pollTimeLeft();
+  }
 }
 
-const refreshIfTurnOver = () => {
+const pollTimeLeft = () => {
+  if (!window.pollTimer) {
+    window.pollTimer = setInterval(refreshIfTurnOver, 5000);
+  }
+  refreshIfTurnOver();
+};
+
+const applyTimerState = data => {
   const display = document.getElementById('round-timer');
 
-  fetch(window.timeLeftUrl)
+  window.secondsLeft = data.secondsLeft;
+  window.isStarting = data.isStarting;
+  window.startingDelay = data.startingDelay;
+
+  if (window.isPaused !== data.isPaused) {
+    window.isPaused = data.isPaused;
+    if (window.isPaused) {
+      clearInterval(window.refreshTimeTimer);
+      delete window.refreshTimeTimer;
+    }
+    if (window.isStarting) {
+      display.textContent = 'Starting...';
+      setTimeout(refreshTime, window.startingDelay * 1000);
+    }
+
+    if (window.isPaused) {
+      display.textContent = 'Paused';
+    }
+  }
+
+  if (data.turn != window.turn) {
+    refreshState();
+  }
+};
+
+const sameEntities = (first, second) => first.length === second.length && first.every(id => second.includes(id));
+
+const setEntityStat = (entityId, stat, value) => {
+  const labels = {
+    resource: ['.entity-resources', 'Resource - '],
+    vitality: ['.entity-vitality', 'Vitality - '],
+    victory_points: ['.entity-vp', 'VP: '],
+  };
+  if (!labels[stat]) return;
+  const [selector, label] = labels[stat];
+  document.querySelector(`#${entityId} ${selector}`).textContent = label + value;
+};
+
+// Applies a JSON patch of the board to the page, returns false if it touches something that needs a full render
+const patchBoard = operations => operations.every(operation => {
+  const [section, team, entities, entityId, stat, ...rest] = operation.path.split('/').slice(1);
+  if (section !== 'teams') return true;
+  if (!team || !entities) return false;
+  if (entities !== 'entities') return true;
+  if (!stat || ['connections', 'attacks'].includes(stat)) return false;
+  if (!rest.length) setEntityStat(entityId, stat, operation.value);
+  return true;
+});
+
+const renderBoard = board => Object.values(board.teams).forEach(team => {
+  Object.values(team.entities).forEach(entity => {
+    ['resource', 'vitality', 'victory_points'].forEach(stat => setEntityStat(entity.id, stat, entity[stat]));
+  });
+});
+
+const appendNewMessages = () => {
+  const messageList = document.querySelector('#message-log ul');
+  fetch(`${window.logUrl}?after=${messageList.dataset.lastSeq}`)
     .then(resp => resp.json())
     .then(data => {
-      window.secondsLeft = data.secondsLeft;
-      window.isStarting = data.isStarting;
-      window.startingDelay = data.startingDelay;
-
-      if (window.isPaused !== data.isPaused) {
-        window.isPaused = data.isPaused;
-        if (window.isPaused) {
-          clearInterval(window.refreshTimeTimer);
-          delete window.refreshTimeTimer;
-        }
-        if (window.isStarting) {
-          display.textContent = 'Starting...';
-          setTimeout(refreshTime, window.startingDelay * 1000);
-        }
+      data.entries.forEach(entry => {
+        const item = document.createElement('li');
+        item.className = entry.category;
+        item.textContent = entry.message;
+        messageList.insertBefore(item, messageList.firstChild);
+        messageList.dataset.lastSeq = entry.seq;
+      });
+    });
+};
 
-        if (window.isPaused) {
-          display.textContent = 'Paused';
-        }
-      }
+// Swaps in the cards whose active state changed and the order section, rendered by the state API
+const replaceOrderForms = () => {
+  fetch(`${window.stateUrl}?forms=1`)
+    .then(resp => resp.json())
+    .then(state => {
+      const changed = Object.keys(state.forms.cards).filter(id =>
+        window.activeEntities.includes(id) !== state.viewer.activeEntities.includes(id));
+      const orders = document.getElementById('orders');
+      orders.innerHTML = state.forms.orders;
+      bindOrderForms(orders);
+      changed.forEach(id => {
+        const template = document.createElement('template');
+        template.innerHTML = state.forms.cards[id].trim();
+        const card = template.content.firstElementChild;
+        document.getElementById(id).replaceWith(card);
+        bindOrderForms(card);
+      });
+      window.activeEntities = state.viewer.activeEntities;
+      positionArrows();
+    });
+};
 
-      if (data.turn != window.turn) {
+const refreshState = () => {
+  fetch(`${window.stateUrl}?since=${window.stateVersion}`)
+    .then(resp => resp.json())
+    .then(state => {
+      if (state.victor) {
         location.reload();
+        return;
+      }
+      if (!sameEntities(window.activeEntities, state.viewer.activeEntities)) {
+        replaceOrderForms();
       }
+      if (state.board) {
+        renderBoard(state.board);
+      } else if (!patchBoard(state.patch)) {
+        location.reload();
+        return;
+      }
+
+      const month = document.querySelector('.game-info .month');
+      month.textContent = state.month;
+      month.className = `month ${state.currentTeam}`;
+      document.querySelector('.team-vps').textContent =
+        `Victory Points - Russia: ${state.victoryPoints.red} - UK: ${state.victoryPoints.blue}`;
+      document.getElementById('turn').value = state.turn;
+      window.turn = state.turn;
+      window.stateVersion = state.version;
+      window.waitingForMove = state.viewer.waitingForMove;
+      appendNewMessages();
+      showOdds();
     });
 };
 
-const handleAssetsDialog = () => {
-  const showButton = document.getElementById('open-assets');
-  const assetsDialog = document.getElementById('assets');
-  const closeDialog = document.getElementById('close-assets');
-  const useButtons = document.querySelectorAll('.use-asset-btn');
-  const activatedAssets = document.getElementById('activated-assets');
+const refreshIfTurnOver = () => {
+  fetch(window.timeLeftUrl)
+    .then(resp => resp.json())
+    .then(applyTimerState);
+};
+
+const subscribeToEvents = () => {
+  const source = new EventSource(window.eventsUrl);
+  const onTimerEvent = e => applyTimerState(JSON.parse(e.data));
+
+  source.addEventListener('pause', onTimerEvent);
+  source.addEventListener('unpause', onTimerEvent);
+  source.addEventListener('turn', onTimerEvent);
+  source.addEventListener('game-over', () => location.reload());
+  source.addEventListener('open', () => {
+    clearInterval(window.pollTimer);
+    delete window.pollTimer;
+    refreshIfTurnOver();
+  });
+  source.addEventListener('error', () => {
+    if (source.readyState === EventSource.CLOSED) {
+      pollTimeLeft();
+    }
+  });
+};
+
+const handleAssetsDialog = (root = document) => {
+  const showButton = root.querySelector('#open-assets');
+  const assetsDialog = root.querySelector('#assets');
+  const closeDialog = root.querySelector('#close-assets');
+  const useButtons = root.querySelectorAll('.use-asset-btn');
+  const activatedAssets = root.querySelector('#activated-assets');
 
   if (!showButton) return;
   showButton.addEventListener('click', () => assetsDialog.showModal());
@@ -168,29 +296,30 @@ const handleAssetsDialog = () => {
   }));
 };
 
-const handleBlackMarket = () => {
-  const scsOpen = document.getElementById('scs__black_market');
-  const gchqOpen = document.getElementById('gchq__black_market');
-  const marketDialog = document.getElementById('black-market');
-  const clearButton = document.getElementById('clear-bm');
-  const submitDialog = document.getElementById('submit-bm');
+// The radios live on the cards and the dialog in the order section, which are swapped out separately
+const handleBlackMarket = (root = document) => {
+  const openers = ['#scs__black_market', '#gchq__black_market'];
+  const marketDialog = root.querySelector('#black-market');
+  const clearButton = root.querySelector('#clear-bm');
+  const submitDialog = root.querySelector('#submit-bm');
 
-  if (!submitDialog) return;
   const openFunction = () => {
-    marketDialog.showModal();
+    document.getElementById('black-market')?.showModal();
   };
-  marketDialog?.addEventListener('close', () => {
-    scsOpen?.parentNode.parentNode.parentNode.parentNode.classList.remove('active');
-    gchqOpen?.parentNode.parentNode.parentNode.parentNode.classList.remove('active');
+  openers.forEach(selector => root.querySelector(selector)?.addEventListener('change', openFunction));
+
+  if (!submitDialog) return;
+  marketDialog.addEventListener('close', () => {
+    openers.forEach(selector => {
+      document.querySelector(selector)?.parentNode.parentNode.parentNode.parentNode.classList.remove('active');
+    });
   });
-  scsOpen?.addEventListener('change', openFunction);
-  gchqOpen?.addEventListener('change', openFunction);
   submitDialog.addEventListener('click', e => {
     marketDialog.close();
     e.preventDefault();
   });
 
-  const bidInputs = Array.from(document.querySelectorAll('.bm-bid'));
+  const bidInputs = Array.from(root.querySelectorAll('.bm-bid'));
   const startingResources = bidInputs ? bidInputs[0].max : 0;
   bidInputs.forEach(input => {
     input.addEventListener('change', e => {
@@ -284,14 +413,59 @@ const showPopup = () => {
   });
 };
 
+const showOdds = () => {
+  const display = document.getElementById('team-odds');
+
+  if (!display) return;
+  fetch(window.oddsUrl)
+    .then(resp => resp.json())
+    .then(data => {
+      const team = display.dataset.team;
+      const chance = Math.round(data.winProbability[team] * 100);
+      const vps = data.victoryPoints[team];
+      display.textContent = `Win chance: ${chance}% - expected VPs: ${vps.p10}-${vps.p90}`;
+    });
+};
+
+const handleOlderMessages = () => {
+  const olderButton = document.getElementById('older-messages');
+  const messageList = document.querySelector('#message-log ul');
+
+  olderButton?.addEventListener('click', () => {
+    fetch(`${window.logUrl}?before=${olderButton.dataset.before}`)
+      .then(resp => resp.json())
+      .then(data => {
+        data.entries.reverse().forEach(entry => {
+          const item = document.createElement('li');
+          item.className = entry.category;
+          item.textContent = entry.message;
+          messageList.appendChild(item);
+        });
+        const oldest = data.entries[data.entries.length - 1];
+        if (!oldest || oldest.seq <= 1) {
+          olderButton.remove();
+        } else {
+          olderButton.dataset.before = oldest.seq;
+        }
+      });
+  });
+};
+
+const bindOrderForms = root => {
+  addClassToTargetOnHover('.attack', 'attack-target', root);
+  addClassToTargetOnHover('.transfer', 'transfer-target', root);
+  makeOnlySelectedOptionVisible(root);
+  displayRevitalizeCost(root);
+  changeMaxTransferValue(root);
+  handleAssetsDialog(root);
+  handleBlackMarket(root);
+};
+
 window.onload = () => {
   setTitle();
   scrollDown();
-  addClassToTargetOnHover('.attack', 'attack-target');
-  addClassToTargetOnHover('.transfer', 'transfer-target');
-  makeOnlySelectedOptionVisible();
-  displayRevitalizeCost();
-  changeMaxTransferValue();
+  window.activeEntities = Array.from(document.querySelectorAll('.card.active')).map(card => card.id);
+  bindOrderForms(document);
   if (!window.victor) {
     timerManagement();
     if (window.isOwner) {
@@ -300,10 +474,10 @@ window.onload = () => {
   } else {
     handleEndScreen();
   }
-  handleAssetsDialog();
-  handleBlackMarket();
   positionArrows();
   showPopup();
+  handleOlderMessages();
+  showOdds();
 };
 
 window.onresize = () => {
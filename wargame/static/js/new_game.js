@@ -13,7 +13,8 @@ const ensurePlayerOnOnlyOneTeam = () => {
       const playersInTeam = Array.from(pickers[thisTeam]).map(p => p.value);
       pickers[otherTeam].forEach(p => {
         for (option of p.children) {
-          if (playersInTeam.includes(option.value)) {
+          // bots can play on both teams
+          if (playersInTeam.includes(option.value) && !option.value.startsWith('bot:')) {
             option.classList.add('hidden-option');
           } else if (option.value !== '') {
             option.classList.remove('hidden-option');
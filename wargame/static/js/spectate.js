@@ -0,0 +1,62 @@
+// Loaded after board.js on the spectator page, reusing its layout helpers.
+
+const spectatorTimerText = board => {
+  if (board.dataset.victor) {
+    return `Team ${board.dataset.victor} won!`;
+  }
+  if (board.dataset.paused === 'true') {
+    return 'Paused';
+  }
+  const now = Date.now() / 1000;
+  const unpauseTime = parseFloat(board.dataset.unpauseTime);
+  if (now < unpauseTime) {
+    return 'Starting...';
+  }
+  const secondsLeft = Math.max(0, Math.round(unpauseTime + parseInt(board.dataset.secondsLeft) - now));
+  return new Date(secondsLeft * 1000).toLocaleTimeString('en-us', {minute: '2-digit', second: '2-digit'});
+};
+
+// The page is the same for every spectator, so the timer is computed here from the turn's deadline
+const refreshSpectatorTimer = () => {
+  const board = document.getElementById('board');
+  const display = document.getElementById('round-timer');
+  const unpauseTime = parseFloat(board.dataset.unpauseTime);
+  const secondsLeft = unpauseTime + parseInt(board.dataset.secondsLeft) - Date.now() / 1000;
+
+  display.textContent = spectatorTimerText(board);
+  display.classList.toggle('time-red', !board.dataset.victor && board.dataset.paused !== 'true' && secondsLeft < 60);
+  display.classList.toggle('time-yellow', !board.dataset.victor && board.dataset.paused !== 'true' && secondsLeft >= 60 && secondsLeft < 120);
+};
+
+const showSpectatorBoard = () => {
+  refreshSpectatorTimer();
+  positionArrows();
+  resizeBackground();
+};
+
+// Revalidates the page against its ETag - unchanged boards are answered with a 304 and nothing is redrawn
+const refreshSpectatorBoard = () => {
+  fetch(window.location.href, {cache: 'no-cache'})
+    .then(resp => {
+      const etag = resp.headers.get('ETag');
+      if (!resp.ok || etag === window.spectatorEtag) {
+        return;
+      }
+      window.spectatorEtag = etag;
+      return resp.text().then(html => {
+        const board = new DOMParser().parseFromString(html, 'text/html').getElementById('board');
+        const current = document.getElementById('board');
+        if (board && board.dataset.version !== current.dataset.version) {
+          current.replaceWith(board);
+          showSpectatorBoard();
+        }
+      });
+    });
+};
+
+window.onload = () => {
+  document.title = 'Wargame: spectating';
+  showSpectatorBoard();
+  setInterval(refreshSpectatorTimer, 1000);
+  setInterval(refreshSpectatorBoard, window.spectatorPollInterval);
+};
@@ -1,9 +1,5 @@
 from datetime import timedelta
-from functools import cache
 from itertools import chain
-from json import load
-from random import choice
-from re import match
 from time import strftime, gmtime
 
 
@@ -70,29 +66,10 @@ class Event:
             entity['resource'] += 1
             entity['vitality'] += 1
 
-    def handle(self):
-        event = choice(self.events())
+    def handle(self, rng):
+        event = rng.choice(self.events())
         getattr(self, event)()
-        return self.descriptions[event]
-
-
-@cache
-def get_initial_board_state():
-    with open('wargame/static/initial_state.json') as f:
-        state = load(f)
-        return state
-
-
-def find_attack_targets(attacker, form):
-    for field in form:
-        if m := match(attacker + r'-([^-]+)__attack', field):
-            yield m.groups()[0], field
-
-
-def find_transfer_targets(source, form):
-    for field in form:
-        if m := match(source + r'-([^-]+)__transfer', field):
-            yield m.groups()[0], field
+        return event
 
 
 attack_result_table = (
@@ -327,17 +304,6 @@ def get_bm_assets(assets):
         yield asset_name, asset_type, asset_effect, required_bid, opposing_bid
 
 
-def get_popup_messages(message_log):
-    last_turn = False
-    for message, category in reversed(message_log):
-        if category == 'turn':
-            if last_turn:
-                return
-            last_turn = True
-        if category == 'attack-damage' and last_turn:
-            yield message
-
-
 def helper_functions():
     return dict(
         turn_to_month=turn_to_month,
@@ -356,5 +322,4 @@ def helper_functions():
         get_player_team=get_player_team,
         get_timer_string=get_timer_string,
         is_entity_active=is_entity_active,
-        get_popup_messages=get_popup_messages,
     )